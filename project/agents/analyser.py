@@ -41,6 +41,29 @@ ANALYSER_PROMPT = (
 )
 
 
+# Одна пара "номер вопроса + (пробелы) + буква a-d"
+ANSWER_PAIR_RE = re.compile(r"(\d+)\s*([a-d])")
+
+# Строка, состоящая ТОЛЬКО из таких пар (через пробелы, запятые, точки с запятой)
+ANSWER_LINE_RE = re.compile(r"(?:\d+\s*[a-d][\s,;]*)+")
+
+
+def clean_answers_text(text: str) -> str:
+    """
+    Строка ответов в виде, который понимают parse_answers и ANSWER_LINE_RE:
+    без запятых и точек с запятой, в нижнем регистре.
+    """
+    return text.replace(",", " ").replace(";", " ").strip().lower()
+
+
+def looks_like_answers(text: str) -> bool:
+    """
+    True, если вся строка — это ответы на тест в формате parse_answers
+    (например '1a 2b 3c 4d 5a'), без посторонних слов.
+    """
+    return ANSWER_LINE_RE.fullmatch(clean_answers_text(text)) is not None
+
+
 def parse_answers(text: str, question_count: int) -> Dict[int, str]:
     """
     Простой парсер ответов.
@@ -52,10 +75,10 @@ def parse_answers(text: str, question_count: int) -> Dict[int, str]:
     - '1 a 2 c 3 d'
     - '1a, 2a, 3d, 4b, 5c'
     """
-    text_clean = text.replace(",", " ").replace(";", " ").strip().lower()
+    text_clean = clean_answers_text(text)
 
     # Ищем все вхождения "число + (пробелы) + буква a-d"
-    matches = re.findall(r"(\d+)\s*([a-d])", text_clean)
+    matches = ANSWER_PAIR_RE.findall(text_clean)
 
     if not matches:
         return {}
@@ -0,0 +1,217 @@
+# agents/batch_grader.py
+#
+# Проверка сразу многих ответов на один тест (например, всей группы в конце четверти).
+#
+# Ответы разбираются той же грамматикой, что и у run_analyser (parse_answers),
+# складываются в матрицу «ученик × вопрос» и проверяются целиком на NumPy.
+# Кроме баллов считается статистика по вопросам: сложность (доля верных),
+# дискриминативность (точечно-бисериальная корреляция с баллом за остальные вопросы)
+# и распределение выбранных вариантов.
+#
+# Запуск:
+#   python -m agents.batch_grader --key exam.json --submissions answers.csv
+#   python -m agents.batch_grader --key exam.json --submissions answers.jsonl --scores scores.csv
+#
+# exam.json — {"1": "A", "2": "C", ...} (или {"answers": {...}}), либо exam.txt — текст экзаменатора;
+# answers.csv — колонки student,answers; answers.jsonl — {"student": ..., "answers": "1a 2b ..."}.
+
+
+import argparse
+import csv
+import json
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from agents.analyser import clean_answers_text
+from utils.exam import parse_exam
+
+
+OPTIONS = "ABCD"
+
+# Код «нет ответа» в матрице ответов
+NO_ANSWER = -1
+
+
+# Разбор всех ответов одним проходом регулярки: строки склеиваются через \x00
+# (его не ловит ни \d, ни \s, так что пара не может перейти через границу строки),
+# номер строки — число разделителей перед парой
+_SEPARATOR = "\x00"
+_BATCH_RE = re.compile(r"\x00|\d+\s*[a-d]")   # та же пара, что ANSWER_PAIR_RE, без групп
+
+
+def answer_matrix(submissions: Sequence[str], question_count: int) -> np.ndarray:
+    """
+    Матрица (ученики × вопросы) с номерами вариантов 0..3 (A..D), NO_ANSWER — пропуск.
+    Разбор — как в parse_answers: пары «номер + буква», номера вне теста игнорируются,
+    при повторе номера побеждает последний ответ.
+    """
+    matrix = np.full((len(submissions), question_count), NO_ANSWER, dtype=np.int8)
+    joined = clean_answers_text(_SEPARATOR.join(s.replace(_SEPARATOR, " ") for s in submissions))
+    tokens = _BATCH_RE.findall(joined)
+
+    is_pair = np.fromiter((t != _SEPARATOR for t in tokens), dtype=bool, count=len(tokens))
+    rows = np.cumsum(~is_pair)[is_pair]
+    pairs = [t for t in tokens if t != _SEPARATOR]
+    if not pairs:
+        return matrix
+
+    # пара — «номер, пробелы, буква»: int() сам отбрасывает пробелы после номера
+    qids = np.fromiter((int(t[:-1]) for t in pairs), dtype=np.int64, count=len(pairs)) - 1
+    answers = np.frombuffer("".join(t[-1] for t in pairs).encode("ascii"), dtype=np.uint8)
+    answers = answers.astype(np.int8) - ord("a")
+
+    inside = (qids >= 0) & (qids < question_count)
+    # при повторяющихся индексах NumPy оставляет последнее присваивание
+    matrix[rows[inside], qids[inside]] = answers[inside]
+    return matrix
+
+
+def key_vector(correct_answers: Dict[int, str]) -> np.ndarray:
+    """
+    Правильные ответы {номер: буква} → вектор номеров вариантов длиной в число вопросов.
+    """
+    total = len(correct_answers)
+    key = np.full(total, NO_ANSWER, dtype=np.int8)
+    for qid, letter in correct_answers.items():
+        letter = letter.upper()
+        if 1 <= qid <= total and letter in OPTIONS:
+            key[qid - 1] = OPTIONS.index(letter)
+    return key
+
+
+def _columnwise_corr(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Корреляция Пирсона между одноимёнными столбцами x и y; nan, если столбец постоянный.
+    """
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    denom = np.sqrt((x ** 2).sum(axis=0) * (y ** 2).sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denom > 0, (x * y).sum(axis=0) / denom, np.nan)
+
+
+def grade_batch(correct_answers: Dict[int, str], submissions: Sequence[str]) -> Dict:
+    """
+    Проверяет все ответы на один тест.
+
+    Возвращает словарь:
+      - scores: число правильных у каждого ученика (в порядке submissions)
+      - total: всего вопросов
+      - percent: процент правильных у каждого ученика
+      - parsed: распознан ли у ученика хоть один ответ
+      - difficulty: доля верных ответов на каждый вопрос
+      - discrimination: точечно-бисериальная корреляция верности вопроса
+        с баллом за остальные вопросы (nan, если её не посчитать)
+      - options: (вопросы × 5) — сколько раз выбран A, B, C, D и сколько пропусков
+    """
+    total = len(correct_answers)
+    key = key_vector(correct_answers)
+    matrix = answer_matrix(submissions, total)
+
+    correct = (matrix == key) & (key != NO_ANSWER)
+    scores = correct.sum(axis=1)
+    parsed = (matrix != NO_ANSWER).any(axis=1)
+
+    n = len(submissions)
+    difficulty = correct.mean(axis=0) if n else np.zeros(total)
+
+    # балл за остальные вопросы, чтобы вопрос не коррелировал сам с собой
+    correct_f = correct.astype(np.float64)
+    rest = scores[:, None] - correct_f
+    discrimination = _columnwise_corr(correct_f, rest) if n > 1 else np.full(total, np.nan)
+
+    # распределение вариантов: сдвигаем коды на 1 (пропуск → 0) и считаем bincount по каждому столбцу
+    offsets = np.arange(total) * (len(OPTIONS) + 1)
+    codes = (matrix.astype(np.int64) + 1) + offsets
+    options = np.bincount(codes.ravel(), minlength=total * (len(OPTIONS) + 1))
+    options = options.reshape(total, len(OPTIONS) + 1)
+    # порядок столбцов: A, B, C, D, пропуск
+    options = np.roll(options, -1, axis=1)
+
+    return {
+        "scores": scores,
+        "total": total,
+        "percent": (scores * 100 // total) if total else np.zeros(n, dtype=np.int64),
+        "parsed": parsed,
+        "difficulty": difficulty,
+        "discrimination": discrimination,
+        "options": options,
+    }
+
+
+def load_key(path: str) -> Dict[int, str]:
+    """
+    Правильные ответы из JSON ({номер: буква} или {"answers": ...})
+    либо из сохранённого текста экзаменатора (.txt).
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".txt"):
+            return parse_exam(f.read()).answers_dict
+        data = json.load(f)
+    if "answers" in data:
+        data = data["answers"]
+    return {int(k): v for k, v in data.items()}
+
+
+def load_submissions(path: str) -> Tuple[List[str], List[str]]:
+    """
+    (ученики, строки ответов) из CSV (student,answers) или JSONL ({"student", "answers"}).
+    """
+    students, answers = [], []
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                students.append(str(record.get("student", len(students) + 1)))
+                answers.append(record.get("answers", ""))
+        else:
+            for record in csv.DictReader(f):
+                students.append(record.get("student") or str(len(students) + 1))
+                answers.append(record.get("answers") or "")
+    return students, answers
+
+
+def format_item_report(report: Dict) -> str:
+    lines = ["Вопрос  Верно  Дискр.   " + "  ".join(f"{o:>5}" for o in OPTIONS) + "  Пропуск"]
+    for i in range(report["total"]):
+        disc = report["discrimination"][i]
+        disc_text = "   —  " if np.isnan(disc) else f"{disc:+.2f} "
+        counts = "  ".join(f"{c:>5}" for c in report["options"][i][:len(OPTIONS)])
+        lines.append(
+            f"{i + 1:>6}  {report['difficulty'][i] * 100:>4.0f}%  {disc_text}  {counts}  {report['options'][i][-1]:>7}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка ответов всей группы на один тест.")
+    parser.add_argument("--key", required=True, help="правильные ответы: JSON {номер: буква} или текст теста экзаменатора (.txt)")
+    parser.add_argument("--submissions", required=True, help="CSV (student,answers) или JSONL")
+    parser.add_argument("--scores", help="куда сохранить баллы учеников (CSV)")
+    args = parser.parse_args(argv)
+
+    correct_answers = load_key(args.key)
+    students, answers = load_submissions(args.submissions)
+    report = grade_batch(correct_answers, answers)
+
+    n = len(students)
+    print(f"Учеников: {n}, вопросов: {report['total']}, не распознано: {int((~report['parsed']).sum())}")
+    if n:
+        print(f"Средний балл: {report['scores'].mean():.2f}/{report['total']}")
+    print(format_item_report(report))
+
+    if args.scores:
+        with open(args.scores, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["student", "score", "total", "percent"])
+            for student, score, percent in zip(students, report["scores"], report["percent"]):
+                writer.writerow([student, int(score), report["total"], int(percent)])
+
+
+if __name__ == "__main__":
+    main()
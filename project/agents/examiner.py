@@ -1,6 +1,8 @@
 # agents/examiner.py
 
-from gigachat_api import chat_with_gigachat
+from gigachat_api import GigaChatClient, AsyncGigaChatClient, chat_with_gigachat, chat_with_gigachat_async
+from structured_output import request_structured, request_structured_async
+from utils.exam import EXAM_QUESTIONS, Exam, exam_from_json
 
 EXAMINER_PROMPT = (
     "Ты — экзаменатор. Твоя задача — создать тест по заданной теме.\n"
@@ -34,20 +36,100 @@ EXAMINER_PROMPT = (
    
 )
 
-def run_examiner(access_token: str, topic: str) -> str:
-    """
-    Агент-тестировщик.
-    Добавляет к сообщению пользователя инструкцию, что модель — Examiner.
-    """
-    prompt = (
+def _examiner_prompt(topic: str) -> str:
+    return (
         EXAMINER_PROMPT
         + f"\n\nТема теста: {topic}\n"
         "Количество вопросов: 5"
     )
 
 
+# Структурированный режим: тест приходит аргументами функции make_exam (JSON по схеме)
+EXAMINER_JSON_PROMPT = (
+    "Ты — экзаменатор. Твоя задача — создать тест по заданной теме и передать его функции make_exam.\n"
+    "\n"
+    "Требования:\n"
+    f"- ВСЕГДА генерируй ровно {EXAM_QUESTIONS} вопросов.\n"
+    "- У каждого вопроса ровно 4 варианта ответа (A, B, C, D по порядку) и поле answer — буква правильного.\n"
+    "- Варианты не должны подсказывать правильный ответ.\n"
+    "- theme — короткое название темы на том же языке, что и запрос.\n"
+)
+
+EXAM_FUNCTION = {
+    "name": "make_exam",
+    "description": "Сохраняет тест по теме: тема, вопросы с вариантами A–D и правильные ответы.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "theme": {"type": "string", "description": "Краткое название темы"},
+            "questions": {
+                "type": "array",
+                "minItems": EXAM_QUESTIONS,
+                "maxItems": EXAM_QUESTIONS,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string", "description": "Текст вопроса"},
+                        "options": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "minItems": 4,
+                            "maxItems": 4,
+                            "description": "Варианты A, B, C, D по порядку",
+                        },
+                        "answer": {"type": "string", "enum": ["A", "B", "C", "D"]},
+                    },
+                    "required": ["text", "options", "answer"],
+                },
+            },
+        },
+        "required": ["theme", "questions"],
+    },
+}
+
+
+def _examiner_messages(topic: str) -> list:
+    return [
+        {"role": "system", "content": EXAMINER_JSON_PROMPT},
+        {"role": "user", "content": f"Тема теста: {topic}"},
+    ]
+
+
+def run_examiner(client: GigaChatClient, topic: str) -> str:
+    """
+    Агент-тестировщик.
+    Добавляет к сообщению пользователя инструкцию, что модель — Examiner.
+    """
     # Используем уже существующую функцию из gigachat_api
-    return chat_with_gigachat(access_token, prompt)
+    return chat_with_gigachat(client, _examiner_prompt(topic), agent="examiner")
+
+
+async def run_examiner_async(client: AsyncGigaChatClient, topic: str, agent: str = "examiner") -> str:
+    """
+    Асинхронный вариант run_examiner.
+    """
+    return await chat_with_gigachat_async(client, _examiner_prompt(topic), agent=agent)
+
+
+def run_examiner_structured(client: GigaChatClient, topic: str) -> Exam:
+    """
+    Тест по теме в структурированном режиме (JSON через function_call).
+    Если модель так и не выдала годный тест — StructuredOutputError.
+    Одновременные запросы теста по одной теме (вся группа разом) склеиваются в один.
+    """
+    return request_structured(
+        client, _examiner_messages(topic), EXAM_FUNCTION, exam_from_json, coalesce=True, agent="examiner"
+    )
+
+
+async def run_examiner_structured_async(client: AsyncGigaChatClient, topic: str, agent: str = "examiner") -> Exam:
+    """
+    Асинхронный вариант run_examiner_structured.
+    agent="prefetch" — фоновая генерация, идёт в очереди после запросов учеников.
+    """
+    return await request_structured_async(
+        client, _examiner_messages(topic), EXAM_FUNCTION, exam_from_json, coalesce=True, agent=agent
+    )
  
  
  
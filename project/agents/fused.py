@@ -0,0 +1,119 @@
+# agents/fused.py
+
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gigachat_api import GigaChatClient, AsyncGigaChatClient
+from agents.moderator import MODERATOR_RULES, parse_moderator_answer
+from agents.tutor import TUTOR_PROMPT, build_tutor_messages, remember_turn
+from agents.tutor_memory import compact_history, schedule_compaction
+
+
+# Один запрос вместо двух: модель сначала выбирает агента (как Moderator),
+# и если это Tutor — сразу же отвечает на вопрос.
+FUSED_PROMPT = MODERATOR_RULES + (
+    "ФОРМАТ ОТВЕТА:\n"
+    "Первая строка ответа ВСЕГДА имеет вид 'ROUTE: X Y', где\n"
+    "X — агент (1, 2, 3 или 4), Y — флаг изменения темы (1 — обновить topic, 0 — оставить).\n"
+    "- Если X = 1 (Tutor), то со следующей строки сразу дай ответ ученику как репетитор (правила ниже).\n"
+    "- Если X = 2, 3 или 4, после строки ROUTE больше НИЧЕГО не пиши.\n"
+    "\n"
+    "Примеры:\n"
+    "Вопрос: 'Сделай тест по производным' → ответ: 'ROUTE: 2 1'\n"
+    "Вопрос: 'Разбери мои ошибки в последнем тесте' → ответ: 'ROUTE: 3 0'\n"
+    "Вопрос: 'Я не понимаю, что такое интеграл, объясни по шагам' → ответ: 'ROUTE: 4 1'\n"
+    "Вопрос: 'Расскажи про планеты Солнечной системы' → ответ:\n"
+    "'ROUTE: 1 1\n"
+    "<объяснение про планеты>'\n"
+    "\n"
+    "ПРАВИЛА ДЛЯ ОТВЕТА TUTOR-А (только если X = 1):\n"
+    + TUTOR_PROMPT
+)
+
+ROUTE_RE = re.compile(r"^\s*ROUTE:\s*(\d)\s+(\d)\s*$", re.IGNORECASE)
+
+
+def _split_route(raw_answer: str) -> Tuple[Tuple[int, int], str]:
+    """
+    'ROUTE: 1 1\\n<ответ>' → ((1, 1), '<ответ>').
+    Если строки ROUTE нет — разбираем первую строку как ответ модератора.
+    """
+    first_line, _, rest = raw_answer.strip().partition("\n")
+    match = ROUTE_RE.match(first_line)
+    if match:
+        decision = parse_moderator_answer(f"{match.group(1)} {match.group(2)}")
+    else:
+        decision = parse_moderator_answer(first_line)
+    return decision, rest.strip()
+
+
+def run_fused(
+    client: GigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+) -> Tuple[int, int, Optional[str]]:
+    """
+    Маршрутизация и ответ Tutor-а одним запросом.
+    Возвращает (agent_id, change_topic_flag, answer); answer не None только для Tutor-а,
+    и тогда ход уже записан в history.
+    """
+    raw_answer = client.chat(build_tutor_messages(user_message, history, FUSED_PROMPT), agent="fused")
+    (agent_id, change_flag), answer = _split_route(raw_answer)
+
+    if agent_id != 1 or not answer:
+        return agent_id, change_flag, None
+
+    remember_turn(history, user_message, answer)
+    compact_history(client, history)
+    return agent_id, change_flag, answer
+
+
+async def run_fused_async(
+    client: AsyncGigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Tuple[int, int, Optional[str]]:
+    """
+    Асинхронный вариант run_fused.
+    Если передан on_delta, ответ читается потоком: строка ROUTE копится в буфере,
+    а текст Tutor-а после неё сразу отдаётся в on_delta.
+    """
+    messages = build_tutor_messages(user_message, history, FUSED_PROMPT)
+
+    if on_delta is None:
+        raw_answer = await client.chat(messages, agent="fused")
+        (agent_id, change_flag), answer = _split_route(raw_answer)
+    else:
+        buffer = ""
+        decision = None
+        parts: List[str] = []
+        stream = client.astream(messages, agent="fused")
+        try:
+            async for delta in stream:
+                if decision is None:
+                    buffer += delta
+                    if "\n" not in buffer.lstrip():
+                        continue
+                    decision, _ = _split_route(buffer)
+                    if decision[0] != 1:
+                        break  # не Tutor — дальше читать незачем
+                    delta = buffer.lstrip().partition("\n")[2].lstrip("\n")
+                    if not delta:
+                        continue
+                parts.append(delta)
+                on_delta(delta)
+        finally:
+            await stream.aclose()
+
+        if decision is None:
+            decision, _ = _split_route(buffer)
+        agent_id, change_flag = decision
+        answer = "".join(parts).strip()
+
+    if agent_id != 1 or not answer:
+        return agent_id, change_flag, None
+
+    remember_turn(history, user_message, answer)
+    schedule_compaction(client, history)
+    return agent_id, change_flag, answer
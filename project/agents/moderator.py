@@ -1,9 +1,19 @@
 # agents/moderator.py
 
-from typing import Tuple
-from gigachat_api import chat_with_gigachat_messages
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from gigachat_api import (
+    GigaChatClient,
+    AsyncGigaChatClient,
+    chat_with_gigachat_messages,
+    chat_with_gigachat_messages_async,
+)
 
-MODERATOR_PROMPT = (
+# Общая часть: агенты и правила маршрутизации (её же использует agents/fused.py)
+MODERATOR_RULES = (
     "Ты — Moderator, маршрутизатор запросов пользователя между несколькими агентами.\n"
     "\n"
     "У тебя есть 4 агента:\n"
@@ -36,6 +46,9 @@ MODERATOR_PROMPT = (
     "- Любая фраза вида 'тест по <тема>' или 'test about <topic>' — это НОВАЯ тема, ставь второе число 1.\n"
     "- Фразы 'по этой теме', 'on this topic', 'about it' — использовать существующую тему, второе число 0.\n"
     "\n"
+)
+
+MODERATOR_PROMPT = MODERATOR_RULES + (
     "ФОРМАТ ОТВЕТА:\n"
     "Ответь СТРОГО двумя числами через пробел, БЕЗ дополнительных слов, комментариев и символов.\n"
     "Первое число — агент (1, 2, 3 или 4).\n"
@@ -60,19 +73,45 @@ MODERATOR_PROMPT = (
 )
 
 
-def run_moderator(access_token: str, user_message: str) -> Tuple[int, int]:
-    """
-    Вызывает модератора и возвращает (agent_id, change_topic_flag).
-    agent_id: 1=Tutor, 2=Examiner, 3=Analyzer, 4=Problem Solver
-    change_topic_flag: 1=обновить тему, 0=оставить.
-    """
-    prompt = [
+# Если задан путь — каждое решение о маршруте дописывается туда в JSONL
+# (из этих логов обучается agents/route_classifier.py). source — кто решил:
+# moderator, fused или правило FastRouter (answers, test_request, classifier, ...)
+MODERATOR_LOG_PATH = os.getenv("LUMIRA_MODERATOR_LOG")
+_log_lock = threading.Lock()
+
+
+def log_decision(
+    user_message: str,
+    decision: Tuple[int, int],
+    source: str = "moderator",
+    raw_answer: Optional[str] = None,
+) -> None:
+    if not MODERATOR_LOG_PATH:
+        return
+    record = {
+        "ts": time.time(),
+        "text": user_message,
+        "raw": raw_answer,
+        "agent_id": decision[0],
+        "change_topic": decision[1],
+        "source": source,
+    }
+    with _log_lock:
+        with open(MODERATOR_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _moderator_messages(user_message: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": MODERATOR_PROMPT},
         {"role": "user", "content": user_message},
     ]
 
-    raw_answer = chat_with_gigachat_messages(access_token, prompt)
 
+def parse_moderator_answer(raw_answer: str) -> Tuple[int, int]:
+    """
+    Разбирает ответ модератора "X Y" в (agent_id, change_topic_flag).
+    """
     # Ожидаем формат "X Y"
     parts = raw_answer.strip().split()
     try:
@@ -92,3 +131,30 @@ def run_moderator(access_token: str, user_message: str) -> Tuple[int, int]:
         change_flag = 0
 
     return agent_id, change_flag
+
+
+def run_moderator(client: GigaChatClient, user_message: str) -> Tuple[int, int]:
+    """
+    Вызывает модератора и возвращает (agent_id, change_topic_flag).
+    agent_id: 1=Tutor, 2=Examiner, 3=Analyzer, 4=Problem Solver
+    change_topic_flag: 1=обновить тему, 0=оставить.
+    """
+    # решение зависит только от текста реплики — одинаковые одновременные запросы склеиваем
+    raw_answer = chat_with_gigachat_messages(
+        client, _moderator_messages(user_message), coalesce=True, agent="moderator"
+    )
+    decision = parse_moderator_answer(raw_answer)
+    log_decision(user_message, decision, raw_answer=raw_answer)
+    return decision
+
+
+async def run_moderator_async(client: AsyncGigaChatClient, user_message: str) -> Tuple[int, int]:
+    """
+    Асинхронный вариант run_moderator.
+    """
+    raw_answer = await chat_with_gigachat_messages_async(
+        client, _moderator_messages(user_message), coalesce=True, agent="moderator"
+    )
+    decision = parse_moderator_answer(raw_answer)
+    log_decision(user_message, decision, raw_answer=raw_answer)
+    return decision
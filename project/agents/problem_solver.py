@@ -1,9 +1,18 @@
 # agents/problem_solver.py
 
-from typing import Dict, List, Tuple
-import json
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import os
 
-from gigachat_api import chat_with_gigachat_messages
+from gigachat_api import (
+    GigaChatClient,
+    AsyncGigaChatClient,
+    chat_with_gigachat_messages,
+    chat_with_gigachat_messages_async,
+)
+import metrics
+from structured_output import StructuredOutputError, request_structured, request_structured_async
 
 
 PROBLEM_SOLVER_PROMPT = (
@@ -11,7 +20,7 @@ PROBLEM_SOLVER_PROMPT = (
     "\n"
     "Твоя задача: разбить сложную тему на 3 коротких логичных шага и объяснить каждый шаг простым языком.\n"
     "\n"
-    "Формат ответа ДОЛЖЕН быть строго таким (JSON):\n"
+    "Передай шаги функции explain_steps. Формат ДОЛЖЕН быть строго таким (JSON):\n"
     "{\n"
     "  \"steps\": [\n"
     "    \"Короткое объяснение шага 1\",\n"
@@ -27,35 +36,101 @@ PROBLEM_SOLVER_PROMPT = (
 )
 
 
-def _generate_steps(access_token: str, user_question: str) -> List[str]:
+# Упрощённый вариант текущего шага готовится заранее, пока ученик его читает,
+# чтобы ответ "нет" обрабатывался мгновенно. Ограничиваем число параллельных генераций.
+SIMPLIFY_WORKERS = int(os.getenv("LUMIRA_SIMPLIFY_WORKERS", "4"))
+_simplify_pool = ThreadPoolExecutor(max_workers=SIMPLIFY_WORKERS, thread_name_prefix="simplify")
+_simplify_slots = None  # asyncio.Semaphore, создаётся в event loop при первом использовании
+
+YES_WORDS = {"yes", "y", "да", "ага", "понял", "поняла", "понял.", "поняла."}
+NO_WORDS = {"no", "n", "нет", "неа", "не", "не понял", "не поняла"}
+
+
+def is_yes_no(user_reply: str) -> bool:
     """
-    Запрашивает у GigaChat план из 3 шагов и возвращает список строк.
+    True, если реплика — это ответ "да/нет" на вопрос "Понятно ли это?".
     """
-    messages = [
+    normalized = user_reply.strip().lower()
+    return normalized in YES_WORDS or normalized in NO_WORDS
+
+
+def _steps_messages(user_question: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": PROBLEM_SOLVER_PROMPT},
         {"role": "user", "content": user_question},
     ]
 
-    raw_answer = chat_with_gigachat_messages(access_token, messages)
 
-    # Пытаемся распарсить JSON
+STEPS_FUNCTION = {
+    "name": "explain_steps",
+    "description": "Пошаговое объяснение темы: 3 коротких шага по порядку.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "steps": {
+                "type": "array",
+                "items": {"type": "string"},
+                "minItems": 1,
+                "maxItems": 3,
+                "description": "Короткие объяснения шагов по порядку",
+            },
+        },
+        "required": ["steps"],
+    },
+}
+
+
+def _parse_steps(data) -> List[str]:
+    """
+    Проверка аргументов explain_steps: непустой список непустых строк.
+    """
+    steps = data.get("steps") if isinstance(data, dict) else None
+    if not isinstance(steps, list):
+        raise ValueError("нет списка steps")
+    steps = [str(s).strip() for s in steps if str(s).strip()]
+    if not steps:
+        raise ValueError("список steps пуст")
+    # Берём максимум 3 шага
+    return steps[:3]
+
+
+STEPS_ERROR = "Ошибка: не удалось разбить тему на шаги. Попробуй переформулировать вопрос."
+
+
+def _steps_failed(error: StructuredOutputError) -> None:
+    # модель так и не дала годный JSON: ученику — явная ошибка, сырой ответ — только
+    # в трассу реплики (счётчик — в structured_stats как failed)
+    metrics.annotate(problem_solver_error=str(error), problem_solver_raw=error.raw[:500])
+
+
+def _generate_steps(client: GigaChatClient, user_question: str) -> Optional[List[str]]:
+    """
+    Запрашивает у GigaChat план из 3 шагов и возвращает список строк
+    (None — модель так и не дала план).
+    """
     try:
-        data = json.loads(raw_answer)
-        steps = data.get("steps", [])
-        if isinstance(steps, list) and len(steps) >= 1:
-            # Берём максимум 3 шага
-            return [str(s) for s in steps[:3]]
-    except Exception:
-        pass
+        return request_structured(
+            client, _steps_messages(user_question), STEPS_FUNCTION, _parse_steps, agent="problem_solver_steps"
+        )
+    except StructuredOutputError as e:
+        _steps_failed(e)
+        return None
 
-    # Фолбэк: если модель не дала JSON — всё равно отдаём один шаг
-    return [raw_answer.strip()]
 
-def _simplify_step(access_token: str, topic: str, current_explanation: str) -> str:
+async def _generate_steps_async(client: AsyncGigaChatClient, user_question: str) -> Optional[List[str]]:
     """
-    Просим модель объяснить тот же шаг проще, другими словами.
+    Асинхронный вариант _generate_steps.
     """
+    try:
+        return await request_structured_async(
+            client, _steps_messages(user_question), STEPS_FUNCTION, _parse_steps, agent="problem_solver_steps"
+        )
+    except StructuredOutputError as e:
+        _steps_failed(e)
+        return None
 
+
+def _simplify_messages(topic: str, current_explanation: str) -> List[Dict[str, str]]:
     system_prompt = (
         "Ты помогаешь разобрать сложный материал по шагам.\n"
         "Тебе дают один шаг объяснения, и ты должен объяснить ТО ЖЕ самое, "
@@ -69,22 +144,154 @@ def _simplify_step(access_token: str, topic: str, current_explanation: str) -> s
         "Переформулируй этот шаг проще и понятнее, чтобы было легче понять."
     )
 
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_content},
     ]
 
-    new_text = chat_with_gigachat_messages(access_token, messages)
+
+def _simplify_step(
+    client: GigaChatClient, topic: str, current_explanation: str, agent: str = "problem_solver_simplify"
+) -> str:
+    """
+    Просим модель объяснить тот же шаг проще, другими словами.
+    """
+    new_text = chat_with_gigachat_messages(client, _simplify_messages(topic, current_explanation), agent=agent)
     return new_text.strip()
 
 
-def start_problem_solver(access_token: str, user_question: str) -> Tuple[str, Dict]:
+async def _simplify_step_async(
+    client: AsyncGigaChatClient, topic: str, current_explanation: str, agent: str = "problem_solver_simplify"
+) -> str:
     """
-    Старт Problem Solver-а:
-    - запрашивает у модели 3 шага,
-    - возвращает текст для пользователя и состояние problem_solver.
+    Асинхронный вариант _simplify_step.
     """
-    steps = _generate_steps(access_token, user_question)
+    new_text = await chat_with_gigachat_messages_async(
+        client, _simplify_messages(topic, current_explanation), agent=agent
+    )
+    return new_text.strip()
+
+
+def _drop_prefetch(problem_state: Dict) -> None:
+    prefetch = problem_state.pop("prefetch", None)
+    if prefetch is not None:
+        prefetch["future"].cancel()
+
+
+def _prefetch_matches(problem_state: Dict, prefetch: Optional[Dict]) -> bool:
+    """
+    Заготовка относится к текущему шагу и к его текущему тексту.
+    """
+    if prefetch is None or not problem_state.get("active"):
+        return False
+    steps = problem_state.get("steps", [])
+    current_step = problem_state.get("current_step", 0)
+    return (
+        prefetch["step"] == current_step
+        and 0 <= current_step < len(steps)
+        and prefetch["source"] == steps[current_step]
+    )
+
+
+def _prefetch_simplify(client: GigaChatClient, problem_state: Dict) -> None:
+    """
+    В фоне (пул потоков) готовит упрощённый вариант текущего шага.
+    Старая заготовка для другого шага отменяется.
+    """
+    if _prefetch_matches(problem_state, problem_state.get("prefetch")):
+        return
+    _drop_prefetch(problem_state)
+    if not problem_state.get("active"):
+        return
+
+    current_step = problem_state.get("current_step", 0)
+    steps = problem_state.get("steps", [])
+    if not 0 <= current_step < len(steps):
+        return
+
+    source = steps[current_step]
+    # заготовка ещё может не понадобиться — пропускаем вперёд запросы учеников
+    future = _simplify_pool.submit(_simplify_step, client, problem_state.get("topic", ""), source, "prefetch")
+    problem_state["prefetch"] = {"step": current_step, "source": source, "future": future}
+
+
+def _prefetch_simplify_async(client: AsyncGigaChatClient, problem_state: Dict) -> None:
+    """
+    Асинхронный вариант _prefetch_simplify: фоновая задача в текущем event loop.
+    """
+    global _simplify_slots
+
+    if _prefetch_matches(problem_state, problem_state.get("prefetch")):
+        return
+    _drop_prefetch(problem_state)
+    if not problem_state.get("active"):
+        return
+
+    current_step = problem_state.get("current_step", 0)
+    steps = problem_state.get("steps", [])
+    if not 0 <= current_step < len(steps):
+        return
+
+    if _simplify_slots is None:
+        _simplify_slots = asyncio.Semaphore(SIMPLIFY_WORKERS)
+
+    source = steps[current_step]
+    topic = problem_state.get("topic", "")
+
+    async def _run():
+        async with _simplify_slots:
+            return await _simplify_step_async(client, topic, source, agent="prefetch")
+
+    task = asyncio.create_task(_run())
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    problem_state["prefetch"] = {"step": current_step, "source": source, "future": task}
+
+
+def _take_prefetched(problem_state: Dict) -> Optional[str]:
+    """
+    Забирает готовую (или дожидается идущей) заготовку из пула потоков.
+    """
+    prefetch = problem_state.pop("prefetch", None)
+    if not _prefetch_matches(problem_state, prefetch) or not isinstance(prefetch["future"], Future):
+        if prefetch is not None:
+            prefetch["future"].cancel()
+        return None
+    try:
+        return prefetch["future"].result()
+    except Exception:
+        return None
+
+
+async def _take_prefetched_async(problem_state: Dict) -> Optional[str]:
+    prefetch = problem_state.pop("prefetch", None)
+    if not _prefetch_matches(problem_state, prefetch):
+        if prefetch is not None:
+            prefetch["future"].cancel()
+        return None
+
+    future = prefetch["future"]
+    if isinstance(future, Future):
+        future = asyncio.wrap_future(future)
+    try:
+        return await future
+    except Exception:
+        return None
+
+
+def release_problem_solver(problem_state: Dict) -> None:
+    """
+    Сессия Problem Solver-а больше не нужна: отменяем фоновые заготовки.
+    """
+    _drop_prefetch(problem_state)
+
+
+def _start_with_steps(user_question: str, steps: Optional[List[str]]) -> Tuple[str, Dict]:
+    """
+    Собирает состояние problem_solver и текст первого шага.
+    steps = None — плана нет: текст ошибки и неактивное состояние.
+    """
+    if steps is None:
+        return STEPS_ERROR, {"active": False, "topic": user_question, "steps": [], "current_step": 0}
 
     # Гарантируем не менее 1 шага
     if not steps:
@@ -107,25 +314,65 @@ def start_problem_solver(access_token: str, user_question: str) -> Tuple[str, Di
     return text, state
 
 
-def continue_problem_solver(access_token: str, problem_state: Dict, user_reply: str):
+def start_problem_solver(client: GigaChatClient, user_question: str) -> Tuple[str, Dict]:
     """
-    Продолжение Problem Solver-а:
-    - если пользователь ответил 'да' → переходим к следующему шагу (или завершаем),
-    - если 'нет' → переформулируем текущий шаг проще и показываем обновлённый текст.
+    Старт Problem Solver-а:
+    - запрашивает у модели 3 шага,
+    - возвращает текст для пользователя и состояние problem_solver.
+    """
+    steps = _generate_steps(client, user_question)
+    text, state = _start_with_steps(user_question, steps)
+    _prefetch_simplify(client, state)
+    return text, state
+
+
+async def start_problem_solver_async(client: AsyncGigaChatClient, user_question: str) -> Tuple[str, Dict]:
+    """
+    Асинхронный вариант start_problem_solver.
+    """
+    steps = await _generate_steps_async(client, user_question)
+    text, state = _start_with_steps(user_question, steps)
+    _prefetch_simplify_async(client, state)
+    return text, state
+
+
+def _needs_simplify(problem_state: Dict, user_reply: str) -> bool:
+    """
+    True, если пользователь ответил "нет" и текущий шаг нужно переформулировать.
+    """
+    if not problem_state.get("active"):
+        return False
+    steps = problem_state.get("steps", [])
+    current_step = problem_state.get("current_step", 0)
+    return user_reply.strip().lower() in NO_WORDS and 0 <= current_step < len(steps)
+
+
+def _show_simplified(problem_state: Dict, new_expl: str) -> Tuple[str, Dict]:
+    current_step = problem_state.get("current_step", 0)
+    problem_state["steps"][current_step] = new_expl
+
+    text = (
+        "Хорошо, давай попробуем объяснить этот шаг по-другому:\n\n"
+        f"Шаг {current_step + 1}:\n{new_expl}\n\n"
+        "Теперь понятнее? (да/нет)"
+    )
+    return text, problem_state
+
+
+def _advance(problem_state: Dict, user_reply: str) -> Tuple[str, Dict]:
+    """
+    Всё, что не требует модели: неактивная сессия, "да" и непонятный ответ.
     """
     if not problem_state.get("active"):
         return "Сейчас нет активного пошагового объяснения. Задай новую тему.", problem_state
 
     steps: List[str] = problem_state.get("steps", [])
     current_step = problem_state.get("current_step", 0)
-    topic = problem_state.get("topic", "")
 
     ans = user_reply.strip().lower()
-    yes_words = {"yes", "y", "да", "ага", "понял", "поняла", "понял.", "поняла."}
-    no_words = {"no", "n", "нет", "неа", "не", "не понял", "не поняла"}
 
     # --- ПОЛЬЗОВАТЕЛЬ СКАЗАЛ "ДА" ---
-    if ans in yes_words:
+    if ans in YES_WORDS:
         current_step += 1
 
         if current_step < len(steps):
@@ -144,24 +391,50 @@ def continue_problem_solver(access_token: str, problem_state: Dict, user_reply:
             )
             return text, problem_state
 
-    # --- ПОЛЬЗОВАТЕЛЬ СКАЗАЛ "НЕТ" ---
-    if ans in no_words:
-        if 0 <= current_step < len(steps):
-            # просим модель переформулировать текущий шаг проще
-            new_expl = _simplify_step(access_token, topic, steps[current_step])
-            steps[current_step] = new_expl
-            problem_state["steps"] = steps
-
-            text = (
-                "Хорошо, давай попробуем объяснить этот шаг по-другому:\n\n"
-                f"Шаг {current_step + 1}:\n{new_expl}\n\n"
-                "Теперь понятнее? (да/нет)"
-            )
-            return text, problem_state
-
     # --- Любой другой ответ ---
     text = (
         "Ответь, пожалуйста, 'да' или 'нет', чтобы я понял, переходить дальше "
         "или объяснить этот шаг ещё раз по-другому."
     )
     return text, problem_state
+
+
+def continue_problem_solver(client: GigaChatClient, problem_state: Dict, user_reply: str):
+    """
+    Продолжение Problem Solver-а:
+    - если пользователь ответил 'да' → переходим к следующему шагу (или завершаем),
+    - если 'нет' → переформулируем текущий шаг проще и показываем обновлённый текст.
+    """
+    # --- ПОЛЬЗОВАТЕЛЬ СКАЗАЛ "НЕТ" ---
+    if _needs_simplify(problem_state, user_reply):
+        # упрощённый вариант обычно уже готов; если нет — просим модель сейчас
+        new_expl = _take_prefetched(problem_state)
+        if new_expl is None:
+            current_step = problem_state.get("current_step", 0)
+            new_expl = _simplify_step(client, problem_state.get("topic", ""), problem_state["steps"][current_step])
+        text, problem_state = _show_simplified(problem_state, new_expl)
+    else:
+        text, problem_state = _advance(problem_state, user_reply)
+
+    # готовим упрощение для шага, который ученик сейчас будет читать
+    _prefetch_simplify(client, problem_state)
+    return text, problem_state
+
+
+async def continue_problem_solver_async(client: AsyncGigaChatClient, problem_state: Dict, user_reply: str):
+    """
+    Асинхронный вариант continue_problem_solver.
+    """
+    if _needs_simplify(problem_state, user_reply):
+        new_expl = await _take_prefetched_async(problem_state)
+        if new_expl is None:
+            current_step = problem_state.get("current_step", 0)
+            new_expl = await _simplify_step_async(
+                client, problem_state.get("topic", ""), problem_state["steps"][current_step]
+            )
+        text, problem_state = _show_simplified(problem_state, new_expl)
+    else:
+        text, problem_state = _advance(problem_state, user_reply)
+
+    _prefetch_simplify_async(client, problem_state)
+    return text, problem_state
@@ -0,0 +1,255 @@
+# agents/route_classifier.py
+#
+# Локальный классификатор маршрута: по тексту сообщения предсказывает
+# (agent_id, change_topic) без запроса к модели.
+#
+# Признаки — символьные n-граммы (utils/ngrams.py), модель — многоклассовая
+# логистическая регрессия на NumPy. Обучается офлайн на логах модератора
+# (LUMIRA_MODERATOR_LOG, см. agents/moderator.py).
+#
+# Обучение и отчёт по отложенной выборке:
+#   python -m agents.route_classifier train --log moderator_log.jsonl --model routing_model.npz
+#   python -m agents.route_classifier evaluate --log heldout.jsonl --model routing_model.npz
+
+
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.ngrams import hashed_features
+
+
+# Все пары (agent_id, change_topic): класс = (agent_id - 1) * 2 + change_topic
+LABELS: List[Tuple[int, int]] = [(agent, change) for agent in (1, 2, 3, 4) for change in (0, 1)]
+
+DEFAULT_DIM = 2 ** 16
+DEFAULT_THRESHOLD = 0.9
+
+
+def label_to_class(agent_id: int, change_topic: int) -> int:
+    return LABELS.index((agent_id, change_topic))
+
+
+class RouteClassifier:
+    """
+    Softmax-регрессия над хешированными char n-граммами.
+    Веса хранятся в .npz (np.load без pickle — загрузка за миллисекунды).
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, n_min: int = 2, n_max: int = 4):
+        self.weights = weights      # (dim, n_classes)
+        self.bias = bias            # (n_classes,)
+        self.dim = weights.shape[0]
+        self.n_min = n_min
+        self.n_max = n_max
+
+    # ---------- предсказание ----------
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        indices, values = hashed_features(text, self.dim, self.n_min, self.n_max)
+        logits = values @ self.weights[indices] + self.bias
+        logits -= logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def predict(self, text: str) -> Tuple[Tuple[int, int], float]:
+        """
+        Возвращает ((agent_id, change_topic), уверенность).
+        """
+        proba = self.predict_proba(text)
+        best = int(proba.argmax())
+        return LABELS[best], float(proba[best])
+
+    # ---------- хранение ----------
+
+    def save(self, path: str) -> None:
+        # через файл: иначе np.savez допишет к пути «.npz», и LUMIRA_ROUTER_MODEL=path не найдётся
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                weights=self.weights.astype(np.float32),
+                bias=self.bias.astype(np.float32),
+                ngram_range=np.array([self.n_min, self.n_max]),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "RouteClassifier":
+        data = np.load(path, allow_pickle=False)
+        n_min, n_max = (int(x) for x in data["ngram_range"])
+        return cls(data["weights"], data["bias"], n_min, n_max)
+
+    # ---------- обучение ----------
+
+    @classmethod
+    def train(
+        cls,
+        texts: List[str],
+        labels: List[int],
+        dim: int = DEFAULT_DIM,
+        epochs: int = 50,
+        lr: float = 5.0,
+        l2: float = 1e-5,
+        batch_size: int = 256,
+        seed: int = 0,
+    ) -> "RouteClassifier":
+        """
+        Мини-батчевый градиентный спуск по кросс-энтропии.
+        Признаки держим разреженно (CSR-подобно), чтобы не строить матрицу N × dim.
+        """
+        n_classes = len(LABELS)
+        feats = [hashed_features(t, dim) for t in texts]
+        y = np.asarray(labels, dtype=np.int64)
+
+        rng = np.random.default_rng(seed)
+        weights = np.zeros((dim, n_classes), dtype=np.float32)
+        bias = np.zeros(n_classes, dtype=np.float32)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(texts))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                cols = np.concatenate([feats[i][0] for i in batch])
+                vals = np.concatenate([feats[i][1] for i in batch])
+                lengths = np.array([len(feats[i][0]) for i in batch])
+                rows = np.repeat(np.arange(len(batch)), lengths)
+
+                logits = np.zeros((len(batch), n_classes), dtype=np.float32)
+                np.add.at(logits, rows, vals[:, None] * weights[cols])
+                logits += bias
+                logits -= logits.max(axis=1, keepdims=True)
+                proba = np.exp(logits)
+                proba /= proba.sum(axis=1, keepdims=True)
+
+                # градиент кросс-энтропии по логитам
+                proba[np.arange(len(batch)), y[batch]] -= 1.0
+                proba /= len(batch)
+
+                grad_w = np.zeros_like(weights)
+                np.add.at(grad_w, cols, vals[:, None] * proba[rows])
+                weights -= lr * (grad_w + l2 * weights)
+                bias -= lr * proba.sum(axis=0)
+
+        return cls(weights, bias)
+
+
+def classifier_rule(model: RouteClassifier, threshold: float = DEFAULT_THRESHOLD):
+    """
+    Правило для FastRouter: отвечает само, только если уверенность ≥ threshold,
+    иначе отдаёт решение LLM-модератору.
+    """
+    def rule(text: str, state: Dict) -> Optional[Tuple[int, int]]:
+        decision, confidence = model.predict(text)
+        if confidence >= threshold:
+            return decision
+        return None
+
+    return rule
+
+
+# ---------- CLI ----------
+
+def load_log(path: str, sources: Optional[Set[str]] = None) -> Tuple[List[str], List[int]]:
+    """
+    Читает JSONL-лог маршрутов: {"text": ..., "agent_id": ..., "change_topic": ..., "source": ...}.
+    sources — только решения этих источников (moderator, fused, classifier, правила FastRouter);
+    None — все. Записи без source — от модератора.
+    """
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if sources is not None and record.get("source", "moderator") not in sources:
+                continue
+            texts.append(record["text"])
+            labels.append(label_to_class(int(record["agent_id"]), int(record["change_topic"])))
+    return texts, labels
+
+
+def evaluate(model: RouteClassifier, texts: List[str], labels: List[int], threshold: float) -> Dict:
+    """
+    Точность на всей выборке и на той части, где модель уверена (coverage),
+    плюс задержка одного предсказания.
+    """
+    correct = confident = confident_correct = 0
+    latencies = []
+    for text, label in zip(texts, labels):
+        t0 = time.perf_counter()
+        decision, confidence = model.predict(text)
+        latencies.append(time.perf_counter() - t0)
+
+        hit = label_to_class(*decision) == label
+        correct += hit
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += hit
+
+    n = len(texts)
+    lat_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "samples": n,
+        "accuracy": correct / n if n else 0.0,
+        "threshold": threshold,
+        "coverage": confident / n if n else 0.0,
+        "accuracy_at_threshold": confident_correct / confident if confident else 0.0,
+        "latency_ms_p50": float(np.percentile(lat_ms, 50)),
+        "latency_ms_p99": float(np.percentile(lat_ms, 99)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обучение и проверка локального классификатора маршрутов.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    train_p = sub.add_parser("train", help="обучить модель на логе модератора")
+    train_p.add_argument("--log", required=True, help="JSONL-лог решений о маршруте (LUMIRA_MODERATOR_LOG)")
+    train_p.add_argument(
+        "--sources", help="только эти источники через запятую (например, moderator,fused); по умолчанию — все"
+    )
+    train_p.add_argument("--model", required=True, help="куда сохранить .npz")
+    train_p.add_argument("--holdout", type=float, default=0.2, help="доля отложенной выборки для отчёта")
+    train_p.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    train_p.add_argument("--epochs", type=int, default=50)
+    train_p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    eval_p = sub.add_parser("evaluate", help="отчёт по точности и задержке на отложенном логе")
+    eval_p.add_argument("--log", required=True)
+    eval_p.add_argument("--model", required=True)
+    eval_p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        sources = set(args.sources.split(",")) if args.sources else None
+        texts, labels = load_log(args.log, sources)
+        order = np.random.default_rng(0).permutation(len(texts))
+        n_holdout = int(len(texts) * args.holdout)
+        test_idx, train_idx = order[:n_holdout], order[n_holdout:]
+
+        model = RouteClassifier.train(
+            [texts[i] for i in train_idx],
+            [labels[i] for i in train_idx],
+            dim=args.dim,
+            epochs=args.epochs,
+        )
+        model.save(args.model)
+        print(f"Модель сохранена: {args.model} (обучено на {len(train_idx)} примерах)")
+
+        if n_holdout:
+            report = evaluate(model, [texts[i] for i in test_idx], [labels[i] for i in test_idx], args.threshold)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    elif args.command == "evaluate":
+        texts, labels = load_log(args.log)
+        model = RouteClassifier.load(args.model)
+        report = evaluate(model, texts, labels, args.threshold)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# agents/router.py
+
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from agents.analyser import looks_like_answers
+
+
+# Правило получает текст и состояние сессии и возвращает решение
+# (agent_id, change_topic_flag) — или None, если правило не уверено.
+Rule = Callable[[str, Dict], Optional[Tuple[int, int]]]
+
+
+def answers_rule(text: str, state: Dict) -> Optional[Tuple[int, int]]:
+    """
+    '1a 2b 3c 4d 5a' — это ответы на тест → Analyzer, тему не меняем.
+    """
+    if looks_like_answers(text):
+        return 3, 0
+    return None
+
+
+def problem_solver_reply_rule(text: str, state: Dict) -> Optional[Tuple[int, int]]:
+    """
+    'да'/'нет' во время пошагового объяснения → продолжаем Problem Solver.
+    """
+    if not state.get("problem_solver", {}).get("active"):
+        return None
+    # активный Problem Solver значит, что модуль уже загружен
+    from agents.problem_solver import is_yes_no
+
+    if is_yes_no(text):
+        return 4, 0
+    return None
+
+
+# только формы самого слова: «тестостерон» или «тестирование» — не просьба о тесте
+TEST_WORD_RE = re.compile(
+    r"\b(тест(?:ик)?(?:а|у|ом|е|ы|ов|ам|ами|ах|и)?|tests?|quiz(?:zes)?|"
+    r"викторин(?:а|ы|у|ой|е|ам|ами|ах)?)\b"
+)
+TEST_REQUEST_RE = re.compile(
+    r"^(сделай|сделайте|составь|дай|давай|хочу|нужен|проверь|"
+    r"make|give|create|generate|i want|let's do)\b"
+)
+# целыми словами: «по нейронным сетям», «on italian cuisine» — это новая тема
+SAME_TOPIC_RE = re.compile(
+    r"\b(по этой теме|по теме выше|по ней|по этому|по пройденному|"
+    r"on this topic|on this|about it|on it|about this)\b"
+)
+NEW_TOPIC_RE = re.compile(r"\b(по|про|на тему|about|on)\s+\S+")
+
+
+def test_request_rule(text: str, state: Dict) -> Optional[Tuple[int, int]]:
+    """
+    Явная просьба о тесте: 'сделай тест по производным' → '2 1',
+    'сделай тест по этой теме' / просто 'тест' → '2 0'.
+    Вопросы вида 'что такое тест Тьюринга?' сюда не попадают.
+    """
+    normalized = text.strip().lower()
+    if "?" in normalized:
+        return None
+
+    match = TEST_WORD_RE.search(normalized)
+    if not match:
+        return None
+    if match.start() != 0 and not TEST_REQUEST_RE.match(normalized):
+        return None
+
+    tail = normalized[match.end():]
+    if SAME_TOPIC_RE.search(tail):
+        return 2, 0
+    if NEW_TOPIC_RE.search(tail):
+        return 2, 1
+    if not tail.strip(" .!"):
+        return 2, 0
+    return None
+
+
+DEFAULT_RULES: List[Tuple[str, Rule]] = [
+    ("problem_solver_reply", problem_solver_reply_rule),
+    ("answers", answers_rule),
+    ("test_request", test_request_rule),
+]
+
+
+class FastRouter:
+    """
+    Локальный пре-роутер перед run_moderator.
+
+    Правила проверяются по порядку; первое уверенное решение возвращается сразу,
+    без запроса к модели. Если ни одно правило не сработало — спрашиваем модератора.
+    Считает попадания по каждому правилу и общий hit rate.
+    """
+
+    def __init__(self, rules: Optional[List[Tuple[str, Rule]]] = None):
+        self.rules: List[Tuple[str, Rule]] = list(DEFAULT_RULES if rules is None else rules)
+        self.hits: Dict[str, int] = {name: 0 for name, _ in self.rules}
+        self.fallbacks = 0
+
+    def add_rule(self, name: str, rule: Rule, first: bool = False) -> None:
+        if first:
+            self.rules.insert(0, (name, rule))
+        else:
+            self.rules.append((name, rule))
+        self.hits.setdefault(name, 0)
+
+    def decide(self, text: str, state: Dict) -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+        """
+        Пытается решить маршрут локально: (решение, имя сработавшего правила).
+        (None, None) — нужен LLM-модератор.
+        """
+        for name, rule in self.rules:
+            decision = rule(text, state)
+            if decision is not None:
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return decision, name
+        self.fallbacks += 1
+        return None, None
+
+    def match(self, text: str, state: Dict) -> Optional[Tuple[int, int]]:
+        """
+        Пытается решить маршрут локально. None — нужен LLM-модератор.
+        """
+        return self.decide(text, state)[0]
+
+    def hit_rate(self) -> float:
+        hits = sum(self.hits.values())
+        total = hits + self.fallbacks
+        return hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        # плоский словарь — так его отдаёт metrics (lumira_router_hits_<правило>)
+        return {
+            "fallbacks": self.fallbacks,
+            "hit_rate": self.hit_rate(),
+            **{f"hits_{rule}": n for rule, n in self.hits.items()},
+        }
+
+
+# Обученный классификатор маршрутов (agents/route_classifier.py) подключается
+# последним правилом: отвечает сам при уверенности ≥ порога, иначе — модератор.
+ROUTER_MODEL_PATH = os.getenv("LUMIRA_ROUTER_MODEL")
+ROUTER_THRESHOLD = float(os.getenv("LUMIRA_ROUTER_THRESHOLD", "0.9"))
+
+default_router = FastRouter()
+
+if ROUTER_MODEL_PATH:
+    from agents.route_classifier import RouteClassifier, classifier_rule
+
+    default_router.add_rule(
+        "classifier",
+        classifier_rule(RouteClassifier.load(ROUTER_MODEL_PATH), ROUTER_THRESHOLD),
+    )
@@ -1,6 +1,12 @@
 # agents/tutor.py
-from typing import List, Dict, Tuple
-from gigachat_api import chat_with_gigachat_messages
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional, Tuple
+from gigachat_api import (
+    GigaChatClient,
+    AsyncGigaChatClient,
+    chat_with_gigachat_messages,
+    chat_with_gigachat_messages_async,
+)
+from agents.tutor_memory import visible_context, compact_history, schedule_compaction
 
 TUTOR_PROMPT = (
     "Ты — персональный репетитор.\n"
@@ -20,39 +26,142 @@ TUTOR_PROMPT = (
     "Сейчас тебе передадут вопрос ученика. Объясняй так, как будто говоришь живому человеку."
 )
 
-def run_tutor(
-    access_token: str,
+def build_tutor_messages(
     user_message: str,
     history: List[Dict[str, str]],
-) -> Tuple[str, List[Dict[str, str]]]:
+    system_prompt: str = TUTOR_PROMPT,
+) -> List[Dict[str, str]]:
     """
-    Агент-репетитор с памятью.
-    history — список сообщений вида {"role": "user"|"assistant", "content": "..."}.
-    Возвращает (ответ модели, обновлённая history).
+    Собирает messages: system (+ краткое содержание старых реплик)
+    + последние реплики в пределах бюджета токенов + текущий вопрос.
     """
-
-    # 1. Собираем messages: system + (обрезанная) история + текущий вопрос
     messages: List[Dict[str, str]] = []
 
-    # system — инструкция для модели
-    messages.append({"role": "system", "content": TUTOR_PROMPT})
+    # Берём только то, что влезает в бюджет; более старое — в виде краткого содержания
+    summary, recent = visible_context(history)
+    if summary:
+        system_prompt += f"\n\nКраткое содержание предыдущей части занятия:\n{summary}"
 
-    # Обрезаем историю, чтобы не раздувать контекст
-    MAX_HISTORY_MESSAGES = 10
-    trimmed_history = history[-MAX_HISTORY_MESSAGES:]
+    # system — инструкция для модели
+    messages.append({"role": "system", "content": system_prompt})
 
-    messages.extend(trimmed_history)
+    messages.extend(recent)
 
     # Текущее сообщение пользователя
     messages.append({"role": "user", "content": user_message})
+    return messages
 
-    # 2. Запрос к GigaChat
-    answer = chat_with_gigachat_messages(access_token, messages)
 
-    # 3. Обновляем историю: добавляем новый user-вопрос и ответ ассистента
+def remember_turn(history: List[Dict[str, str]], user_message: str, answer: str) -> None:
+    # Обновляем историю: добавляем новый user-вопрос и ответ ассистента
     history.append({"role": "user", "content": user_message})
     history.append({"role": "assistant", "content": answer})
 
+
+def run_tutor(
+    client: GigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Агент-репетитор с памятью.
+    history — список сообщений вида {"role": "user"|"assistant", "content": "..."};
+    первым элементом может идти {"role": "summary", ...} — краткое содержание старых реплик.
+    Возвращает (ответ модели, обновлённая history).
+    """
+    # первый вопрос без контекста у многих учеников одинаковый — такие запросы склеиваем
+    answer = chat_with_gigachat_messages(client, build_tutor_messages(user_message, history), coalesce=not history, agent="tutor")
+    remember_turn(history, user_message, answer)
+    compact_history(client, history)
+    return answer, history
+
+
+async def run_tutor_async(
+    client: AsyncGigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Асинхронный вариант run_tutor.
+    """
+    answer = await chat_with_gigachat_messages_async(
+        client, build_tutor_messages(user_message, history), coalesce=not history, agent="tutor"
+    )
+    remember_turn(history, user_message, answer)
+    schedule_compaction(client, history)
     return answer, history
 
-# "6) В конце ответа всегда задавай один короткий вопрос, чтобы проверить понимание.\n"
\ No newline at end of file
+
+def run_tutor_stream(
+    client: GigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+) -> Iterator[str]:
+    """
+    Потоковый run_tutor: отдаёт ответ кусочками по мере генерации.
+    В history ответ попадает целиком, когда поток закончился.
+    """
+    parts: List[str] = []
+    for delta in client.stream(build_tutor_messages(user_message, history), agent="tutor"):
+        parts.append(delta)
+        yield delta
+    remember_turn(history, user_message, "".join(parts))
+    compact_history(client, history)
+
+
+async def run_tutor_stream_async(
+    client: AsyncGigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+) -> AsyncIterator[str]:
+    """
+    Асинхронный вариант run_tutor_stream.
+    """
+    parts: List[str] = []
+    async for delta in client.astream(build_tutor_messages(user_message, history), agent="tutor"):
+        parts.append(delta)
+        yield delta
+    remember_turn(history, user_message, "".join(parts))
+    schedule_compaction(client, history)
+
+# "6) В конце ответа всегда задавай один короткий вопрос, чтобы проверить понимание.\n"
+
+
+class DeferredStream:
+    """
+    Кусочки ответа, который ещё может оказаться не нужен (спекулятивный Tutor).
+    Пока не вызван attach, они только копятся; attach отдаёт накопленное
+    в on_delta и дальше пересылает кусочки на лету.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self._on_delta: Optional[Callable[[str], None]] = None
+
+    def push(self, delta: str) -> None:
+        self.parts.append(delta)
+        if self._on_delta is not None:
+            self._on_delta(delta)
+
+    def attach(self, on_delta: Callable[[str], None]) -> None:
+        for delta in self.parts:
+            on_delta(delta)
+        self._on_delta = on_delta
+
+
+async def run_tutor_speculative_async(
+    client: AsyncGigaChatClient,
+    user_message: str,
+    history: List[Dict[str, str]],
+    stream: DeferredStream,
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Потоковый Tutor для спекулятивного вызова: кусочки идут в stream.
+    Сжатие истории не запускается — его запускает вызывающий (schedule_compaction),
+    когда ответ принят, чтобы отброшенный вызов не тратил запрос на summary.
+    """
+    async for delta in client.astream(build_tutor_messages(user_message, history), agent="tutor"):
+        stream.push(delta)
+    answer = "".join(stream.parts)
+    remember_turn(history, user_message, answer)
+    return answer, history
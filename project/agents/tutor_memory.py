@@ -0,0 +1,167 @@
+# agents/tutor_memory.py
+
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from gigachat_api import (
+    GigaChatClient,
+    AsyncGigaChatClient,
+    chat_with_gigachat_messages,
+    chat_with_gigachat_messages_async,
+)
+
+
+# Сколько токенов истории отправляем модели дословно (последние реплики)
+TUTOR_CONTEXT_TOKENS = int(os.getenv("LUMIRA_TUTOR_CONTEXT_TOKENS", "1500"))
+
+# Реплики, вытесненные из бюджета, сворачиваются в краткое содержание пачками
+# не меньше стольких токенов (чтобы не звать модель на каждый ход)
+SUMMARY_BATCH_TOKENS = int(os.getenv("LUMIRA_SUMMARY_BATCH_TOKENS", "600"))
+
+# Примерный предел длины самого краткого содержания
+SUMMARY_MAX_WORDS = 150
+
+SUMMARY_PROMPT = (
+    "Ты ведёшь краткий конспект занятия ученика с репетитором.\n"
+    "Тебе дают прежний конспект (может быть пустым) и новые реплики разговора.\n"
+    "Обнови конспект: какие темы разбирались, что уже объяснено, где ученик ошибался или "
+    "чего не понял, на чём остановились.\n"
+    f"Пиши сжато, не больше {SUMMARY_MAX_WORDS} слов, без вступлений — только сам конспект."
+)
+
+# id списков history, для которых сейчас идёт фоновое сжатие
+_compacting = set()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Быстрая оценка числа токенов без обращения к API:
+    для русского и английского текста GigaChat тратит примерно токен на 3 символа.
+    """
+    return len(text) // 3 + 1
+
+
+def _split_history(history: List[Dict[str, str]]) -> Tuple[Optional[Dict[str, str]], int]:
+    """
+    Возвращает (запись с кратким содержанием или None, индекс первой реплики,
+    которая целиком помещается в бюджет TUTOR_CONTEXT_TOKENS).
+    """
+    summary = history[0] if history and history[0]["role"] == "summary" else None
+    start = 1 if summary is not None else 0
+
+    budget = TUTOR_CONTEXT_TOKENS
+    first_visible = len(history)
+    # идём с конца, пока реплики влезают в бюджет;
+    # видимая часть всегда начинается с реплики ученика
+    for i in range(len(history) - 1, start - 1, -1):
+        budget -= count_tokens(history[i]["content"])
+        if budget < 0:
+            break
+        first_visible = i
+    while first_visible < len(history) and history[first_visible]["role"] != "user":
+        first_visible += 1
+    return summary, first_visible
+
+
+def visible_context(history: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    Что уходит в запрос: текст краткого содержания (или None)
+    и последние реплики в пределах бюджета — в виде {"role", "content"}.
+    """
+    summary, first_visible = _split_history(history)
+    messages = [{"role": m["role"], "content": m["content"]} for m in history[first_visible:]]
+    return (summary["content"] if summary else None), messages
+
+
+def _evicted(history: List[Dict[str, str]]) -> Tuple[Optional[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Реплики, которые уже не влезают в бюджет, если их набралось на пачку; иначе пустой список.
+    """
+    summary, first_visible = _split_history(history)
+    start = 1 if summary is not None else 0
+    evicted = history[start:first_visible]
+    if sum(count_tokens(m["content"]) for m in evicted) < SUMMARY_BATCH_TOKENS:
+        return summary, []
+    return summary, evicted
+
+
+def _summary_messages(summary: Optional[Dict[str, str]], evicted: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    dialogue = "\n".join(
+        f"{'Ученик' if m['role'] == 'user' else 'Репетитор'}: {m['content']}" for m in evicted
+    )
+    previous = summary["content"] if summary else "(пусто)"
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Прежний конспект:\n{previous}\n\nНовые реплики:\n{dialogue}"},
+    ]
+
+
+def _apply_summary(
+    history: List[Dict[str, str]],
+    old_summary: Optional[Dict[str, str]],
+    evicted: List[Dict[str, str]],
+    new_text: Optional[str],
+) -> None:
+    """
+    Заменяет краткое содержание и убирает свёрнутые реплики.
+    new_text = None — конспект не получился (сеть, отмена): реплики всё равно
+    убираем, а конспект остаётся прежним, иначе история росла бы без предела.
+    Новые реплики за это время могли добавиться только в конец, поэтому
+    достаточно проверить, что начало истории не изменилось.
+    """
+    start = 1 if old_summary is not None else 0
+    if old_summary is not None and (not history or history[0] is not old_summary):
+        return
+    if history[start:start + len(evicted)] != evicted:
+        return
+
+    if new_text is None:
+        del history[start:start + len(evicted)]
+        return
+    new_summary = {"role": "summary", "content": new_text.strip()}
+    history[0:start + len(evicted)] = [new_summary]
+
+
+def compact_history(client: GigaChatClient, history: List[Dict[str, str]]) -> None:
+    """
+    Если вне бюджета накопилась пачка реплик — сворачивает их в краткое содержание.
+    Так память сессии и размер запроса остаются примерно постоянными.
+    """
+    summary, evicted = _evicted(history)
+    if not evicted:
+        return
+    new_text = None
+    try:
+        new_text = chat_with_gigachat_messages(client, _summary_messages(summary, evicted), agent="summary")
+    finally:
+        _apply_summary(history, summary, evicted, new_text)
+
+
+async def _summarize_async(
+    client: AsyncGigaChatClient,
+    history: List[Dict[str, str]],
+    summary: Optional[Dict[str, str]],
+    evicted: List[Dict[str, str]],
+) -> None:
+    new_text = None
+    try:
+        new_text = await chat_with_gigachat_messages_async(
+            client, _summary_messages(summary, evicted), agent="summary"
+        )
+    finally:
+        _apply_summary(history, summary, evicted, new_text)
+        _compacting.discard(id(history))
+
+
+def schedule_compaction(client: AsyncGigaChatClient, history: List[Dict[str, str]]) -> None:
+    """
+    Запускает сжатие в фоне, чтобы не задерживать ответ ученику.
+    Ничего не делает, если сжимать пока нечего или сжатие уже идёт.
+    """
+    summary, evicted = _evicted(history)
+    if not evicted or id(history) in _compacting:
+        return
+    _compacting.add(id(history))
+    task = asyncio.create_task(_summarize_async(client, history, summary, evicted))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
@@ -1,7 +1,27 @@
 # gigachat_api.py
 import requests
 import urllib3
+import aiohttp
+import asyncio
 import base64
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import email.utils
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+
+import metrics
+import recorder
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -16,88 +36,1052 @@ SCOPE = "GIGACHAT_API_PERS"   # или другой scope, если так вы
 # Какая модель GigaChat
 MODEL = "GigaChat"  # можно взять любую из /api/v1/models
 
+# Адреса API; переопределяются, например, чтобы ходить в локальный mock_gigachat.py
+GIGACHAT_AUTH_URL = os.getenv("LUMIRA_GIGACHAT_AUTH_URL", "https://ngw.devices.sberbank.ru:9443").rstrip("/")
+GIGACHAT_API_URL = os.getenv("LUMIRA_GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru").rstrip("/")
 
-def get_access_token() -> str:
-    """
-    Получаем OAuth-токен у NGW.
-    """
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+OAUTH_URL = GIGACHAT_AUTH_URL + "/api/v2/oauth"
+CHAT_URL = GIGACHAT_API_URL + "/api/v1/chat/completions"
+# Лёгкий запрос для прогрева соединения при старте
+MODELS_URL = GIGACHAT_API_URL + "/api/v1/models"
+
+# Сколько keep-alive соединений держим в пуле
+POOL_SIZE = 16
+# ...и сколько одновременных соединений у асинхронного клиента
+ASYNC_POOL_SIZE = 100
+
+# За сколько секунд до expires_at обновляем токен заранее
+TOKEN_REFRESH_MARGIN = 60
+
+# Если NGW не прислал expires_at — считаем, что токен живёт 30 минут
+DEFAULT_TOKEN_LIFETIME = 30 * 60
+
+# ==== ЛИМИТЫ И ПОВТОРЫ ====
+# Частота запросов к /chat/completions на процесс (под нашу квоту) и допустимый всплеск
+RATE_LIMIT_RPS = float(os.getenv("LUMIRA_RATE_LIMIT_RPS", "10"))
+RATE_LIMIT_BURST = int(os.getenv("LUMIRA_RATE_LIMIT_BURST", "20"))
+
+# Потолок одновременных запросов одного клиента. Фактический лимит подстраивается:
+# на 429/5xx уменьшается вдвое, на успешных ответах понемногу растёт обратно
+MAX_CONCURRENCY = int(os.getenv("LUMIRA_MAX_CONCURRENCY", "32"))
+
+# Повторы на 429/5xx и обрывы связи: пауза из Retry-After, а без него —
+# экспоненциальная (BACKOFF_BASE * 2^попытка, не больше BACKOFF_MAX) с джиттером
+MAX_RETRIES = int(os.getenv("LUMIRA_MAX_RETRIES", "4"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Приоритеты агентов: меньше — раньше. Короткие решения модератора обгоняют
+# длинные генерации тестов и фоновые задачи
+AGENT_PRIORITY = {
+    "moderator": 0,
+    "fused": 1,
+    "tutor": 1,
+    "problem_solver_steps": 1,
+    "problem_solver_simplify": 1,
+    "examiner": 2,
+    "summary": 3,
+    "prefetch": 3,
+}
+DEFAULT_PRIORITY = 1
 
+# Кэш контекста GigaChat (заголовок X-Session-ID): запросы одной сессии Lumira
+# к одному агенту идут с одним id, и повторяющееся начало промпта (системный промпт,
+# история Tutor-а) сервер не обрабатывает и не тарифицирует заново
+SESSION_CACHE = os.getenv("LUMIRA_SESSION_CACHE", "1") == "1"
+_cache_session = contextvars.ContextVar("gigachat_cache_session", default=None)
+
+# Токены по агентам (из usage ответов): prompt — всего в промптах, precached — из них
+# взято из кэша сессии, completion — в ответах; calls — ответов с usage
+prompt_token_stats = {}
+
+# Сетевые ошибки обоих клиентов, после которых повторы уже исчерпаны
+NETWORK_ERRORS = (aiohttp.ClientError, requests.RequestException, asyncio.TimeoutError)
+
+# retries — повторных запросов, throttled — ответов 429/5xx и обрывов,
+# failed — запросов, которые так и не удались, queued — ждали своей очереди
+rate_limit_stats = {"retries": 0, "throttled": 0, "failed": 0, "queued": 0}
+
+# Склейка одинаковых одновременных запросов (complete(..., coalesce=True)):
+# leaders — реально отправленных, shared — получивших чужой результат
+coalesce_stats = {"leaders": 0, "shared": 0}
+
+
+def _oauth_payload(scope: str) -> str:
     # grant_type ОБЯЗАТЕЛЕН
-    payload = f"scope={SCOPE}&grant_type=client_credentials"
+    return f"scope={scope}&grant_type=client_credentials"
 
-    # client_id:client_secret → base64 (но здесь кладём уже готовые)
-    auth_bytes = f"{CLIENT_ID}:{CLIENT_SECRET}".encode("utf-8")
+
+def _oauth_headers(client_id: str, client_secret: str) -> dict:
+    # client_id:client_secret → base64
+    auth_bytes = f"{client_id}:{client_secret}".encode("utf-8")
     auth_b64 = base64.b64encode(auth_bytes).decode("ascii")
 
-    headers = {
+    return {
         "Content-Type": "application/x-www-form-urlencoded",
         "Accept": "application/json",
-        "RqUID": "fd648f05-0e2b-41bf-8753-5c197c62e598",  # можно любой UUID
+        "RqUID": str(uuid.uuid4()),
         "Authorization": f"Basic {auth_b64}",
     }
 
-    resp = requests.post(url, headers=headers, data=payload, verify=False, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-
-    # Обычно токен лежит в поле access_token
-    return data["access_token"]
 
-def chat_with_gigachat_messages(access_token: str, messages: list[dict]) -> str:
+def _parse_token(data: dict) -> tuple[str, float]:
     """
-    Общая функция: отправляет список messages в GigaChat и возвращает ответ ассистента.
-    messages — это список словарей вида {"role": "...", "content": "..."}.
+    Достаёт из ответа NGW токен и момент его истечения (unix-время в секундах).
     """
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+    # expires_at приходит в миллисекундах
+    expires_at = data.get("expires_at")
+    if expires_at:
+        expires_at = expires_at / 1000
+    else:
+        expires_at = time.time() + DEFAULT_TOKEN_LIFETIME
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
+    # Обычно токен лежит в поле access_token
+    return data["access_token"], expires_at
+
+
+def _chat_headers(token: str) -> dict:
+    return {
+        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
         "Accept": "application/json",
     }
 
-    payload = {
-        "model": MODEL,
-        "messages": messages,
-    }
 
-    resp = requests.post(url, headers=headers, json=payload, verify=False, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+def _request_key(model: str, messages: list[dict], extra: dict) -> str:
+    """
+    Отпечаток запроса для склейки: модель, messages и остальные поля payload.
+    """
+    body = json.dumps({"model": model, "messages": messages, **extra}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _parse_sse_line(line: str, usage: dict = None):
+    """
+    Разбирает одну строку server-sent events из потокового ответа.
+    Возвращает кусок текста, "" для служебных строк и None на "data: [DONE]".
+    usage из последнего куска (если он есть) дописывается в словарь usage.
+    """
+    if not line or not line.startswith("data:"):
+        return ""
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    if usage is not None and chunk.get("usage"):
+        usage.update(chunk["usage"])
+    choices = chunk.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content") or ""
+
+
+def agent_priority(agent: str = None) -> int:
+    return AGENT_PRIORITY.get(agent, DEFAULT_PRIORITY)
+
 
-    return data["choices"][0]["message"]["content"]
+def _agent_label(agent: str = None) -> str:
+    return agent or "other"
 
 
-def chat_with_gigachat(access_token: str,user_message: str) -> str:
+def _stream_response(parts: list[str], usage: dict) -> dict:
+    message = {"role": "assistant", "content": "".join(parts)}
+    return {"choices": [{"message": message, "index": 0}], "usage": usage}
+
+
+@contextmanager
+def cache_session(session_id: str):
     """
-    Отправляем сообщение в GigaChat и получаем ответ .
+    Запросы внутри блока (и запущенные из него задачи) идут с X-Session-ID
+    этой сессии — отдельным для каждого агента. session_id должен быть уникален
+    (случайный id сессии, а не имя вроде "cli"): сервер делит кэш между всеми,
+    кто ходит с теми же учётными данными.
     """
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+    token = _cache_session.set(session_id)
+    try:
+        yield
+    finally:
+        _cache_session.reset(token)
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
 
-    payload = {
-        "model": MODEL,
-        "messages": [
-            {
-                "role": "system",
-                "content": "Ты дружелюбный помощник.",
-            },
-            {
-                "role": "user",
-                "content": user_message,
-            },
-        ],
-    }
+def _session_headers(agent: str = None) -> dict:
+    session_id = _cache_session.get()
+    if not SESSION_CACHE or session_id is None:
+        return {}
+    # свой кэш у каждого агента: у них разные системные промпты
+    cache_id = uuid.uuid5(uuid.NAMESPACE_URL, f"lumira/{session_id}/{_agent_label(agent)}")
+    return {"X-Session-ID": str(cache_id)}
+
+
+_USAGE_FIELDS = {
+    "prompt": "prompt_tokens",
+    "completion": "completion_tokens",
+    "precached": "precached_prompt_tokens",
+}
+
+
+def _record_usage(agent: str, data: dict) -> None:
+    # usage: {"prompt_tokens", "completion_tokens", "precached_prompt_tokens", "total_tokens"}
+    usage = data.get("usage")
+    if not usage:
+        return
+    label = _agent_label(agent)
+    stats = prompt_token_stats.setdefault(label, {"calls": 0, "prompt": 0, "precached": 0, "completion": 0})
+    stats["calls"] += 1
+    for kind, field in _USAGE_FIELDS.items():
+        tokens = usage.get(field) or 0
+        stats[kind] += tokens
+        if tokens:
+            metrics.inc("llm_tokens", tokens, agent=label, kind=kind)
+
+
+def prompt_token_report() -> dict:
+    """
+    Токены промптов по агентам: всего (столько обрабатывалось бы без кэша),
+    взято из кэша сессии, оплачено (без кэша) и средний размер промпта.
+    """
+    report = {}
+    for agent, stats in sorted(prompt_token_stats.items()):
+        prompt, precached, calls = stats["prompt"], stats["precached"], stats["calls"]
+        report[agent] = {
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "precached_tokens": precached,
+            "billed_prompt_tokens": prompt - precached,
+            "avg_prompt_tokens": prompt / calls if calls else 0.0,
+            "cached_share": precached / prompt if prompt else 0.0,
+        }
+    return report
+
+
+def _backoff_delay(attempt: int) -> float:
+    # «equal jitter»: половина паузы фиксирована, половина случайна,
+    # чтобы одновременно получившие 429 не вернулись тоже одновременно
+    cap = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(cap / 2, cap)
+
+
+def _retry_delay(retry_after, attempt: int) -> float:
+    """
+    Пауза перед повтором: Retry-After (секунды или HTTP-дата), иначе экспоненциальная.
+    Пауза из Retry-After приостанавливает и все остальные запросы процесса.
+    """
+    delay = None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        return _backoff_delay(attempt)
+    delay = min(max(delay, 0.0), BACKOFF_MAX)
+    _rate_bucket.pause(delay)
+    return delay
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, не больше burst про запас.
+    Общий для всех клиентов процесса (sync и async), потокобезопасный.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT_RPS, burst: int = RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> float:
+        """
+        Берёт токен и возвращает 0, если он есть; иначе — сколько секунд подождать.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """
+        Сервер попросил подождать (Retry-After): новых запросов не выпускаем.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_rate_bucket = TokenBucket()
+
+
+class _AdaptiveLimit:
+    """
+    Лимит одновременных запросов по схеме AIMD: +1/limit за каждый успешный ответ,
+    вдвое меньше на 429/5xx (не чаще раза в секунду, чтобы пачка отказов не обнулила лимит).
+    """
+
+    def __init__(self, maximum: int = MAX_CONCURRENCY):
+        self.maximum = max(1, maximum)
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+
+    def has_room(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def on_release(self, throttled: bool) -> None:
+        self.in_flight -= 1
+        if throttled:
+            rate_limit_stats["throttled"] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_abandon(self) -> None:
+        """
+        Место вернули без ответа сервера (отмена, обрыв, ошибка клиента):
+        о пропускной способности это ничего не говорит, лимит не трогаем.
+        """
+        self.in_flight -= 1
+
+
+class _Scheduler:
+    """
+    Очередь запросов одного синхронного клиента: выпускает по приоритету
+    (при равном — по порядку прихода), когда есть место в лимите параллельности
+    и токен в общем TokenBucket.
+    """
+
+    def __init__(self, maximum: int = MAX_CONCURRENCY):
+        self.limit = _AdaptiveLimit(maximum)
+        self._waiting = []  # куча (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int) -> None:
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiting, me)
+            queued = False
+            while True:
+                if self._waiting[0] == me and self.limit.has_room():
+                    delay = _rate_bucket.try_take()
+                    if delay == 0:
+                        heapq.heappop(self._waiting)
+                        self.limit.in_flight += 1
+                        # следующий в очереди мог ждать только нас
+                        self._cond.notify_all()
+                        return
+                else:
+                    delay = None
+                if not queued:
+                    queued = True
+                    rate_limit_stats["queued"] += 1
+                self._cond.wait(delay)
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.limit.on_release(throttled)
+            self._cond.notify_all()
+
+    def abandon(self) -> None:
+        with self._cond:
+            self.limit.on_abandon()
+            self._cond.notify_all()
+
+
+class _AsyncScheduler:
+    """
+    То же, что _Scheduler, для корутин одного event loop.
+    """
+
+    def __init__(self, maximum: int = MAX_CONCURRENCY):
+        self.limit = _AdaptiveLimit(maximum)
+        self._waiting = []  # куча (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer = None
+
+    async def acquire(self, priority: int) -> None:
+        if not self._waiting and self.limit.has_room() and _rate_bucket.try_take() == 0:
+            self.limit.in_flight += 1
+            return
+
+        rate_limit_stats["queued"] += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # место уже выдали, но ждавший успел отмениться — возвращаем
+                self.abandon()
+            raise
+
+    def release(self, throttled: bool = False) -> None:
+        self.limit.on_release(throttled)
+        self._wake()
+
+    def abandon(self) -> None:
+        self.limit.on_abandon()
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiting and self.limit.has_room():
+            future = self._waiting[0][2]
+            if future.done():
+                # ждавший отменился
+                heapq.heappop(self._waiting)
+                continue
+            delay = _rate_bucket.try_take()
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                return
+            heapq.heappop(self._waiting)
+            self.limit.in_flight += 1
+            future.set_result(None)
+
 
-    resp = requests.post(url, headers=headers, json=payload, verify=False, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+class GigaChatClient:
+    """
+    Клиент GigaChat с пулом keep-alive соединений и кэшем OAuth-токена.
+
+    Токен обновляется заранее, за TOKEN_REFRESH_MARGIN секунд до expires_at.
+    Если обновление нужно сразу нескольким потокам, к NGW ходит только один,
+    остальные ждут и берут уже свежий токен.
+    """
+
+    def __init__(
+        self,
+        client_id: str = CLIENT_ID,
+        client_secret: str = CLIENT_SECRET,
+        scope: str = SCOPE,
+        model: str = MODEL,
+        pool_size: int = POOL_SIZE,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.model = model
+
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._token = None
+        self._expires_at = 0.0  # unix-время в секундах
+        self._token_lock = threading.Lock()
+
+        self._inflight = {}  # отпечаток запроса → Future с его результатом
+        self._inflight_lock = threading.Lock()
+
+        self._scheduler = _Scheduler()
+
+    # ---------- OAuth ----------
+
+    def _token_is_fresh(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - TOKEN_REFRESH_MARGIN
+
+    def _fetch_token(self) -> None:
+        """
+        Получаем OAuth-токен у NGW и запоминаем срок его жизни.
+        """
+        resp = self.session.post(
+            OAUTH_URL,
+            headers=_oauth_headers(self.client_id, self.client_secret),
+            data=_oauth_payload(self.scope),
+            timeout=30,
+        )
+        resp.raise_for_status()
+        self._token, self._expires_at = _parse_token(resp.json())
+
+    def get_token(self) -> str:
+        """
+        Возвращает действующий токен, при необходимости обновляя его.
+        """
+        if self._token_is_fresh():
+            return self._token
+
+        with self._token_lock:
+            # пока ждали блокировку, токен мог обновить другой поток
+            if not self._token_is_fresh():
+                self._fetch_token()
+            return self._token
+
+    def invalidate_token(self, token: str) -> None:
+        """
+        Помечает токен протухшим (например, сервер ответил 401).
+        """
+        with self._token_lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    # ---------- Прогрев ----------
+
+    def prewarm(self) -> dict:
+        """
+        Получает токен и открывает keep-alive соединение с API (GET /models),
+        чтобы первый вопрос ученика не ждал OAuth и TLS-рукопожатия.
+        Ошибки не выбрасывает: первый настоящий запрос просто попробует снова.
+        Возвращает время этапов в секундах: {"token": ..., "connection": ...}.
+        """
+        timings = {}
+        started = time.perf_counter()
+        try:
+            token = self.get_token()
+            timings["token"] = time.perf_counter() - started
+            started = time.perf_counter()
+            self.session.get(MODELS_URL, headers=_chat_headers(token), timeout=30).close()
+            timings["connection"] = time.perf_counter() - started
+        except NETWORK_ERRORS:
+            metrics.inc("prewarm_errors")
+        return timings
+
+    # ---------- Chat ----------
+
+    def complete(self, messages: list[dict], coalesce: bool = False, agent: str = None, **extra) -> dict:
+        """
+        Отправляет запрос в /chat/completions и возвращает весь JSON ответа.
+        extra — дополнительные поля payload (temperature, functions и т.п.).
+        agent — кто спрашивает (см. AGENT_PRIORITY): от этого зависит место в очереди.
+
+        coalesce=True — если точно такой же запрос уже в полёте (из другого потока),
+        не отправлять второй, а дождаться его результата (или его ошибки).
+        Результат общий для всех ждавших — его нельзя менять на месте.
+        """
+        if not coalesce:
+            return self._complete(messages, agent, **extra)
+
+        key = _request_key(self.model, messages, extra)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            coalesce_stats["shared"] += 1
+            metrics.inc("llm_coalesced", agent=_agent_label(agent))
+            return future.result()
+
+        coalesce_stats["leaders"] += 1
+        try:
+            result = self._complete(messages, agent, **extra)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _post(self, payload: dict, agent: str = None, stream: bool = False) -> requests.Response:
+        """
+        POST в /chat/completions через планировщик: ждёт своей очереди (по приоритету),
+        лимита частоты и параллельности; на 429/5xx и обрывы связи повторяет запрос
+        с паузой из Retry-After или экспоненциальной с джиттером.
+        На 401 один раз обновляет токен. Возвращает успешный ответ, иначе HTTPError.
+        При stream=True место в планировщике остаётся занятым, пока ответ читается:
+        освобождает его вызывающий (release()).
+        """
+        headers_extra = {"Accept": "text/event-stream"} if stream else {}
+        priority = agent_priority(agent)
+        refreshed = False
+        attempt = 0
+        while True:
+            token = self.get_token()
+            headers = {**_chat_headers(token), **_session_headers(agent), **recorder.turn_headers(), **headers_extra}
+            self._scheduler.acquire(priority)
+            try:
+                resp = self.session.post(CHAT_URL, headers=headers, json=payload, timeout=60, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                self._scheduler.release(throttled=True)
+                if attempt >= MAX_RETRIES:
+                    rate_limit_stats["failed"] += 1
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason="connection")
+                    raise
+                delay = _backoff_delay(attempt)
+            except BaseException:
+                # любая другая ошибка (ChunkedEncodingError, InvalidURL, Ctrl+C) тоже освобождает место,
+                # иначе после MAX_CONCURRENCY таких ошибок acquire ждал бы вечно
+                self._scheduler.abandon()
+                raise
+            else:
+                throttled = resp.status_code in RETRY_STATUSES
+                if not (stream and resp.ok):
+                    self._scheduler.release(throttled=throttled)
+                if resp.status_code == 401 and not refreshed:
+                    refreshed = True
+                    resp.close()
+                    self.invalidate_token(token)
+                    continue
+                if not (throttled or resp.ok):
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason=str(resp.status_code))
+                if not throttled:
+                    resp.raise_for_status()
+                    return resp
+                if attempt >= MAX_RETRIES:
+                    rate_limit_stats["failed"] += 1
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason=str(resp.status_code))
+                    resp.raise_for_status()
+                delay = _retry_delay(resp.headers.get("Retry-After"), attempt)
+                resp.close()
+
+            attempt += 1
+            rate_limit_stats["retries"] += 1
+            metrics.inc("llm_retries", agent=_agent_label(agent))
+            time.sleep(delay)
+
+    def _complete(self, messages: list[dict], agent: str = None, **extra) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            **extra,
+        }
+        started = time.perf_counter()
+        with metrics.timer("llm_request_seconds", agent=_agent_label(agent)):
+            data = self._post(payload, agent).json()
+        _record_usage(agent, data)
+        recorder.record_llm(agent, payload, data, time.perf_counter() - started)
+        return data
+
+    def chat(self, messages: list[dict], coalesce: bool = False, agent: str = None) -> str:
+        """
+        Отправляет список messages и возвращает текст ответа ассистента.
+        """
+        data = self.complete(messages, coalesce=coalesce, agent=agent)
+        return data["choices"][0]["message"]["content"]
+
+    def stream(self, messages: list[dict], agent: str = None, **extra):
+        """
+        Потоковый режим (stream: true): генератор кусочков ответа по мере генерации.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            **extra,
+        }
+
+        started = time.perf_counter()
+        resp = self._post(payload, agent, stream=True)
+        parts, usage = [], {}
+        finished = False
+        try:
+            with resp:
+                # байты декодируем сами: без charset requests считает text/* latin-1,
+                # и байт 0x85 из кириллицы в UTF-8 превращается в перевод строки
+                for raw_line in resp.iter_lines():
+                    delta = _parse_sse_line(raw_line.decode("utf-8"), usage)
+                    if delta is None:
+                        break
+                    if delta:
+                        if not parts:
+                            # время до первого кусочка — то, что видит пользователь
+                            metrics.observe(
+                                "llm_first_chunk_seconds", time.perf_counter() - started, agent=_agent_label(agent)
+                            )
+                        parts.append(delta)
+                        yield delta
+            # дочитанный до конца поток учитываем и записываем как обычный ответ
+            finished = True
+            response = _stream_response(parts, usage)
+            _record_usage(agent, response)
+            recorder.record_llm(agent, payload, response, time.perf_counter() - started)
+        except GeneratorExit:
+            # поток бросили, не дочитав
+            recorder.record_llm(agent, payload, None, time.perf_counter() - started, cancelled=True)
+            raise
+        finally:
+            # брошенный или оборванный поток не повод поднимать лимит
+            if finished:
+                self._scheduler.release()
+            else:
+                self._scheduler.abandon()
+            metrics.observe("llm_stream_seconds", time.perf_counter() - started, agent=_agent_label(agent))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncGigaChatClient:
+    """
+    Асинхронный вариант GigaChatClient на aiohttp.
+
+    Один клиент обслуживает сотни одновременных запросов в одном event loop:
+    соединения берутся из общего пула, токен обновляет только одна корутина.
+    Клиент привязан к event loop, в котором был сделан первый запрос.
+    """
+
+    def __init__(
+        self,
+        client_id: str = CLIENT_ID,
+        client_secret: str = CLIENT_SECRET,
+        scope: str = SCOPE,
+        model: str = MODEL,
+        pool_size: int = ASYNC_POOL_SIZE,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.model = model
+        self.pool_size = pool_size
+
+        self._session = None  # aiohttp.ClientSession создаём лениво, уже внутри loop
+        self._token = None
+        self._expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+        self._inflight = {}  # отпечаток запроса → {"task", "waiters"}
+
+        self._scheduler = _AsyncScheduler()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=False)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    # ---------- OAuth ----------
+
+    def _token_is_fresh(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - TOKEN_REFRESH_MARGIN
+
+    async def _fetch_token(self) -> None:
+        session = self._get_session()
+        async with session.post(
+            OAUTH_URL,
+            headers=_oauth_headers(self.client_id, self.client_secret),
+            data=_oauth_payload(self.scope),
+            timeout=aiohttp.ClientTimeout(total=30),
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        self._token, self._expires_at = _parse_token(data)
+
+    async def get_token(self) -> str:
+        if self._token_is_fresh():
+            return self._token
+
+        async with self._token_lock:
+            if not self._token_is_fresh():
+                await self._fetch_token()
+            return self._token
+
+    async def invalidate_token(self, token: str) -> None:
+        async with self._token_lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    # ---------- Прогрев ----------
+
+    async def prewarm(self) -> dict:
+        """
+        Асинхронный вариант GigaChatClient.prewarm.
+        """
+        timings = {}
+        started = time.perf_counter()
+        try:
+            token = await self.get_token()
+            timings["token"] = time.perf_counter() - started
+            started = time.perf_counter()
+            async with self._get_session().get(
+                MODELS_URL,
+                headers=_chat_headers(token),
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as resp:
+                await resp.read()
+            timings["connection"] = time.perf_counter() - started
+        except NETWORK_ERRORS:
+            metrics.inc("prewarm_errors")
+        return timings
 
-    return data["choices"][0]["message"]["content"]
+    # ---------- Chat ----------
 
+    async def complete(self, messages: list[dict], coalesce: bool = False, agent: str = None, **extra) -> dict:
+        """
+        Асинхронный вариант GigaChatClient.complete.
+
+        При coalesce=True запрос выполняется отдельной задачей, которую ждут все
+        одинаковые вызовы. Отмена одного из ждущих не мешает остальным;
+        задача отменяется, только когда её не ждёт уже никто.
+        """
+        if not coalesce:
+            return await self._complete(messages, agent, **extra)
+
+        key = _request_key(self.model, messages, extra)
+        entry = self._inflight.get(key)
+        if entry is None:
+            coalesce_stats["leaders"] += 1
+            task = asyncio.ensure_future(self._complete(messages, agent, **extra))
+            entry = self._inflight[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda t: self._forget_inflight(key, entry, t))
+        else:
+            coalesce_stats["shared"] += 1
+            metrics.inc("llm_coalesced", agent=_agent_label(agent))
+
+        task = entry["task"]
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not task.done():
+                # новые вызовы не должны присоединиться к отменяемой задаче
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+
+    def _forget_inflight(self, key: str, entry: dict, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+        # ошибку уже получили ждавшие; если не ждал никто — не даём ей всплыть как «never retrieved»
+        if not task.cancelled():
+            task.exception()
+
+    async def _post(self, payload: dict, agent: str = None, stream: bool = False) -> aiohttp.ClientResponse:
+        """
+        Асинхронный вариант GigaChatClient._post (те же очередь, лимиты и повторы).
+        """
+        session = self._get_session()
+        headers_extra = {"Accept": "text/event-stream"} if stream else {}
+        priority = agent_priority(agent)
+        refreshed = False
+        attempt = 0
+        while True:
+            token = await self.get_token()
+            headers = {**_chat_headers(token), **_session_headers(agent), **recorder.turn_headers(), **headers_extra}
+            await self._scheduler.acquire(priority)
+            try:
+                resp = await session.post(
+                    CHAT_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=60),
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._scheduler.release(throttled=True)
+                if attempt >= MAX_RETRIES:
+                    rate_limit_stats["failed"] += 1
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason="connection")
+                    raise
+                delay = _backoff_delay(attempt)
+            except BaseException:
+                self._scheduler.abandon()
+                raise
+            else:
+                throttled = resp.status in RETRY_STATUSES
+                if not (stream and resp.ok):
+                    self._scheduler.release(throttled=throttled)
+                if resp.status == 401 and not refreshed:
+                    refreshed = True
+                    resp.release()
+                    await self.invalidate_token(token)
+                    continue
+                if not (throttled or resp.ok):
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason=str(resp.status))
+                if not throttled:
+                    resp.raise_for_status()
+                    return resp
+                if attempt >= MAX_RETRIES:
+                    rate_limit_stats["failed"] += 1
+                    metrics.inc("llm_errors", agent=_agent_label(agent), reason=str(resp.status))
+                    resp.raise_for_status()
+                delay = _retry_delay(resp.headers.get("Retry-After"), attempt)
+                resp.release()
+
+            attempt += 1
+            rate_limit_stats["retries"] += 1
+            metrics.inc("llm_retries", agent=_agent_label(agent))
+            await asyncio.sleep(delay)
+
+    async def _complete(self, messages: list[dict], agent: str = None, **extra) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            **extra,
+        }
+        started = time.perf_counter()
+        try:
+            with metrics.timer("llm_request_seconds", agent=_agent_label(agent)):
+                resp = await self._post(payload, agent)
+                async with resp:
+                    data = await resp.json(content_type=None)
+        except asyncio.CancelledError:
+            # отменённый запрос (спекуляция, заготовка) тоже пишем — replay должен знать, что он был
+            recorder.record_llm(agent, payload, None, time.perf_counter() - started, cancelled=True)
+            raise
+        _record_usage(agent, data)
+        recorder.record_llm(agent, payload, data, time.perf_counter() - started)
+        return data
+
+    async def chat(self, messages: list[dict], coalesce: bool = False, agent: str = None) -> str:
+        data = await self.complete(messages, coalesce=coalesce, agent=agent)
+        return data["choices"][0]["message"]["content"]
+
+    async def astream(self, messages: list[dict], agent: str = None, **extra):
+        """
+        Асинхронный потоковый режим: async-итератор кусочков ответа.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            **extra,
+        }
+
+        started = time.perf_counter()
+        try:
+            resp = await self._post(payload, agent, stream=True)
+        except asyncio.CancelledError:
+            recorder.record_llm(agent, payload, None, time.perf_counter() - started, cancelled=True)
+            raise
+        parts, usage = [], {}
+        finished = False
+        try:
+            async with resp:
+                async for raw_line in resp.content:
+                    delta = _parse_sse_line(raw_line.decode("utf-8").strip(), usage)
+                    if delta is None:
+                        break
+                    if delta:
+                        if not parts:
+                            # время до первого кусочка — то, что видит пользователь
+                            metrics.observe(
+                                "llm_first_chunk_seconds", time.perf_counter() - started, agent=_agent_label(agent)
+                            )
+                        parts.append(delta)
+                        yield delta
+            # дочитанный до конца поток учитываем и записываем как обычный ответ
+            finished = True
+            response = _stream_response(parts, usage)
+            _record_usage(agent, response)
+            recorder.record_llm(agent, payload, response, time.perf_counter() - started)
+        except (asyncio.CancelledError, GeneratorExit):
+            # поток бросили, не дочитав
+            recorder.record_llm(agent, payload, None, time.perf_counter() - started, cancelled=True)
+            raise
+        finally:
+            # брошенный или оборванный поток не повод поднимать лимит
+            if finished:
+                self._scheduler.release()
+            else:
+                self._scheduler.abandon()
+            metrics.observe("llm_stream_seconds", time.perf_counter() - started, agent=_agent_label(agent))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+_default_async_client = None
+
+
+def get_client() -> GigaChatClient:
+    """
+    Общий клиент на процесс (создаётся при первом обращении).
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = GigaChatClient()
+    return _default_client
+
+
+def get_async_client() -> AsyncGigaChatClient:
+    """
+    Общий асинхронный клиент (один на event loop приложения).
+    """
+    global _default_async_client
+    if _default_async_client is None:
+        _default_async_client = AsyncGigaChatClient()
+    return _default_async_client
+
+
+def get_access_token() -> str:
+    """
+    Получаем OAuth-токен у NGW (через кэш общего клиента).
+    """
+    return get_client().get_token()
+
+
+def chat_with_gigachat_messages(
+    client: GigaChatClient,
+    messages: list[dict],
+    coalesce: bool = False,
+    agent: str = None,
+) -> str:
+    """
+    Общая функция: отправляет список messages в GigaChat и возвращает ответ ассистента.
+    messages — это список словарей вида {"role": "...", "content": "..."}.
+    coalesce=True — одинаковые одновременные запросы получают один общий ответ
+    (включать там, где один ответ на всех допустим).
+    agent — имя агента для приоритета в очереди запросов (AGENT_PRIORITY).
+    """
+    return client.chat(messages, coalesce=coalesce, agent=agent)
+
+
+async def chat_with_gigachat_messages_async(
+    client: AsyncGigaChatClient,
+    messages: list[dict],
+    coalesce: bool = False,
+    agent: str = None,
+) -> str:
+    """
+    Асинхронный вариант chat_with_gigachat_messages.
+    """
+    return await client.chat(messages, coalesce=coalesce, agent=agent)
+
+
+def _simple_messages(user_message: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": "Ты дружелюбный помощник.",
+        },
+        {
+            "role": "user",
+            "content": user_message,
+        },
+    ]
+
+
+def chat_with_gigachat(client: GigaChatClient, user_message: str, agent: str = None) -> str:
+    """
+    Отправляем сообщение в GigaChat и получаем ответ .
+    """
+    return client.chat(_simple_messages(user_message), agent=agent)
+
+
+async def chat_with_gigachat_async(client: AsyncGigaChatClient, user_message: str, agent: str = None) -> str:
+    """
+    Асинхронный вариант chat_with_gigachat.
+    """
+    return await client.chat(_simple_messages(user_message), agent=agent)
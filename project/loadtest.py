@@ -0,0 +1,265 @@
+# loadtest.py
+#
+# Нагрузочный прогон Lumira без реального GigaChat: N учеников одновременно
+# проходят сценарий «объяснение → тест → ответы → прогресс» через те же вызовы,
+# что и main.py (SessionManager.handle с потоковым выводом, format_progress),
+# а на запросы отвечает локальный mock_gigachat.py.
+#
+#   python loadtest.py --students 50 --latency lognormal:0.6,0.5 --throttle-rate 0.02
+#
+# В конце — пропускная способность (реплик в секунду), p50/p95/p99 времени реплики
+# и токены промптов по агентам: всего и сколько из них взято из кэша контекста
+# (сравнить с прогоном без кэша — LUMIRA_SESSION_CACHE=0).
+# Базы (банк тестов, темы, прогресс) создаются во временном каталоге, если их
+# пути не заданы явно через LUMIRA_EXAM_BANK / LUMIRA_TOPIC_INDEX / LUMIRA_PROGRESS_DB.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from mock_gigachat import MockGigaChat
+
+
+TOPICS = [
+    "интегралы",
+    "производные",
+    "планеты Солнечной системы",
+    "фотосинтез",
+    "второй закон Ньютона",
+    "квадратные уравнения",
+    "Великая французская революция",
+    "строение клетки",
+    "закон Ома",
+    "теорема Пифагора",
+]
+
+# Сценарий ученика: (шаг, реплика); {topic} и {answers} подставляются для каждого ученика
+SCRIPT = [
+    ("explain", "Объясни, что такое {topic}"),
+    ("more", "Расскажи подробнее"),
+    ("test", "Сделай тест по этой теме"),
+    ("answers", "{answers}"),
+    ("progress", "progress"),
+]
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга (sorted_values уже отсортирован).
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))   # округление вверх
+    return sorted_values[int(rank) - 1]
+
+
+def configure(url: str, rps: Optional[float] = None) -> None:
+    """
+    Направляет Lumira на url (mock) и кладёт базы во временный каталог.
+    Всё это читается при импорте gigachat_api / sessions, поэтому вызывать — до него.
+    """
+    os.environ["LUMIRA_GIGACHAT_AUTH_URL"] = url
+    os.environ["LUMIRA_GIGACHAT_API_URL"] = url
+    if rps is not None:
+        os.environ["LUMIRA_RATE_LIMIT_RPS"] = str(rps)
+        os.environ["LUMIRA_RATE_LIMIT_BURST"] = str(max(1, int(rps * 2)))
+    workdir = tempfile.mkdtemp(prefix="lumira-loadtest-")
+    for name, filename in (
+        ("LUMIRA_EXAM_BANK", "exam_bank.sqlite3"),
+        ("LUMIRA_TOPIC_INDEX", "topics.sqlite3"),
+        ("LUMIRA_PROGRESS_DB", "progress.sqlite3"),
+    ):
+        os.environ.setdefault(name, os.path.join(workdir, filename))
+
+
+def _random_answers(rng: random.Random, count: int = 5) -> str:
+    return " ".join(f"{i}{rng.choice('ABCD')}" for i in range(1, count + 1))
+
+
+async def _student(manager, student_id: str, rng: random.Random, think: float, results: Dict) -> None:
+    from sessions import format_progress
+
+    topic = rng.choice(TOPICS)
+    answers = _random_answers(rng)
+
+    for step, template in SCRIPT:
+        user_text = template.format(topic=topic, answers=answers)
+        first_delta: List[float] = []
+        started = time.perf_counter()
+
+        def on_delta(delta, first_delta=first_delta, started=started):
+            if not first_delta:
+                first_delta.append(time.perf_counter() - started)
+
+        try:
+            # как в main.run_cli: «progress» показывается без обращения к модели
+            if user_text == "progress":
+                format_progress(manager.get_state(student_id))
+            else:
+                await manager.handle(student_id, user_text, on_delta)
+        except Exception as e:
+            results["errors"][type(e).__name__] = results["errors"].get(type(e).__name__, 0) + 1
+        else:
+            elapsed = time.perf_counter() - started
+            results["turns"].setdefault(step, []).append(elapsed)
+            if first_delta:
+                results["first_chunk"].append(first_delta[0])
+
+        if think > 0:
+            await asyncio.sleep(rng.expovariate(1.0 / think))
+
+    manager.end_session(student_id)
+
+
+async def run_load(students: int, think: float = 0.0, ramp: float = 0.0, seed: int = 0) -> Dict:
+    """
+    Прогоняет students учеников одновременно (старт размазан по ramp секундам)
+    и возвращает {"turns": {шаг: [время, ...]}, "first_chunk": [...], "errors": {...}, "wall_s": ...}.
+    Адреса GigaChat и пути к базам должны быть настроены до вызова.
+    """
+    from sessions import SessionManager
+
+    manager = SessionManager()
+    results = {"turns": {}, "first_chunk": [], "errors": {}}
+
+    async def delayed(i: int) -> None:
+        if ramp > 0:
+            await asyncio.sleep(ramp * i / students)
+        await _student(manager, f"student-{i}", random.Random(seed + i), think, results)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(delayed(i) for i in range(students)))
+    finally:
+        await manager.close()
+    results["wall_s"] = time.perf_counter() - started
+    return results
+
+
+def summarize(results: Dict) -> Dict:
+    """
+    Итоги прогона: пропускная способность и перцентили времени реплики (всего и по шагам).
+    """
+    all_turns = sorted(t for times in results["turns"].values() for t in times)
+
+    def stats(values: List[float]) -> Dict:
+        values = sorted(values)
+        report = {"count": len(values)}
+        for p in PERCENTILES:
+            report[f"p{p}"] = percentile(values, p)
+        report["max"] = values[-1] if values else 0.0
+        return report
+
+    return {
+        "turns": len(all_turns),
+        "errors": sum(results["errors"].values()),
+        "error_types": results["errors"],
+        "wall_s": results["wall_s"],
+        "throughput": len(all_turns) / results["wall_s"] if results["wall_s"] else 0.0,
+        "latency": {"all": stats(all_turns), **{step: stats(v) for step, v in results["turns"].items()}},
+        "first_chunk": stats(results["first_chunk"]),
+    }
+
+
+def format_summary(summary: Dict, students: int) -> str:
+    lines = [
+        f"Учеников: {students}, реплик: {summary['turns']}, ошибок: {summary['errors']} {summary['error_types'] or ''}",
+        f"Время прогона: {summary['wall_s']:.1f} с, пропускная способность: {summary['throughput']:.2f} реплик/с",
+        "",
+        f"{'время реплики, с':<18}{'n':>6}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'max':>9}",
+    ]
+    rows = list(summary["latency"].items()) + [("первый кусочек", summary["first_chunk"])]
+    for name, s in rows:
+        lines.append(
+            f"{name:<18}{s['count']:>6}" + "".join(f"{s['p' + str(p)]:>9.3f}" for p in PERCENTILES) + f"{s['max']:>9.3f}"
+        )
+    return "\n".join(lines)
+
+
+def format_prompt_tokens(report: Dict) -> str:
+    """
+    Таблица gigachat_api.prompt_token_report: токены промптов без кэша и с ним.
+    """
+    lines = [
+        f"{'токены промптов':<24}{'запросов':>9}{'средний':>9}{'без кэша':>10}{'из кэша':>9}{'с кэшем':>9}{'доля':>7}"
+    ]
+    totals = {"calls": 0, "prompt_tokens": 0, "precached_tokens": 0, "billed_prompt_tokens": 0}
+    for agent, r in report.items():
+        for key in totals:
+            totals[key] += r[key]
+        lines.append(
+            f"{agent:<24}{r['calls']:>9}{r['avg_prompt_tokens']:>9.0f}{r['prompt_tokens']:>10}"
+            f"{r['precached_tokens']:>9}{r['billed_prompt_tokens']:>9}{r['cached_share']:>7.0%}"
+        )
+    if totals["prompt_tokens"]:
+        lines.append(
+            f"{'всего':<24}{totals['calls']:>9}{totals['prompt_tokens'] / totals['calls']:>9.0f}"
+            f"{totals['prompt_tokens']:>10}{totals['precached_tokens']:>9}{totals['billed_prompt_tokens']:>9}"
+            f"{totals['precached_tokens'] / totals['prompt_tokens']:>7.0%}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон Lumira на mock GigaChat")
+    parser.add_argument("--students", type=int, default=20, help="сколько учеников одновременно")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза ученика между репликами, с")
+    parser.add_argument("--ramp", type=float, default=0.0, help="за сколько секунд стартуют все ученики")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="lognormal:0.6,0.5", help="задержка mock-а (см. mock_gigachat.parse_latency)")
+    parser.add_argument("--token-time", type=float, default=0.005, help="добавка mock-а на токен ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--rps", type=float, help="LUMIRA_RATE_LIMIT_RPS на время прогона (по умолчанию — как настроено)")
+    parser.add_argument("--url", help="не поднимать mock, а ходить в уже запущенный (базовый адрес)")
+    parser.add_argument("--json", help="куда сохранить итоги в JSON")
+    args = parser.parse_args()
+
+    mock = None
+    if args.url is None:
+        mock = MockGigaChat(
+            latency=args.latency,
+            token_time=args.token_time,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            retry_after=args.retry_after,
+            seed=args.seed,
+        ).start()
+    url = args.url or mock.url
+
+    configure(url, args.rps)
+
+    try:
+        results = asyncio.run(run_load(args.students, args.think, args.ramp, args.seed))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    import metrics
+    from gigachat_api import prompt_token_report
+
+    summary = summarize(results)
+    summary["prompt_tokens"] = prompt_token_report()
+    print(format_summary(summary, args.students))
+    print("\n" + format_prompt_tokens(summary["prompt_tokens"]))
+    if mock is not None:
+        summary["mock"] = mock.stats
+        print(f"\nЗапросов к mock: {mock.stats['requests']} {mock.stats['by_agent']}, "
+              f"подмешано 429: {mock.stats['throttled']}, 500: {mock.stats['errors']}")
+
+    if args.json:
+        summary["metrics"] = metrics.snapshot()
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
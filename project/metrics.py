@@ -0,0 +1,315 @@
+# metrics.py
+#
+# Встроенные метрики без внешних зависимостей:
+# - гистограммы задержек и счётчики с метками (агент, источник и т.п.);
+# - сборщики — функции, отдающие уже существующие словари статистики
+#   (кэши, склейка запросов, лимиты, маршрутизатор);
+# - трассировка реплики: вложенные интервалы (span) от маршрута до ответа агента.
+#
+# Снаружи видно через snapshot() (словарь), render_prometheus() (текстовый формат
+# Prometheus), файл LUMIRA_METRICS_FILE и/или HTTP на порту LUMIRA_METRICS_PORT
+# (GET /metrics — Prometheus, GET /snapshot — JSON).
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+METRICS_FILE = os.getenv("LUMIRA_METRICS_FILE")
+METRICS_PORT = int(os.getenv("LUMIRA_METRICS_PORT", "0"))
+
+# Файл переписываем не чаще раза в столько секунд
+METRICS_FILE_INTERVAL = 1.0
+
+# Сколько последних трасс реплик держим в памяти
+TRACES_KEEP = 100
+
+PREFIX = "lumira_"
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+_histograms: Dict[Tuple[str, Labels], Dict] = {}
+_collectors: Dict[str, Callable[[], Dict]] = {}
+_traces = deque(maxlen=TRACES_KEEP)
+_current_trace = contextvars.ContextVar("lumira_trace", default=None)
+_file_written = 0.0
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """
+    Увеличивает счётчик name с метками labels.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """
+    Добавляет наблюдение в гистограмму name (по умолчанию — задержки в секундах).
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+                break
+        hist["count"] += 1
+        hist["sum"] += seconds
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Замеряет блок: гистограмма name и, если идёт трасса реплики, span с тем же именем.
+    """
+    started = time.perf_counter()
+    with span(":".join([name, *(str(v) for v in labels.values() if v is not None)])):
+        try:
+            yield
+        finally:
+            observe(name, time.perf_counter() - started, **labels)
+
+
+def register_collector(name: str, collect: Callable[[], Dict]) -> None:
+    """
+    Подключает существующую статистику: collect() возвращает {ключ: число}
+    или {группа: {ключ: число}} — она попадает в снимок и в Prometheus как есть.
+    """
+    _collectors[name] = collect
+
+
+# ---------- Трассировка реплики ----------
+
+@contextmanager
+def trace(name: str, **attrs):
+    """
+    Трасса одной реплики: все span() внутри (в том числе в запросах к GigaChat)
+    записываются в неё со смещением от начала. Готовая трасса — в snapshot()["traces"].
+    """
+    # служебные поля с «_» в снимок не попадают
+    record = {"name": name, **attrs, "started": time.time(), "spans": [], "_t0": time.perf_counter(), "_open": True}
+    token = _current_trace.set(record)
+    try:
+        yield record
+    finally:
+        _current_trace.reset(token)
+        record["_open"] = False
+        record["duration_s"] = round(time.perf_counter() - record["_t0"], 4)
+        with _lock:
+            _traces.append(record)
+        _maybe_write_file()
+
+
+def annotate(**attrs) -> None:
+    """
+    Дописывает поля в текущую трассу (маршрут, агент и т.п.); вне трассы ничего не делает.
+    """
+    record = _current_trace.get()
+    if record is not None:
+        record.update(attrs)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Интервал внутри текущей трассы; вне трассы ничего не делает.
+    Фоновые задачи, запущенные из реплики, наследуют трассу, но после её
+    окончания свои интервалы уже не дописывают.
+    """
+    record = _current_trace.get()
+    if record is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record["_open"]:
+            record["spans"].append({
+                "name": name,
+                "start_s": round(started - record["_t0"], 4),
+                "duration_s": round(time.perf_counter() - started, 4),
+            })
+
+
+# ---------- Вывод ----------
+
+def _collect() -> Dict[str, Dict]:
+    result = {}
+    for name, collect in list(_collectors.items()):
+        try:
+            result[name] = collect()
+        except Exception:
+            continue
+    return result
+
+
+def snapshot() -> Dict:
+    """
+    Все метрики одним словарем (для тестов, отчётов и /snapshot).
+    """
+    with _lock:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _counters.items()]
+        histograms = [
+            {
+                "name": n,
+                "labels": dict(l),
+                "count": h["count"],
+                "sum": h["sum"],
+                "avg": h["sum"] / h["count"] if h["count"] else 0.0,
+                "buckets": dict(zip(LATENCY_BUCKETS, h["buckets"])),
+            }
+            for (n, l), h in _histograms.items()
+        ]
+        traces = [{k: v for k, v in t.items() if not k.startswith("_")} for t in _traces]
+    return {"counters": counters, "histograms": histograms, "collectors": _collect(), "traces": traces}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _metric_name(*parts: str) -> str:
+    name = PREFIX + "_".join(parts)
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+def render_prometheus() -> str:
+    """
+    Текстовый формат Prometheus (exposition format 0.0.4).
+    """
+    lines: List[str] = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+
+    typed = set()
+    for (name, labels), value in counters:
+        metric = _metric_name(name, "total")
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    for (name, labels), hist in histograms:
+        metric = _metric_name(name)
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+            cumulative += count
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {hist['count']}")
+
+    # сборщики отдаём как gauge: {ключ: число} → lumira_<сборщик>_<ключ>,
+    # {группа: {ключ: число}} → lumira_<сборщик>_<ключ>{key="группа"}
+    for collector, values in sorted(_collect().items()):
+        for key, value in sorted(values.items()):
+            if isinstance(value, dict):
+                for sub_key, sub_value in sorted(value.items()):
+                    if isinstance(sub_value, (int, float)):
+                        metric = _metric_name(collector, sub_key)
+                        if metric not in typed:
+                            typed.add(metric)
+                            lines.append(f"# TYPE {metric} gauge")
+                        lines.append(f"{metric}{_format_labels((('key', key),))} {sub_value}")
+            elif isinstance(value, (int, float)):
+                metric = _metric_name(collector, key)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: Optional[str] = METRICS_FILE) -> None:
+    """
+    Записывает метрики в файл (атомарно: через временный файл и rename) —
+    например, для textfile-коллектора node_exporter.
+    """
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def _maybe_write_file() -> None:
+    global _file_written
+    if not METRICS_FILE:
+        return
+    now = time.monotonic()
+    if now - _file_written < METRICS_FILE_INTERVAL:
+        return
+    _file_written = now
+    try:
+        write_file(METRICS_FILE)
+    except OSError:
+        pass
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/metrics"):
+            body = render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.startswith("/snapshot"):
+            body = json.dumps(snapshot(), ensure_ascii=False, default=str).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """
+    Поднимает /metrics и /snapshot в фоновом потоке (один раз на процесс).
+    """
+    global _server
+    if _server is not None or not port:
+        return _server
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
@@ -0,0 +1,416 @@
+# mock_gigachat.py
+#
+# Локальный заменитель GigaChat для нагрузочных прогонов без расхода квоты:
+# те же /api/v2/oauth и /api/v1/chat/completions (в том числе stream и function_call),
+# задержки из заданного распределения, подмешивание 429/500 и заготовленные
+# ответы под каждого агента Lumira. Кэш контекста по X-Session-ID тоже имитируется:
+# совпадающие с прошлым запросом той же сессии сообщения идут в precached_prompt_tokens.
+#
+# Запуск отдельно:
+#   python mock_gigachat.py --port 8090 --latency lognormal:0.6,0.5 --throttle-rate 0.02
+# и затем Lumira с
+#   LUMIRA_GIGACHAT_AUTH_URL=http://127.0.0.1:8090 LUMIRA_GIGACHAT_API_URL=http://127.0.0.1:8090
+# (loadtest.py поднимает его сам).
+
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from utils.exam import EXAM_QUESTIONS, OPTIONS, Exam, Question
+
+
+# Сколько живёт выданный токен, секунды
+TOKEN_LIFETIME = 30 * 60
+
+_ANSWERS_RE = re.compile(r"\d+\s*[a-dA-D]")
+_TEST_RE = re.compile(r"\b(тест(?:ик)?(?:а|у|ом|е|ы|ов|и)?|tests?|quiz)\b")
+_SAME_TOPIC_RE = re.compile(r"\b(по этой теме|по теме выше|по ней|по этому|this topic|about it|on it|on this|this part)\b")
+_CONTINUE_RE = re.compile(r"\b(ещ[её]|продолж\w*|подробн\w*|дальше|more|continue|go on)\b")
+_FILLER = (
+    "Это понятие удобно объяснить на простом примере. "
+    "Сначала разберём определение, затем посмотрим, как оно работает на практике. "
+    "Обрати внимание на ключевую идею: каждое следующее утверждение опирается на предыдущее. "
+    "Если что-то осталось непонятным, попроси объяснить по шагам. "
+    "В задачах это чаще всего встречается в виде стандартной формулировки. "
+    "Полезно сравнить это с тем, что ты уже знаешь из соседних тем. "
+)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Распределение задержки ответа, секунды:
+    "0.5" или "const:0.5", "uniform:0.2,1.5", "normal:0.8,0.2",
+    "lognormal:<медиана>,<sigma>", "exp:<среднее>".
+    """
+    name, _, params = spec.partition(":")
+    if not params:
+        name, params = "const", name
+    values = [float(v) for v in params.split(",")]
+
+    if name == "const":
+        return lambda rng: values[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if name == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    if name == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"неизвестное распределение задержки: {spec!r}")
+
+
+def _count_tokens(text: str) -> int:
+    # та же оценка, что в agents/tutor_memory.count_tokens: ~3 символа на токен
+    return len(text) // 3 + 1
+
+
+def _last_user(messages: List[Dict]) -> str:
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            return str(m.get("content") or "")
+    return ""
+
+
+def detect_agent(payload: Dict) -> str:
+    """
+    Какой агент Lumira спрашивает — по функции или по системному промпту.
+    """
+    functions = payload.get("functions") or []
+    if functions:
+        return functions[0]["name"]   # make_exam / explain_steps
+
+    messages = payload.get("messages") or []
+    system = " ".join(str(m.get("content") or "") for m in messages if m.get("role") == "system")
+    everything = " ".join(str(m.get("content") or "") for m in messages)
+    if "Moderator" in system:
+        return "fused" if "ROUTE:" in system else "moderator"
+    if "конспект" in system:
+        return "summary"
+    if "THEME:" in everything:
+        return "examiner"
+    if "Переформулируй этот шаг" in everything:
+        return "simplify"
+    return "tutor"
+
+
+def _route(text: str) -> Tuple[int, int]:
+    # правила MODERATOR_PROMPT: новая тема — 1; продолжение, «по этой теме»
+    # и короткие фразы без нового предмета — 0
+    lowered = text.lower().strip(" .!?")
+    if _ANSWERS_RE.search(text) and len(_ANSWERS_RE.findall(text)) >= 3:
+        return 3, 0
+    test = _TEST_RE.search(lowered)
+    if test:
+        tail = lowered[test.end():].strip()
+        return 2, 0 if not tail or _SAME_TOPIC_RE.search(tail) else 1
+    if "шаг" in lowered or "step" in lowered or lowered.startswith(("реши", "solve")):
+        return 4, 0 if _SAME_TOPIC_RE.search(lowered) else 1
+    if _CONTINUE_RE.search(lowered) or len(lowered.split()) <= 2:
+        return 1, 0
+    return 1, 1
+
+
+def _paragraph(rng: random.Random, topic: str, sentences: Tuple[int, int]) -> str:
+    pool = _FILLER.split(". ")
+    body = ". ".join(rng.choice(pool).strip(". ") for _ in range(rng.randint(*sentences))) + "."
+    return f"Разберём тему «{topic[:60]}». {body}"
+
+
+def _mock_exam(rng: random.Random, topic: str) -> Exam:
+    questions = tuple(
+        Question(i, f"Вопрос {i} по теме «{topic[:40]}»?", tuple(f"Вариант {letter}" for letter in OPTIONS))
+        for i in range(1, EXAM_QUESTIONS + 1)
+    )
+    return Exam(topic[:60] or "Тема", questions, "".join(rng.choice(OPTIONS) for _ in questions))
+
+
+def canned_reply(agent: str, payload: Dict, rng: random.Random) -> Dict:
+    """
+    message ответа (content или function_call) под агента.
+    """
+    text = _last_user(payload.get("messages") or [])
+
+    if agent == "moderator":
+        return {"role": "assistant", "content": "%d %d" % _route(text)}
+    if agent == "fused":
+        route = _route(text)
+        content = "ROUTE: %d %d" % route
+        if route[0] == 1:
+            content += "\n" + _paragraph(rng, text, (3, 8))
+        return {"role": "assistant", "content": content}
+    if agent == "make_exam":
+        exam = _mock_exam(rng, text)
+        arguments = {
+            "theme": exam.theme,
+            "questions": [
+                {"text": q.text, "options": list(q.options), "answer": answer}
+                for q, answer in zip(exam.questions, exam.answers)
+            ],
+        }
+        return {"role": "assistant", "content": "", "function_call": {"name": agent, "arguments": arguments}}
+    if agent == "explain_steps":
+        steps = [_paragraph(rng, f"шаг {i}", (1, 3)) for i in range(1, 4)]
+        return {"role": "assistant", "content": "", "function_call": {"name": agent, "arguments": {"steps": steps}}}
+    if agent == "examiner":
+        exam = _mock_exam(rng, text)
+        answers = " ".join(f"{i}{letter}" for i, letter in enumerate(exam.answers, start=1))
+        content = f"THEME: {exam.theme}\nANSWERS: {answers}\n\nQUESTIONS:\n{exam.questions_text}"
+        return {"role": "assistant", "content": content}
+    if agent in ("summary", "simplify"):
+        return {"role": "assistant", "content": _paragraph(rng, text, (1, 3))}
+    return {"role": "assistant", "content": _paragraph(rng, text, (3, 8))}
+
+
+class MockGigaChat:
+    """
+    HTTP-сервер в фоновом потоке. stats — сколько запросов пришло
+    (по агентам) и сколько ошибок подмешано.
+
+    latency — распределение задержки до ответа (parse_latency),
+    token_time — добавка на каждый токен ответа (длинные ответы отвечаются дольше),
+    error_rate / throttle_rate — доля ответов 500 / 429 (с Retry-After: retry_after).
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: str = "lognormal:0.6,0.5",
+        token_time: float = 0.005,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = parse_latency(latency)
+        self.token_time = token_time
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stats = {
+            "oauth": 0, "requests": 0, "errors": 0, "throttled": 0, "by_agent": {},
+            "prompt_tokens": 0, "precached_tokens": 0,
+        }
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # X-Session-ID → сообщения последнего запроса этой сессии
+        self._contexts: Dict[str, List[Dict]] = {}
+        self._server = _MockServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockGigaChat":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-gigachat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockGigaChat":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ---------- для обработчика ----------
+
+    def _count(self, key: str, agent: Optional[str] = None) -> None:
+        with self._lock:
+            self.stats[key] += 1
+            if agent is not None:
+                by_agent = self.stats["by_agent"]
+                by_agent[agent] = by_agent.get(agent, 0) + 1
+
+    def _usage(self, session_id: Optional[str], messages: List[Dict], completion_tokens: int) -> Dict:
+        # из кэша — общие с прошлым запросом сессии сообщения в начале промпта
+        tokens = [_count_tokens(str(m.get("content") or "")) for m in messages]
+        precached = 0
+        with self._lock:
+            if session_id:
+                previous = self._contexts.get(session_id, [])
+                for i, (old, new) in enumerate(zip(previous, messages)):
+                    if old != new:
+                        break
+                    precached += tokens[i]
+                self._contexts[session_id] = messages
+            self.stats["prompt_tokens"] += sum(tokens)
+            self.stats["precached_tokens"] += precached
+        return {
+            "prompt_tokens": sum(tokens),
+            "completion_tokens": completion_tokens,
+            "total_tokens": sum(tokens) + completion_tokens,
+            "precached_prompt_tokens": precached,
+        }
+
+    # _draw и _reply переопределяет replay.ReplayGigaChat; turn — заголовок
+    # recorder.TURN_HEADER (реплика воспроизводимой сессии) или None
+
+    def _draw(self, payload: Dict, turn: Optional[str] = None) -> Tuple[float, float]:
+        # (случайное число для ошибок, задержка) — Random не потокобезопасен
+        with self._lock:
+            return self._rng.random(), self.latency(self._rng)
+
+    def _reply(self, agent: str, payload: Dict, turn: Optional[str] = None) -> Dict:
+        with self._lock:
+            return canned_reply(agent, payload, self._rng)
+
+
+class _MockServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address) -> None:
+        # клиент закрыл соединение сам (отменённый спекулятивный поток, остановка) — это не ошибка
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        # /api/v1/models — им клиент прогревает соединение при старте
+        if not self.path.rstrip("/").endswith("/api/v1/models"):
+            self._send_json(404, {"message": "not found"})
+            return
+        self._send_json(200, {"object": "list", "data": [{"id": "GigaChat", "object": "model", "owned_by": "mock"}]})
+
+    def do_POST(self) -> None:
+        mock: MockGigaChat = self.server.mock
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if self.path.rstrip("/").endswith("/api/v2/oauth"):
+            mock._count("oauth")
+            self._send_json(200, {
+                "access_token": uuid.uuid4().hex,
+                "expires_at": int((time.time() + TOKEN_LIFETIME) * 1000),
+            })
+            return
+
+        if not self.path.rstrip("/").endswith("/api/v1/chat/completions"):
+            self._send_json(404, {"message": "not found"})
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send_json(401, {"message": "no token"})
+            return
+
+        payload = json.loads(raw or b"{}")
+        agent = detect_agent(payload)
+        mock._count("requests", agent)
+
+        turn = self.headers.get("X-Lumira-Turn")
+        turn = unquote(turn) if turn else None
+        roll, delay = mock._draw(payload, turn)
+        if roll < mock.throttle_rate:
+            mock._count("throttled")
+            self._send_json(429, {"message": "Too Many Requests"}, {"Retry-After": f"{mock.retry_after:g}"})
+            return
+        if roll < mock.throttle_rate + mock.error_rate:
+            mock._count("errors")
+            time.sleep(delay)
+            self._send_json(500, {"message": "Internal Server Error"})
+            return
+
+        message = mock._reply(agent, payload, turn)
+        content = message.get("content") or json.dumps(message.get("function_call", {}), ensure_ascii=False)
+        usage = mock._usage(self.headers.get("X-Session-ID"), payload.get("messages", []), _count_tokens(content))
+
+        if payload.get("stream"):
+            self._stream(message["content"], delay, mock.token_time, usage)
+            return
+
+        time.sleep(delay + usage["completion_tokens"] * mock.token_time)
+        self._send_json(200, {
+            "choices": [{
+                "message": message,
+                "index": 0,
+                "finish_reason": "function_call" if "function_call" in message else "stop",
+            }],
+            "created": int(time.time()),
+            "model": payload.get("model", "GigaChat"),
+            "object": "chat.completion",
+            "usage": usage,
+        })
+
+    def _stream(self, content: str, delay: float, token_time: float, usage: Dict) -> None:
+        # SSE, как у GigaChat: data: {...}\n\n ... data: [DONE]; длина заранее неизвестна,
+        # usage — в последнем куске
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(delay)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            piece = word if i == len(words) - 1 else word + " "
+            chunk = {"choices": [{"delta": {"content": piece}, "index": 0}]}
+            if i == len(words) - 1:
+                chunk["choices"][0]["finish_reason"] = "stop"
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(_count_tokens(piece) * token_time)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальный mock GigaChat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="lognormal:0.6,0.5", help="распределение задержки (см. parse_latency)")
+    parser.add_argument("--token-time", type=float, default=0.005, help="добавка к задержке на токен ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After в ответах 429, с")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    mock = MockGigaChat(
+        args.host, args.port, args.latency, args.token_time,
+        args.error_rate, args.throttle_rate, args.retry_after, args.seed,
+    )
+    print(f"mock GigaChat: {mock.url} (Ctrl+C — выход)")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock._server.server_close()
+        print(json.dumps(mock.stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
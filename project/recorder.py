@@ -0,0 +1,171 @@
+# recorder.py
+#
+# Запись реальных сессий в JSONL для последующего воспроизведения (replay.py).
+# Включается путём к файлу в LUMIRA_RECORD; по умолчанию выключена.
+#
+# Строки двух видов (у каждой ещё run — id процесса — и source: live или replay):
+#   {"type": "llm",  "key", "agent", "session", "seq", "payload", "response", "duration_s", "ts"}
+#     — каждый запрос к GigaChat (в том числе фоновые) и его сырой ответ;
+#       отменённый до ответа запрос — с "cancelled": true и response = null;
+#   {"type": "turn", "session", "seq", "text", "route", "agent_id", "change_topic",
+#    "answer", "duration_s", "llm_calls", "ts"}
+#     — реплика ученика: решение маршрутизатора, ответ и время.
+
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from urllib.parse import quote
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+RECORD_PATH = os.getenv("LUMIRA_RECORD")
+
+# Один процесс — один run: номера реплик (seq) начинаются заново при каждом запуске
+RUN_ID = uuid.uuid4().hex[:8]
+
+# replay.py ставит "replay": его session уже содержат run исходной записи
+SOURCE = "live"
+
+_lock = threading.Lock()
+_current_turn = contextvars.ContextVar("lumira_record_turn", default=None)
+# номер реплики внутри сессии
+_seq: Dict[str, int] = {}
+
+# При воспроизведении запросы несут реплику, из которой они сделаны (session/seq):
+# replay.ReplayGigaChat отдаёт ответ, записанный для той же реплики, а не первый с таким ключом
+TURN_HEADER = "X-Lumira-Turn"
+
+
+def enabled() -> bool:
+    return bool(RECORD_PATH)
+
+
+def request_key(payload: Dict) -> str:
+    """
+    Ключ запроса для поиска записанного ответа: всё содержимое payload,
+    кроме признака stream (потоковый и обычный ответы взаимозаменяемы).
+    """
+    body = {k: v for k, v in payload.items() if k != "stream"}
+    raw = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _write(record: Dict) -> None:
+    record["run"], record["source"] = RUN_ID, SOURCE
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        with open(RECORD_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+@contextmanager
+def turn(session_id: str, user_text: str):
+    """
+    Запись одной реплики. Запросы к GigaChat внутри (и запущенные из неё
+    фоновые задачи) помечаются её session и seq.
+    """
+    if not enabled():
+        yield None
+        return
+
+    with _lock:
+        seq = _seq[session_id] = _seq.get(session_id, 0) + 1
+    # ts — начало реплики
+    record = {"type": "turn", "session": session_id, "seq": seq, "text": user_text, "llm_calls": 0, "ts": time.time()}
+    token = _current_turn.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _current_turn.reset(token)
+        record["duration_s"] = round(time.perf_counter() - started, 4)
+        _write(record)
+
+
+def annotate(**fields) -> None:
+    """
+    Дописывает поля (маршрут, ответ) в текущую записываемую реплику.
+    """
+    record = _current_turn.get()
+    if record is not None:
+        record.update(fields)
+
+
+def turn_id(session: str, seq: int) -> str:
+    return f"{session}/{seq}"
+
+
+def turn_headers() -> Dict[str, str]:
+    """
+    Заголовок с текущей репликой — только при воспроизведении (SOURCE == "replay").
+    """
+    record = _current_turn.get()
+    if SOURCE != "replay" or record is None:
+        return {}
+    return {TURN_HEADER: quote(turn_id(record["session"], record["seq"]))}
+
+
+def record_llm(
+    agent: Optional[str],
+    payload: Dict,
+    response: Optional[Dict],
+    duration: float,
+    cancelled: bool = False,
+) -> None:
+    """
+    Записывает запрос к GigaChat и его ответ (JSON целиком; для потока —
+    собранный текст в том же виде, что и обычный ответ). Отменённый до ответа
+    запрос (cancelled) записывается без ответа, чтобы replay знал, что он был.
+    """
+    if not enabled():
+        return
+    turn_record = _current_turn.get()
+    if turn_record is not None and not cancelled:
+        turn_record["llm_calls"] += 1
+    _write({
+        "type": "llm",
+        "key": request_key(payload),
+        "agent": agent,
+        "session": turn_record["session"] if turn_record else None,
+        "seq": turn_record["seq"] if turn_record else None,
+        "payload": payload,
+        "response": response,
+        "cancelled": cancelled,
+        "duration_s": round(duration, 4),
+        "ts": time.time(),
+    })
+
+
+def load(path: str) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Читает запись: (реплики по порядку, запросы к GigaChat по порядку).
+    Битые строки (например, оборванная последняя) пропускаются.
+    """
+    turns, calls = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") == "turn":
+                turns.append(record)
+            elif record.get("type") == "llm":
+                calls.append(record)
+    turns.sort(key=lambda r: r["ts"])
+    return turns, calls
+
+
+def session_key(record: Dict) -> str:
+    """
+    Сессия записи с учётом запуска: одна и та же session_id в разных запусках —
+    разные сессии. Для записей replay это уже сделано при воспроизведении.
+    """
+    if record.get("source") == "replay":
+        return record["session"]
+    return f"{record.get('run')}/{record['session']}"
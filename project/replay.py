@@ -0,0 +1,276 @@
+# replay.py
+#
+# Воспроизведение записанных сессий (recorder.py, LUMIRA_RECORD) на текущем коде.
+# Ответы GigaChat берутся из записи: локальный сервер (mock_gigachat.py) отдаёт
+# на каждый запрос записанный ответ с тем же ключом recorder.request_key.
+# Так можно проверить, что изменение кэширования или маршрутизации ускорило
+# реальный трафик и не поменяло решений.
+#
+#   python replay.py run session.jsonl --out replay.jsonl [--timing]
+#   python replay.py diff session.jsonl replay.jsonl
+#
+# --timing — с реальными паузами: ответы приходят с записанной задержкой,
+# реплики начинаются в те же моменты от начала записи, что и исходные.
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import recorder
+from loadtest import configure, percentile
+from mock_gigachat import MockGigaChat
+
+
+# Сколько примеров изменившихся маршрутов показывать
+DIFF_EXAMPLES = 10
+
+
+class ReplayGigaChat(MockGigaChat):
+    """
+    mock GigaChat, отвечающий записанными ответами. Сначала ищется запись с тем же
+    ключом из той же реплики (заголовок recorder.TURN_HEADER), затем — любая с тем же
+    ключом; несколько подходящих отдаются по очереди (последняя — повторно).
+    Запросы, которые и в записи были отменены до ответа, — stats["cancelled"],
+    которых в записи нет вовсе (код стал спрашивать иначе) — stats["unrecorded"];
+    на те и другие — обычный ответ mock-а.
+    """
+
+    def __init__(self, calls: List[Dict], timing: bool = False, seed: Optional[int] = None):
+        super().__init__(latency="0", token_time=0.0, seed=seed)
+        self.timing = timing
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._by_turn: Dict[Tuple[str, str], List[Dict]] = {}
+        self._cancelled = set()
+        self._used = set()
+        for call in calls:
+            if call.get("cancelled"):
+                self._cancelled.add(call["key"])
+                continue
+            self._by_key.setdefault(call["key"], []).append(call)
+            if call.get("session") is not None:
+                turn = recorder.turn_id(recorder.session_key(call), call["seq"])
+                self._by_turn.setdefault((turn, call["key"]), []).append(call)
+        self.stats.update({"replayed": 0, "unrecorded": 0, "cancelled": 0})
+
+    def _next(self, key: str, turn: Optional[str], take: bool) -> Optional[Dict]:
+        recorded = self._by_turn.get((turn, key)) or self._by_key.get(key)
+        if not recorded:
+            return None
+        call = next((c for c in recorded if id(c) not in self._used), recorded[-1])
+        if take:
+            self._used.add(id(call))
+        return call
+
+    def _draw(self, payload: Dict, turn: Optional[str] = None) -> Tuple[float, float]:
+        # ошибок не подмешиваем; задержка — записанная (если --timing)
+        if not self.timing:
+            return 1.0, 0.0
+        with self._lock:
+            call = self._next(recorder.request_key(payload), turn, take=False)
+        return 1.0, call["duration_s"] if call else 0.0
+
+    def _reply(self, agent: str, payload: Dict, turn: Optional[str] = None) -> Dict:
+        key = recorder.request_key(payload)
+        with self._lock:
+            call = self._next(key, turn, take=True)
+            if call is not None:
+                self.stats["replayed"] += 1
+                return call["response"]["choices"][0]["message"]
+            self.stats["cancelled" if key in self._cancelled else "unrecorded"] += 1
+        return super()._reply(agent, payload, turn)
+
+
+def _sessions(turns: List[Dict]) -> Dict[str, List[Dict]]:
+    sessions: Dict[str, List[Dict]] = {}
+    for t in turns:
+        sessions.setdefault(recorder.session_key(t), []).append(t)
+    for items in sessions.values():
+        items.sort(key=lambda t: t["seq"])
+    return sessions
+
+
+async def _replay_sessions(sessions: Dict[str, List[Dict]], timing: bool) -> Dict[str, int]:
+    from sessions import SessionManager
+
+    manager = SessionManager()
+    errors: Dict[str, int] = {}
+    first_ts = min(t["ts"] for items in sessions.values() for t in items)
+    started = time.perf_counter()
+
+    async def run_session(session_id: str, items: List[Dict]) -> None:
+        for t in items:
+            if timing:
+                await asyncio.sleep(max(0.0, t["ts"] - first_ts - (time.perf_counter() - started)))
+            try:
+                # как в main.run_cli: с потоковым выводом Tutor-а
+                await manager.handle(session_id, t["text"], lambda delta: None)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        manager.end_session(session_id)
+
+    try:
+        await asyncio.gather(*(run_session(sid, items) for sid, items in sessions.items()))
+    finally:
+        await manager.close()
+    return errors
+
+
+def run_replay(path: str, out: str, timing: bool = False) -> Dict:
+    """
+    Прогоняет сессии из записи path через текущий код и пишет новую запись в out.
+    Возвращает статистику воспроизведения.
+    """
+    turns, calls = recorder.load(path)
+    if not turns:
+        raise ValueError(f"{path}: в записи нет реплик")
+
+    mock = ReplayGigaChat(calls, timing).start()
+    configure(mock.url)
+    if os.path.exists(out):
+        os.remove(out)
+    recorder.RECORD_PATH = out
+    recorder.SOURCE = "replay"
+
+    started = time.perf_counter()
+    try:
+        errors = asyncio.run(_replay_sessions(_sessions(turns), timing))
+    finally:
+        mock.stop()
+    return {
+        "turns": len(turns),
+        "wall_s": time.perf_counter() - started,
+        "errors": errors,
+        "replayed": mock.stats["replayed"],
+        "unrecorded": mock.stats["unrecorded"],
+        "cancelled": mock.stats["cancelled"],
+    }
+
+
+def _latency(turns: List[Dict]) -> Dict:
+    values = sorted(t.get("duration_s", 0.0) for t in turns)
+    report = {"count": len(values), "mean": sum(values) / len(values) if values else 0.0}
+    for p in (50, 95, 99):
+        report[f"p{p}"] = percentile(values, p)
+    return report
+
+
+def _llm_by_agent(calls: List[Dict]) -> Dict[str, int]:
+    # отменённые до ответа запросы не считаем: в разных прогонах их число зависит от гонок
+    counts: Dict[str, int] = {}
+    for c in calls:
+        if c.get("cancelled"):
+            continue
+        agent = c.get("agent") or "other"
+        counts[agent] = counts.get(agent, 0) + 1
+    return counts
+
+
+def diff(old_path: str, new_path: str) -> Dict:
+    """
+    Сравнивает две записи одних и тех же сессий: решения маршрутизатора,
+    ответы, время реплик (всего и по агентам) и число запросов к GigaChat.
+    """
+    old_turns, old_calls = recorder.load(old_path)
+    new_turns, new_calls = recorder.load(new_path)
+    old = {(recorder.session_key(t), t["seq"]): t for t in old_turns}
+    new = {(recorder.session_key(t), t["seq"]): t for t in new_turns}
+    common = [key for key in old if key in new]
+
+    route_changes = []
+    answers_changed = 0
+    for key in common:
+        a, b = old[key], new[key]
+        before, after = (a.get("agent_id"), a.get("change_topic")), (b.get("agent_id"), b.get("change_topic"))
+        if before != after:
+            route_changes.append({"session": key[0], "seq": key[1], "text": a["text"], "old": before, "new": after})
+        if a.get("answer") != b.get("answer"):
+            answers_changed += 1
+
+    by_agent = {}
+    for agent_id in sorted({old[k].get("agent_id") for k in common} - {None}):
+        by_agent[agent_id] = {
+            "old": _latency([old[k] for k in common if old[k].get("agent_id") == agent_id]),
+            "new": _latency([new[k] for k in common if old[k].get("agent_id") == agent_id]),
+        }
+
+    return {
+        "matched": len(common),
+        "only_old": len(old) - len(common),
+        "only_new": len(new) - len(common),
+        "route_changes": route_changes,
+        "answers_changed": answers_changed,
+        "latency": {
+            "old": _latency([old[k] for k in common]),
+            "new": _latency([new[k] for k in common]),
+        },
+        "latency_by_agent": by_agent,
+        "llm_calls": {"old": _llm_by_agent(old_calls), "new": _llm_by_agent(new_calls)},
+    }
+
+
+def format_diff(report: Dict) -> str:
+    lines = [
+        f"Реплик сопоставлено: {report['matched']} "
+        f"(только в старой: {report['only_old']}, только в новой: {report['only_new']})",
+        f"Маршрут изменился: {len(report['route_changes'])}, ответ изменился: {report['answers_changed']}",
+    ]
+    for change in report["route_changes"][:DIFF_EXAMPLES]:
+        lines.append(f"  {change['session']} #{change['seq']} {change['text'][:50]!r}: {change['old']} → {change['new']}")
+
+    def row(name: str, old: Dict, new: Dict) -> str:
+        speedup = old["mean"] / new["mean"] if new["mean"] else 0.0
+        return (
+            f"{name:<10}{old['count']:>6}"
+            + "".join(f"{old[p]:>8.3f} →{new[p]:>7.3f}" for p in ("p50", "p95", "p99"))
+            + f"{speedup:>9.2f}x"
+        )
+
+    lines += ["", f"{'время, с':<10}{'n':>6}{'p50':>17}{'p95':>17}{'p99':>17}{'ускорение':>11}"]
+    lines.append(row("все", report["latency"]["old"], report["latency"]["new"]))
+    for agent_id, l in report["latency_by_agent"].items():
+        lines.append(row(f"агент {agent_id}", l["old"], l["new"]))
+
+    old_calls, new_calls = report["llm_calls"]["old"], report["llm_calls"]["new"]
+    lines.append(f"\nЗапросов к GigaChat: {sum(old_calls.values())} → {sum(new_calls.values())}")
+    for agent in sorted(set(old_calls) | set(new_calls)):
+        lines.append(f"  {agent}: {old_calls.get(agent, 0)} → {new_calls.get(agent, 0)}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Запись и воспроизведение сессий Lumira")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="воспроизвести запись на текущем коде")
+    run.add_argument("recording")
+    run.add_argument("--out", default="replay.jsonl", help="куда записать новое воспроизведение")
+    run.add_argument("--timing", action="store_true", help="с записанными задержками и паузами")
+
+    compare = commands.add_parser("diff", help="сравнить две записи")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--json", help="сохранить сравнение в JSON")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        stats = run_replay(args.recording, args.out, args.timing)
+        print(
+            f"Воспроизведено реплик: {stats['turns']} за {stats['wall_s']:.1f} с, "
+            f"ответов из записи: {stats['replayed']}, не найдено в записи: {stats['unrecorded']}, "
+            f"отменённых и в записи: {stats['cancelled']}, "
+            f"ошибок: {sum(stats['errors'].values())} {stats['errors'] or ''}\n"
+        )
+        report = diff(args.recording, args.out)
+    else:
+        report = diff(args.old, args.new)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    print(format_diff(report))
+
+
+if __name__ == "__main__":
+    main()
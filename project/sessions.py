@@ -0,0 +1,613 @@
+# sessions.py
+import asyncio
+import importlib
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+import recorder
+from gigachat_api import (
+    AsyncGigaChatClient,
+    cache_session,
+    coalesce_stats,
+    get_async_client,
+    prompt_token_report,
+    rate_limit_stats,
+)
+
+# ALL agents which are used
+# (router нужен на каждой реплике, остальные агенты — через _agent(), при первом вызове)
+from agents.router import default_router
+
+from structured_output import StructuredOutputError, structured_stats
+
+#ALL utils which are used
+from utils.format_exam import format_exam
+from utils.exam_bank import ExamBank
+from utils.prefetch import Prefetcher
+from utils.answer_cache import AnswerCache
+from utils.topic_index import TopicIndex
+from utils.progress_store import ProgressStore
+
+
+DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+
+# Fused-режим: маршрут и ответ Tutor-а одним запросом вместо moderator → tutor
+FUSED_ROUTING = os.getenv("LUMIRA_FUSED_ROUTING", "0") == "1"
+
+# Тесты в виде JSON через function_call (с проверкой, починкой и повторами);
+# 0 — старый текстовый формат THEME/ANSWERS/QUESTIONS
+STRUCTURED_EXAMS = os.getenv("LUMIRA_STRUCTURED_EXAMS", "1") == "1"
+
+# Спекулятивный режим: пока модератор думает, параллельно запускаем агента,
+# которого сессия вызывала в прошлый раз. Список агентов через запятую;
+# поддерживаются 1 (Tutor) и 4 (Problem Solver), пусто — режим выключен.
+SPECULATE_AGENTS = {
+    int(a) for a in os.getenv("LUMIRA_SPECULATE_AGENTS", "").split(",") if a.strip()
+} & {1, 4}
+
+# launched — запущено спекулятивных вызовов, used — маршрут совпал,
+# cancelled — не совпал и вызов отменили, wasted — не совпал, но вызов уже успел отработать
+speculation_stats = {"launched": 0, "used": 0, "cancelled": 0, "wasted": 0}
+
+# Справочник тем: разные написания одной темы → один id (ключ для банка тестов и отчётов)
+topic_index = TopicIndex()
+
+# Результаты тестов всех учеников с накопленными итогами (переживают перезапуск)
+progress_store = ProgressStore()
+
+# Сколько последних тестов показывать в прогрессе
+PROGRESS_RECENT = 5
+
+# Банк готовых тестов: один на процесс, общий для всех сессий
+exam_bank = ExamBank()
+
+# Тест по текущей теме готовится в фоне, пока ученик читает ответ Tutor-а / Problem Solver-а
+exam_prefetcher = Prefetcher()
+
+# Ответы Tutor-а на первые (бесконтекстные) вопросы, общие для всех сессий
+answer_cache = AnswerCache()
+
+# Имена агентов по номерам модератора (метки метрик)
+AGENT_NAMES = {1: "tutor", 2: "examiner", 3: "analyser", 4: "problem_solver"}
+
+# Время реплик, которым понадобилась модель для выбора маршрута,
+# отдельно для fused-режима и для обычного (модератор + агент)
+routing_latency = {
+    "fused": {"turns": 0, "total_s": 0.0},
+    "two_call": {"turns": 0, "total_s": 0.0},
+}
+
+# Готовая статистика компонентов попадает в metrics.snapshot() и /metrics как есть
+metrics.register_collector("speculation", lambda: speculation_stats)
+metrics.register_collector("routing", lambda: routing_report())
+metrics.register_collector("router", default_router.stats)
+metrics.register_collector("answer_cache", lambda: answer_cache.stats)
+metrics.register_collector("exam_prefetch", lambda: exam_prefetcher.stats)
+metrics.register_collector("structured", lambda: structured_stats)
+metrics.register_collector("coalesce", lambda: coalesce_stats)
+metrics.register_collector("rate_limit", lambda: rate_limit_stats)
+metrics.register_collector("llm_prompt", prompt_token_report)
+
+TEST_INSTRUCTIONS = (
+    "Как отвечать на тесты\n"
+    "Пишите только в формате:\n"
+    "1a 2c 3b 4d 5a\n"
+    "Где:\n"
+    "число — номер вопроса,\n"
+    "буква — выбранный вариант ответа."
+)
+
+
+def _agent(name: str):
+    """
+    Модуль агента agents.<name>. Агенты и их промпты грузятся при первом
+    обращении, а не при старте процесса.
+    """
+    return importlib.import_module(f"agents.{name}")
+
+
+def new_state(session_id: str = "default") -> Dict:
+    """
+    Состояние одного ученика (одной сессии).
+    """
+    return {
+        "session_id": session_id,
+        # id кэша контекста GigaChat: session_id вроде "cli" одинаков у всех запусков,
+        # а кэши разных учеников с одними учётными данными не должны смешиваться
+        "cache_session": uuid.uuid4().hex,
+        "tutor_history": [],
+        "last_topic": None,
+        "topic_id": None,       # ← id last_topic в topic_index
+        "last_route": None,     # ← агент, который отвечал в прошлый раз
+        "current_test": None,   # ← здесь будет храниться тест от Examiner
+        "problem_solver": {     # состояние Problem Solver-а
+            "active": False,
+            "topic": None,
+            "steps": [],
+            "current_step": 0,
+        },
+    }
+
+
+def routing_report() -> Dict:
+    """
+    Среднее время реплики (с LLM-маршрутизацией) в fused- и обычном режиме.
+    """
+    report = {}
+    for mode, stats in routing_latency.items():
+        turns = stats["turns"]
+        report[mode] = {
+            "turns": turns,
+            "avg_s": stats["total_s"] / turns if turns else 0.0,
+        }
+    return report
+
+
+def _record_routing_latency(mode: str, started: float) -> None:
+    stats = routing_latency[mode]
+    stats["turns"] += 1
+    stats["total_s"] += time.perf_counter() - started
+
+
+async def _route_with_model(
+    client: AsyncGigaChatClient,
+    state: Dict,
+    user_text: str,
+    on_delta: Optional[Callable[[str], None]],
+) -> Tuple[int, int, Optional[str]]:
+    """
+    Маршрут, который не смог решить локальный роутер.
+    Возвращает (agent_id, change_topic, готовый ответ агента или None):
+    в fused-режиме модель сразу отвечает и за Tutor-а, в спекулятивном — агент
+    работает параллельно с модератором, иначе — отдельный запрос к модератору.
+    Если готовый ответ есть, состояние сессии уже обновлено.
+    """
+    if FUSED_ROUTING:
+        return await _agent("fused").run_fused_async(client, user_text, state["tutor_history"], on_delta)
+
+    predicted = state.get("last_route") or 1
+    if predicted in SPECULATE_AGENTS:
+        return await _route_speculative(client, state, user_text, predicted, on_delta)
+
+    agent_id, change_topic = await _agent("moderator").run_moderator_async(client, user_text)
+    return agent_id, change_topic, None
+
+
+def _discard(task: asyncio.Task) -> None:
+    # забираем исключение отброшенной задачи, чтобы asyncio не ругался в лог
+    if task.cancelled() or task.exception() is not None:
+        return
+    # отброшенный Problem Solver мог успеть запустить фоновые заготовки
+    _, spec_state = task.result()
+    if isinstance(spec_state, dict) and "steps" in spec_state:
+        _agent("problem_solver").release_problem_solver(spec_state)
+
+
+async def _route_speculative(
+    client: AsyncGigaChatClient,
+    state: Dict,
+    user_text: str,
+    predicted: int,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Tuple[int, int, Optional[str]]:
+    """
+    Модератор и предсказанный агент запускаются одновременно.
+    Совпал маршрут — ответ агента уже готов (реплика стоит как один запрос, а не два);
+    не совпал — спекулятивный вызов отменяем или выбрасываем.
+    Tutor идёт потоком в буфер: при совпадении маршрута накопленное отдаётся
+    в on_delta, остальное — по мере генерации.
+    """
+    speculation_stats["launched"] += 1
+    moderator_task = asyncio.create_task(_agent("moderator").run_moderator_async(client, user_text))
+
+    if predicted == 1:
+        # Tutor работает на копии истории: если маршрут не совпадёт, история не изменится
+        spec_history = list(state["tutor_history"])
+        spec_stream = _agent("tutor").DeferredStream()
+        spec_task = asyncio.create_task(
+            _agent("tutor").run_tutor_speculative_async(client, user_text, spec_history, spec_stream)
+        )
+    else:
+        spec_task = asyncio.create_task(_agent("problem_solver").start_problem_solver_async(client, user_text))
+
+    try:
+        agent_id, change_topic = await moderator_task
+    except BaseException:
+        spec_task.cancel()
+        spec_task.add_done_callback(_discard)
+        raise
+
+    if agent_id != predicted:
+        if spec_task.done():
+            speculation_stats["wasted"] += 1
+        else:
+            speculation_stats["cancelled"] += 1
+            spec_task.cancel()
+        spec_task.add_done_callback(_discard)
+        return agent_id, change_topic, None
+
+    if predicted == 1 and on_delta is not None:
+        spec_stream.attach(on_delta)
+    try:
+        answer, new_state = await spec_task
+    except Exception:
+        speculation_stats["wasted"] += 1
+        if predicted == 1 and on_delta is not None and spec_stream.parts:
+            # начало ответа ученик уже видел — повтор напечатал бы его дважды
+            raise
+        # спекулятивный вызов упал — агент будет вызван обычным путём
+        return agent_id, change_topic, None
+
+    speculation_stats["used"] += 1
+    if predicted == 1:
+        state["tutor_history"] = new_state
+        # сжатие — только для принятого ответа
+        _agent("tutor").schedule_compaction(client, new_state)
+    else:
+        _agent("problem_solver").release_problem_solver(state["problem_solver"])
+        state["problem_solver"] = new_state
+    return agent_id, change_topic, answer
+
+
+async def _generate_exam(
+    client: AsyncGigaChatClient,
+    topic: str,
+    topic_id: int,
+    student: Optional[str] = None,
+    agent: str = "examiner",
+) -> Tuple[Optional[int], str, Dict[int, str], str]:
+    """
+    Генерирует новый тест и кладёт его в банк (если он разобрался).
+    Возвращает (exam_id или None, questions_text, answers_dict, theme).
+    """
+    if STRUCTURED_EXAMS:
+        try:
+            exam = await _agent("examiner").run_examiner_structured_async(client, topic, agent=agent)
+        except StructuredOutputError as e:
+            return None, f"Ошибка: экзаменатор выдал некорректный тест ({e}).", {}, topic
+        raw_test = json.dumps(exam.to_dict(), ensure_ascii=False)
+        questions_text, answers_dict, theme = exam.questions_text, exam.answers_dict, exam.theme
+    else:
+        raw_test = await _agent("examiner").run_examiner_async(client, topic, agent=agent)
+        questions_text, answers_dict, theme = format_exam(raw_test)
+
+    exam_id = None
+    if answers_dict:
+        exam_id = exam_bank.add(topic_id, raw_test, questions_text, answers_dict, theme, student=student)
+    return exam_id, questions_text, answers_dict, theme
+
+
+async def _obtain_exam(client: AsyncGigaChatClient, state: Dict, topic: str) -> Tuple[str, Dict[int, str], str]:
+    """
+    Тест по теме: сначала заранее подготовленный в фоне, затем из банка
+    (тот, что ученик ещё не видел), и только если тема исчерпана — генерируем новый.
+    """
+    student = state["session_id"]
+    topic_id = state["topic_id"]
+
+    prefetched = await exam_prefetcher.take(student, topic_id)
+    if prefetched is not None:
+        exam_id, questions_text, answers_dict, theme = prefetched
+        if exam_id is not None:
+            exam_bank.mark_served(exam_id, student)
+            metrics.inc("exam_source", source="prefetch")
+            return questions_text, answers_dict, theme
+
+    stored = exam_bank.pick(topic_id, student)
+    if stored is not None:
+        _, questions_text, answers_dict, theme = stored
+        metrics.inc("exam_source", source="bank")
+        return questions_text, answers_dict, theme
+
+    _, questions_text, answers_dict, theme = await _generate_exam(client, topic, topic_id, student)
+    metrics.inc("exam_source", source="generated" if answers_dict else "failed")
+    return questions_text, answers_dict, theme
+
+
+def _prefetch_exam(client: AsyncGigaChatClient, state: Dict) -> None:
+    """
+    Запускает фоновую генерацию теста по текущей теме, если в банке
+    для этого ученика по ней ничего нет.
+    """
+    topic, topic_id = state["last_topic"], state["topic_id"]
+    if not topic or topic_id is None or exam_bank.has_unseen(topic_id, state["session_id"]):
+        return
+    # фоновая генерация идёт с приоритетом "prefetch"; отпечаток запроса от агента не зависит,
+    # так что ученик, попросивший тот же тест, дождётся этого запроса, а не отправит второй
+    exam_prefetcher.schedule(
+        state["session_id"], topic_id, lambda: _generate_exam(client, topic, topic_id, agent="prefetch")
+    )
+
+
+def format_progress(state: Dict) -> str:
+    """
+    Итоги ученика по темам, последние тесты и общий средний результат.
+    Берутся из накопленных итогов progress_store, без пересчёта всей истории.
+    """
+    student = state["session_id"]
+    overall = progress_store.summary(student)
+    if overall["tests"] == 0:
+        return "Пока нет ни одного завершённого теста."
+
+    lines = ["Результаты по темам:"]
+    for t in progress_store.by_topic(student):
+        topic = t["topic"] or "(неизвестная тема)"
+        lines.append(
+            f"- {topic}: тестов {t['tests']}, результат {t['correct']}/{t['questions']} ({t['percent']}%)"
+        )
+
+    lines.append("\nПоследние тесты:")
+    recent = progress_store.results(student, limit=PROGRESS_RECENT, newest_first=True)
+    for r in reversed(recent):
+        topic = r["topic"] or "(неизвестная тема)"
+        when = time.strftime("%d.%m %H:%M", time.localtime(r["ts"]))
+        lines.append(f"{when} Тема: {topic} — результат: {r['score']}/{r['total']} ({r['percent']}%)")
+
+    # --- средний результат ---
+    if overall["questions"] > 0:
+        lines.append(
+            f"\nСредний результат: {overall['correct']}/{overall['questions']} ({overall['percent']}%)"
+        )
+    else:
+        lines.append("\nСредний результат: нет достаточных данных.")
+
+    return "\n".join(lines)
+
+
+async def process_turn(
+    client: AsyncGigaChatClient,
+    state: Dict,
+    user_text: str,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
+    """
+    Обрабатывает одну реплику ученика и возвращает текст ответа
+    (или None, если отвечать нечего — например, пустой ввод).
+    Если передан on_delta, ответ Tutor-а отдаётся в него кусочками по мере генерации.
+
+    Реплика записывается трассой в metrics (маршрут, агент, интервалы запросов
+    к GigaChat), её время — в гистограмму turn_seconds по способу маршрутизации.
+    При включённой записи (LUMIRA_RECORD) реплика и все её запросы попадают в JSONL.
+    Запросы к GigaChat идут с X-Session-ID этой сессии (кэш контекста, cache_session).
+    """
+    with metrics.trace("turn", session=state["session_id"]) as record:
+        with recorder.turn(state["session_id"], user_text), cache_session(state["cache_session"]):
+            answer = await _process_turn(client, state, user_text, on_delta)
+            recorder.annotate(answer=answer)
+    if "route" in record:
+        metrics.observe("turn_seconds", record["duration_s"], route=record["route"], agent=record["agent"])
+    return answer
+
+
+async def _process_turn(
+    client: AsyncGigaChatClient,
+    state: Dict,
+    user_text: str,
+    on_delta: Optional[Callable[[str], None]],
+) -> Optional[str]:
+    # команда просмотра прогресса
+    if user_text.lower() == "progress":
+        return format_progress(state)
+
+    if not user_text:
+        return None  # пустой ввод, просто пропускаем
+
+    started = time.perf_counter()
+
+    # Первый вопрос Tutor-у не зависит от контекста — его ответ можно взять из общего кэша
+    first_turn = not state["tutor_history"]
+    cached = None
+
+    # 1. Ask router what to do (очевидные случаи — локально, остальное — модель)
+    decision, rule = default_router.decide(user_text, state)
+    if decision is None and first_turn:
+        cached = answer_cache.lookup(user_text)
+
+    llm_routed = decision is None and cached is None
+    if cached is not None:
+        # такой вопрос уже уходил Tutor-у: ни модератор, ни Tutor не нужны
+        ready_answer, change_topic = cached
+        agent_id = 1
+        _agent("tutor").remember_turn(state["tutor_history"], user_text, ready_answer)
+        route = "cache"
+    elif llm_routed:
+        route = "fused" if FUSED_ROUTING else "model"
+        with metrics.timer("routing_seconds", stage=route):
+            agent_id, change_topic, ready_answer = await _route_with_model(client, state, user_text, on_delta)
+    else:
+        (agent_id, change_topic), ready_answer = decision, None
+        route = "fast"
+    if route in ("fast", "fused"):
+        # в лог для обучения route_classifier — все маршруты, а не только решённые модератором
+        # (он пишет свои сам); ответы из кэша — повтор уже записанного решения
+        _agent("moderator").log_decision(user_text, (agent_id, change_topic), source=rule or route)
+    metrics.annotate(route=route, agent=AGENT_NAMES.get(agent_id, "unknown"))
+    recorder.annotate(route=route, agent_id=agent_id, change_topic=change_topic)
+    if DEBUG:
+        print('++++++', agent_id, change_topic)
+
+    # 2. Update topic if Moderator says so
+    if change_topic == 1:
+        state["last_topic"] = user_text
+        state["topic_id"] = topic_index.resolve(user_text)
+        # тест, подготовленный по старой теме, больше не нужен
+        exam_prefetcher.cancel(state["session_id"])
+
+    if ready_answer is not None:
+        # ответ агента уже получен вместе с маршрутом (fused или спекулятивно)
+        answer = ready_answer
+
+    elif agent_id == 1:
+        # ---- TUTOR ----
+        with metrics.timer("agent_seconds", agent="tutor"):
+            if on_delta is not None:
+                parts = []
+                async for delta in _agent("tutor").run_tutor_stream_async(client, user_text, state["tutor_history"]):
+                    parts.append(delta)
+                    on_delta(delta)
+                answer = "".join(parts)
+            else:
+                answer, state["tutor_history"] = await _agent("tutor").run_tutor_async(
+                    client,
+                    user_text,
+                    state["tutor_history"],
+                )
+
+    elif agent_id == 2:
+        # ---- EXAMINER ----
+
+        # If moderator said not to change topic, and last_topic exists,
+        # we use last_topic instead of full user_text as the test theme.
+        if state["last_topic"] is None:
+            # fallback: use current message as topic
+            topic = user_text
+            state["last_topic"] = topic
+            state["topic_id"] = topic_index.resolve(topic)
+        else:
+            topic = state["last_topic"]
+
+        with metrics.timer("agent_seconds", agent="examiner"):
+            questions_text, answers_dict, theme = await _obtain_exam(client, state, topic)
+
+        # обновляем тему в состоянии по результату экзаменатора;
+        # THEME — ещё одно написание той же темы, а не новая тема
+        state["last_topic"] = theme
+        if answers_dict:
+            topic_index.resolve(theme, default=state["topic_id"])
+
+        # сохраняем ответы ДЛЯ анализатора (тест, не прошедший проверку, проверять нечем)
+        state["current_test"] = answers_dict or None
+
+        # показываем пользователю инструкцию и только текст вопросов
+        answer = TEST_INSTRUCTIONS + "\n\n" + questions_text
+
+    elif agent_id == 3:
+        # ---- Analyzer ----
+        if state["current_test"] is None:
+            answer = "Нет теста для проверки!"
+        else:
+            with metrics.timer("agent_seconds", agent="analyser"):
+                report_text, score, total = _agent("analyser").run_analyser(state["current_test"], user_text)
+
+            # сохраняем результат в постоянный журнал
+            progress_store.record(
+                state["session_id"],
+                state["topic_id"],
+                state["last_topic"],
+                score,
+                total,
+                answers=user_text,
+            )
+            # тест проверен → очищаем
+            state["current_test"] = None
+
+            # пользователю показываем текст отчёта
+            answer = report_text
+
+    elif agent_id == 4 and state["problem_solver"]["active"] and _agent("problem_solver").is_yes_no(user_text):
+        # ---- PROBLEM SOLVER: ответ "да/нет" на текущий шаг ----
+        with metrics.timer("agent_seconds", agent="problem_solver_continue"):
+            answer, state["problem_solver"] = await _agent("problem_solver").continue_problem_solver_async(
+                client,
+                state["problem_solver"],
+                user_text,
+            )
+
+    elif agent_id == 4:
+        # ---- PROBLEM SOLVER ----
+        # стартуем новую сессию пошагового объяснения
+        _agent("problem_solver").release_problem_solver(state["problem_solver"])
+        with metrics.timer("agent_seconds", agent="problem_solver_start"):
+            answer, state["problem_solver"] = await _agent("problem_solver").start_problem_solver_async(
+                client, user_text
+            )
+
+    else:
+        answer = "Неизвестный режим, модератор вернул странный код.\n"
+
+    state["last_route"] = agent_id
+
+    if agent_id == 1 and first_turn and cached is None:
+        answer_cache.store(user_text, answer, change_topic)
+
+    # пока ученик читает объяснение, готовим тест по этой теме
+    if agent_id in (1, 4):
+        _prefetch_exam(client, state)
+
+    if llm_routed:
+        _record_routing_latency("fused" if FUSED_ROUTING else "two_call", started)
+
+    return answer
+
+
+class SessionManager:
+    """
+    Хранит состояния учеников по session_id и обрабатывает их реплики.
+
+    Реплики разных сессий обрабатываются параллельно в одном event loop,
+    реплики одной сессии — строго по очереди (через asyncio.Lock сессии).
+    """
+
+    def __init__(self, client: Optional[AsyncGigaChatClient] = None):
+        self.client = client or get_async_client()
+        # LUMIRA_METRICS_PORT — отдавать /metrics и /snapshot по HTTP
+        metrics.start_http_server()
+        self.sessions: Dict[str, Dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def get_state(self, session_id: str) -> Dict:
+        if session_id not in self.sessions:
+            self.sessions[session_id] = new_state(session_id)
+            self._locks[session_id] = asyncio.Lock()
+        return self.sessions[session_id]
+
+    def end_session(self, session_id: str) -> None:
+        exam_prefetcher.cancel(session_id)
+        state = self.sessions.pop(session_id, None)
+        if state is not None:
+            _agent("problem_solver").release_problem_solver(state["problem_solver"])
+        self._locks.pop(session_id, None)
+
+    async def handle(
+        self,
+        session_id: str,
+        user_text: str,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> Optional[str]:
+        """
+        Обрабатывает реплику user_text в сессии session_id.
+        on_delta — необязательный колбэк для потокового вывода ответа.
+        """
+        state = self.get_state(session_id)
+        async with self._locks[session_id]:
+            return await process_turn(self.client, state, user_text, on_delta)
+
+    async def serve(self, requests: asyncio.Queue) -> None:
+        """
+        Цикл обработки запросов: берёт из очереди (session_id, user_text, future)
+        и кладёт ответ в future. Каждая реплика обрабатывается отдельной задачей.
+        """
+        tasks = set()
+
+        async def _run(session_id, user_text, future):
+            try:
+                answer = await self.handle(session_id, user_text)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(answer)
+
+        while True:
+            session_id, user_text, future = await requests.get()
+            task = asyncio.create_task(_run(session_id, user_text, future))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def close(self) -> None:
+        await self.client.close()
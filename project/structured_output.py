@@ -0,0 +1,177 @@
+# structured_output.py
+#
+# Ответы модели в виде JSON: запрос через functions API GigaChat
+# (function_call с заданной схемой), проверка результата, дешёвая локальная
+# починка и только потом — ограниченное число повторных запросов.
+
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from gigachat_api import GigaChatClient, AsyncGigaChatClient
+
+
+T = TypeVar("T")
+
+# Сколько раз переспрашиваем модель, если ответ не удалось ни разобрать, ни починить
+STRUCTURED_MAX_RETRIES = int(os.getenv("LUMIRA_STRUCTURED_RETRIES", "2"))
+
+# Счётчики по каждой функции:
+# calls — вызовов, valid — годных ответов без починки, repaired — годных
+# после локальной починки, retries — повторных запросов,
+# failed — так и не получили годного ответа
+structured_stats: Dict[str, Dict[str, int]] = {}
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class StructuredOutputError(ValueError):
+    """
+    Модель так и не вернула годный JSON. raw — последний ответ (текст).
+    """
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
+
+def _stats(name: str) -> Dict[str, int]:
+    return structured_stats.setdefault(
+        name, {"calls": 0, "valid": 0, "repaired": 0, "retries": 0, "failed": 0}
+    )
+
+
+def repair_json(text: str) -> Any:
+    """
+    Дешёвая починка типичных поломок: markdown-ограда ```json, текст вокруг
+    объекта, висячие запятые. Выбрасывает ValueError, если не помогло.
+    """
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("в ответе нет JSON")
+    start = min(starts)
+    end = max(text.rfind("}"), text.rfind("]"))
+    text = text[start:end + 1]
+
+    text = _TRAILING_COMMA_RE.sub(r"\1", text)
+    return json.loads(text)
+
+
+def _function_payload(function: Dict) -> Dict:
+    return {"functions": [function], "function_call": {"name": function["name"]}}
+
+
+def _extract(response: Dict) -> Tuple[Any, str, bool]:
+    """
+    Из ответа API достаёт (данные, исходный текст, пришлось ли чинить).
+    GigaChat отдаёт аргументы function_call объектом, но на всякий случай понимаем и строку;
+    если модель ответила обычным текстом — разбираем content.
+    """
+    message = response["choices"][0]["message"]
+    call = message.get("function_call")
+    if call is not None:
+        arguments = call.get("arguments")
+        if not isinstance(arguments, str):
+            return arguments, json.dumps(arguments, ensure_ascii=False), False
+        raw = arguments
+    else:
+        raw = message.get("content") or ""
+
+    try:
+        return json.loads(raw), raw, False
+    except ValueError:
+        return repair_json(raw), raw, True
+
+
+def _retry_messages(messages: List[Dict], raw: str, error: Exception) -> List[Dict]:
+    return messages + [
+        {"role": "assistant", "content": raw},
+        {
+            "role": "user",
+            "content": (
+                f"Ответ не прошёл проверку: {error}.\n"
+                "Верни исправленный результат целиком, строго в заданном формате JSON."
+            ),
+        },
+    ]
+
+
+def _attempt(response: Dict, validate: Callable[[Any], T], stats: Dict[str, int]) -> Tuple[Optional[T], str, Exception]:
+    raw = ""
+    try:
+        data, raw, repaired = _extract(response)
+        result = validate(data)
+    except (ValueError, KeyError, TypeError) as e:
+        return None, raw, e
+    stats["repaired" if repaired else "valid"] += 1
+    return result, raw, None
+
+
+def request_structured(
+    client: GigaChatClient,
+    messages: List[Dict],
+    function: Dict,
+    validate: Callable[[Any], T],
+    max_retries: int = STRUCTURED_MAX_RETRIES,
+    coalesce: bool = False,
+    agent: str = None,
+) -> T:
+    """
+    Запрашивает вызов функции function (описание + JSON-схема parameters)
+    и возвращает validate(аргументы). validate выбрасывает ValueError, если данные не годятся.
+    Не удалось за 1 + max_retries запросов — StructuredOutputError.
+    coalesce — склеивать одинаковые одновременные запросы, agent — приоритет в очереди
+    (см. GigaChatClient.complete).
+    """
+    stats = _stats(function["name"])
+    stats["calls"] += 1
+    extra = _function_payload(function)
+
+    raw, error = "", None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            stats["retries"] += 1
+            messages = _retry_messages(messages, raw, error)
+        response = client.complete(messages, coalesce=coalesce, agent=agent, **extra)
+        result, raw, error = _attempt(response, validate, stats)
+        if error is None:
+            return result
+
+    stats["failed"] += 1
+    raise StructuredOutputError(f"{function['name']}: {error}", raw)
+
+
+async def request_structured_async(
+    client: AsyncGigaChatClient,
+    messages: List[Dict],
+    function: Dict,
+    validate: Callable[[Any], T],
+    max_retries: int = STRUCTURED_MAX_RETRIES,
+    coalesce: bool = False,
+    agent: str = None,
+) -> T:
+    """
+    Асинхронный вариант request_structured.
+    """
+    stats = _stats(function["name"])
+    stats["calls"] += 1
+    extra = _function_payload(function)
+
+    raw, error = "", None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            stats["retries"] += 1
+            messages = _retry_messages(messages, raw, error)
+        response = await client.complete(messages, coalesce=coalesce, agent=agent, **extra)
+        result, raw, error = _attempt(response, validate, stats)
+        if error is None:
+            return result
+
+    stats["failed"] += 1
+    raise StructuredOutputError(f"{function['name']}: {error}", raw)
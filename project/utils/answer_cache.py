@@ -0,0 +1,160 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.ngrams import hashed_features, strip_fillers
+
+
+# Сколько ответов держим в кэше (0 — кэш выключен)
+ANSWER_CACHE_SIZE = int(os.getenv("LUMIRA_ANSWER_CACHE_SIZE", "2000"))
+
+# Минимальное косинусное сходство вопросов, при котором отдаём сохранённый ответ
+ANSWER_CACHE_THRESHOLD = float(os.getenv("LUMIRA_ANSWER_CACHE_THRESHOLD", "0.85"))
+
+# Время жизни ответа в кэше, секунды
+ANSWER_CACHE_TTL = float(os.getenv("LUMIRA_ANSWER_CACHE_TTL", str(24 * 3600)))
+
+# Размерность хешированных n-грамм
+ANSWER_CACHE_DIM = 2 ** 11
+
+# Числа и знаки операций. Нормализация их теряет («17 * 23» и «17 / 23» — один текст),
+# поэтому ответ отдаётся только при точном совпадении этой последовательности
+_FORMULA_RE = re.compile(r"\d+(?:[.,]\d+)?|[-+*/^=<>%×÷·√()]")
+
+
+def _cache_key(question: str) -> Tuple[str, str]:
+    """
+    (нормализованный текст без слов-обёрток, числа и операторы вопроса).
+    """
+    return strip_fillers(question), " ".join(_FORMULA_RE.findall(question))
+
+
+class AnswerCache:
+    """
+    Кэш ответов Tutor-а по смыслу вопроса, общий для всех сессий.
+
+    Вопрос нормализуется (без слов-обёрток вроде «объясни», «что такое») и
+    превращается в TF-IDF вектор символьных n-грамм. Векторы лежат строками
+    в одной NumPy-матрице, поиск — косинусное сходство со всеми строками сразу.
+    Вытеснение — LRU при заполнении и TTL для старых ответов.
+    Числа и операторы вопроса (x^2 - 5x + 6 = 0) должны совпасть точно.
+    """
+
+    def __init__(
+        self,
+        capacity: int = ANSWER_CACHE_SIZE,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        dim: int = ANSWER_CACHE_DIM,
+    ):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dim = dim
+
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)  # tf-векторы (L2 = 1)
+        self._df = np.zeros(dim, dtype=np.float32)                   # в скольких строках есть n-грамма
+        self._keys = [None] * capacity        # _cache_key вопроса
+        self._formulas = np.zeros(capacity, dtype=np.int64)  # hash чисел и операторов
+        self._values = [None] * capacity      # (ответ, change_topic)
+        self._created = np.zeros(capacity)
+        self._last_used = np.zeros(capacity)
+        self._by_key: Dict[Tuple[str, str], int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0, "evictions": 0, "expired": 0}
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def _idf(self) -> np.ndarray:
+        n = len(self._by_key)
+        return np.log((1.0 + n) / (1.0 + self._df)) + 1.0
+
+    def _release(self, slot: int) -> None:
+        self._df[self._vectors[slot] > 0] -= 1
+        self._vectors[slot] = 0
+        del self._by_key[self._keys[slot]]
+        self._keys[slot] = None
+        self._values[slot] = None
+        self._free.append(slot)
+
+    def lookup(self, question: str) -> Optional[Tuple[str, int]]:
+        """
+        Возвращает (ответ, change_topic) для похожего вопроса или None.
+        """
+        if self.capacity <= 0:
+            return None
+
+        key = _cache_key(question)
+        now = time.time()
+        with self._lock:
+            slot = self._by_key.get(key)
+            if slot is None and self._by_key:
+                indices, values = hashed_features(key[0], self.dim)
+                idf = self._idf()
+                weighted_q = values * idf[indices]
+                q_norm = np.linalg.norm(weighted_q)
+
+                # cos = <v·idf, q·idf> / (|v·idf| |q·idf|); скалярные произведения — только
+                # по n-граммам запроса, нормы — только у строк, где есть общие n-граммы
+                dots = self._vectors[:, indices] @ (weighted_q * idf[indices])
+                candidates = np.flatnonzero(
+                    (dots > 0) & (self._created >= now - self.ttl) & (self._formulas == hash(key[1]))
+                )
+                if len(candidates):
+                    row_norms = np.sqrt((self._vectors[candidates] ** 2) @ (idf ** 2))
+                    scores = dots[candidates] / np.maximum(row_norms * q_norm, 1e-9)
+                    best = int(scores.argmax())
+                    if scores[best] >= self.threshold:
+                        slot = int(candidates[best])
+
+            if slot is not None and self._created[slot] < now - self.ttl:
+                self._release(slot)
+                self.stats["expired"] += 1
+                slot = None
+
+            if slot is None:
+                self.stats["misses"] += 1
+                return None
+
+            self._last_used[slot] = now
+            self.stats["hits"] += 1
+            return self._values[slot]
+
+    def store(self, question: str, answer: str, change_topic: int) -> None:
+        if self.capacity <= 0 or not answer:
+            return
+
+        key = _cache_key(question)
+        now = time.time()
+        with self._lock:
+            if key in self._by_key:
+                self._release(self._by_key[key])
+
+            if not self._free:
+                # сначала выбрасываем протухшие, иначе — давно не использованный
+                expired = [i for i in range(self.capacity) if self._created[i] < now - self.ttl]
+                for i in expired:
+                    self._release(i)
+                self.stats["expired"] += len(expired)
+                if not self._free:
+                    self._release(int(self._last_used.argmin()))
+                    self.stats["evictions"] += 1
+
+            slot = self._free.pop()
+            indices, values = hashed_features(key[0], self.dim)
+            self._vectors[slot, indices] = values
+            self._formulas[slot] = hash(key[1])
+            self._df[indices] += 1
+            self._keys[slot] = key
+            self._values[slot] = (answer, change_topic)
+            self._created[slot] = now
+            self._last_used[slot] = now
+            self._by_key[key] = slot
+            self.stats["inserts"] += 1
@@ -0,0 +1,289 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# Сколько вопросов и какие варианты ждём от экзаменатора (см. EXAMINER_PROMPT)
+EXAM_QUESTIONS = 5
+OPTIONS = "ABCD"
+
+DEFAULT_THEME = "(не удалось определить тему)"
+
+_HEADER_RE = re.compile(r"(THEME|ANSWERS|QUESTIONS)\s*:\s*(.*)", re.IGNORECASE)
+_QUESTION_RE = re.compile(r"(\d+)\s*[.)]\s*(.*)")
+_OPTION_RE = re.compile(r"([A-Da-d])\s*[).:]\s*(.*)")
+_ANSWER_TOKEN_RE = re.compile(r"(\d+)\s*[.):\-]?\s*([A-Za-z])")
+
+
+class ExamParseError(ValueError):
+    """
+    Тест от экзаменатора не прошёл проверку. errors — список проблем
+    (с номерами строк, где это имеет смысл).
+    """
+
+    def __init__(self, errors: List[str], theme: str = DEFAULT_THEME):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.theme = theme
+
+
+class Question:
+    __slots__ = ("number", "text", "options")
+
+    def __init__(self, number: int, text: str, options: Tuple[str, ...]):
+        self.number = number
+        self.text = text
+        self.options = options   # тексты вариантов в порядке A, B, C, D
+
+    def render(self) -> str:
+        lines = [f"{self.number}. {self.text}"]
+        lines += [f"{letter}) {option}" for letter, option in zip(OPTIONS, self.options)]
+        return "\n".join(lines)
+
+
+class Exam:
+    """
+    Разобранный и проверенный тест: тема, вопросы и правильные ответы.
+    Текст вопросов для ученика собирается только при первом обращении.
+    """
+
+    __slots__ = ("theme", "questions", "answers", "_text")
+
+    def __init__(self, theme: str, questions: Tuple[Question, ...], answers: str):
+        self.theme = theme
+        self.questions = questions
+        self.answers = answers   # буквы правильных ответов по порядку: "ABCDA"
+        self._text: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    @property
+    def questions_text(self) -> str:
+        if self._text is None:
+            self._text = "\n\n".join(q.render() for q in self.questions)
+        return self._text
+
+    @property
+    def answers_dict(self) -> Dict[int, str]:
+        return {i: letter for i, letter in enumerate(self.answers, start=1)}
+
+    def to_dict(self) -> Dict:
+        return {
+            "theme": self.theme,
+            "questions": [{"text": q.text, "options": list(q.options)} for q in self.questions],
+            "answers": self.answers,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Exam":
+        questions = tuple(
+            Question(i, q["text"], tuple(q["options"])) for i, q in enumerate(data["questions"], start=1)
+        )
+        return cls(data["theme"], questions, data["answers"])
+
+
+def _clean_line(line: str) -> str:
+    # модель иногда выделяет заголовки и номера markdown-ом: **THEME:**, ### QUESTIONS
+    return line.replace("**", "").lstrip("#").strip()
+
+
+def _parse_answers_line(value: str, line_no: int, errors: List[str]) -> Dict[int, str]:
+    answers: Dict[int, str] = {}
+    rest = _ANSWER_TOKEN_RE.sub(" ", value).replace(",", " ").replace(";", " ").strip()
+    if rest:
+        errors.append(f"строка {line_no}: непонятные символы в ANSWERS: {rest!r}")
+    for num, letter in _ANSWER_TOKEN_RE.findall(value):
+        num, letter = int(num), letter.upper()
+        if letter not in OPTIONS:
+            errors.append(f"строка {line_no}: ответ на вопрос {num} — «{letter}», а не A–D")
+        elif num in answers and answers[num] != letter:
+            errors.append(f"строка {line_no}: на вопрос {num} указано два ответа")
+        answers[num] = letter
+    return answers
+
+
+def parse_exam(exam_text: str, question_count: int = EXAM_QUESTIONS) -> Exam:
+    """
+    Разбирает ответ экзаменатора за один проход по строкам:
+
+    THEME: ...
+    ANSWERS: 1A 2B 3C 4D 5A
+    QUESTIONS:
+    1. ...
+    A) ...
+
+    Проверяет, что вопросов ровно question_count, у каждого есть текст и
+    варианты A–D, а ANSWERS даёт по одному ответу A–D на каждый вопрос.
+    Все найденные проблемы сразу выбрасываются одним ExamParseError.
+    """
+    errors: List[str] = []
+    theme = None
+    answers: Optional[Dict[int, str]] = None
+    seen_questions_header = False
+
+    questions: List[List] = []   # [номер, строки текста, {буква: строки варианта}, номер строки]
+    current_option: Optional[List[str]] = None
+
+    for line_no, raw_line in enumerate(exam_text.splitlines(), start=1):
+        line = _clean_line(raw_line)
+        if not line:
+            continue
+
+        header = _HEADER_RE.match(line)
+        if header:
+            name, value = header.group(1).upper(), header.group(2).strip()
+            if name == "THEME":
+                theme = value or theme
+                continue
+            if name == "ANSWERS":
+                if answers is not None:
+                    errors.append(f"строка {line_no}: строка ANSWERS встречается второй раз")
+                answers = _parse_answers_line(value, line_no, errors)
+                continue
+            seen_questions_header = True
+            if not value:
+                continue
+            line = value   # «QUESTIONS: 1. ...» на одной строке
+
+        if not seen_questions_header:
+            errors.append(f"строка {line_no}: текст до блока QUESTIONS: {line[:40]!r}")
+            continue
+
+        question = _QUESTION_RE.match(line)
+        option = None if question else _OPTION_RE.match(line)
+        if question:
+            questions.append([int(question.group(1)), [question.group(2).strip()], {}, line_no])
+            current_option = None
+        elif option and questions:
+            letter = option.group(1).upper()
+            options = questions[-1][2]
+            if letter in options:
+                errors.append(f"строка {line_no}: вариант {letter} у вопроса {questions[-1][0]} повторяется")
+            current_option = options[letter] = [option.group(2).strip()]
+        elif questions:
+            # продолжение текста вопроса или варианта на следующей строке
+            (current_option if current_option is not None else questions[-1][1]).append(line)
+        else:
+            errors.append(f"строка {line_no}: ожидался первый вопрос, а не {line[:40]!r}")
+
+    theme = theme or DEFAULT_THEME
+
+    if answers is None:
+        errors.append("нет строки ANSWERS")
+    if not seen_questions_header:
+        errors.append("нет блока QUESTIONS")
+
+    if seen_questions_header and len(questions) != question_count:
+        errors.append(f"вопросов {len(questions)}, а должно быть {question_count}")
+
+    parsed: List[Question] = []
+    for expected, (number, text_lines, options, line_no) in enumerate(questions, start=1):
+        if number != expected:
+            errors.append(f"строка {line_no}: вопрос номер {number}, а ожидался {expected}")
+        text = " ".join(t for t in text_lines if t)
+        if not text:
+            errors.append(f"строка {line_no}: у вопроса {number} нет текста")
+        missing = [letter for letter in OPTIONS if letter not in options]
+        if missing:
+            errors.append(f"строка {line_no}: у вопроса {number} нет вариантов {', '.join(missing)}")
+        option_texts = tuple(" ".join(options.get(letter, [])).strip() for letter in OPTIONS)
+        empty = [letter for letter, t in zip(OPTIONS, option_texts) if not t and letter in options]
+        if empty:
+            errors.append(f"строка {line_no}: у вопроса {number} пустые варианты {', '.join(empty)}")
+        parsed.append(Question(expected, text, option_texts))
+
+    if answers is not None:
+        missing = [str(i) for i in range(1, len(questions) + 1) if i not in answers]
+        extra = [str(i) for i in sorted(answers) if not 1 <= i <= len(questions)]
+        if missing:
+            errors.append(f"в ANSWERS нет ответов на вопросы {', '.join(missing)}")
+        if extra:
+            errors.append(f"в ANSWERS ответы на несуществующие вопросы {', '.join(extra)}")
+
+    if errors:
+        raise ExamParseError(errors, theme)
+
+    return Exam(theme, tuple(parsed), "".join(answers[i] for i in range(1, len(parsed) + 1)))
+
+
+def exam_from_json(data: Dict, question_count: int = EXAM_QUESTIONS) -> Exam:
+    """
+    Тест из JSON-ответа экзаменатора:
+    {"theme": "...", "questions": [{"text": "...", "options": ["...", x4], "answer": "A"}, ...]}
+    Проверки те же, что у parse_exam; проблемы — одним ExamParseError.
+    """
+    if not isinstance(data, dict):
+        raise ExamParseError(["ожидался JSON-объект"])
+
+    theme = data.get("theme")
+    theme = theme.strip() if isinstance(theme, str) and theme.strip() else DEFAULT_THEME
+    items = data.get("questions")
+    if not isinstance(items, list):
+        raise ExamParseError(["нет списка questions"], theme)
+
+    errors: List[str] = []
+    if len(items) != question_count:
+        errors.append(f"вопросов {len(items)}, а должно быть {question_count}")
+
+    questions: List[Question] = []
+    answers = []
+    for number, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            errors.append(f"вопрос {number}: ожидался объект")
+            continue
+        text = str(item.get("text") or "").strip()
+        if not text:
+            errors.append(f"вопрос {number}: нет текста")
+
+        options = item.get("options")
+        if isinstance(options, dict):
+            # {"A": "...", "B": "..."} тоже принимаем
+            options = [options.get(letter) for letter in OPTIONS]
+        if not isinstance(options, list) or len(options) != len(OPTIONS):
+            errors.append(f"вопрос {number}: нужно ровно {len(OPTIONS)} варианта A–D")
+            options = []
+        options = tuple(str(o or "").strip() for o in options)
+        empty = [letter for letter, o in zip(OPTIONS, options) if not o]
+        if empty:
+            errors.append(f"вопрос {number}: пустые варианты {', '.join(empty)}")
+
+        answer = str(item.get("answer") or "").strip().upper()[:1]
+        if answer not in OPTIONS or not answer:
+            errors.append(f"вопрос {number}: ответ «{item.get('answer')}», а не A–D")
+
+        questions.append(Question(number, text, options))
+        answers.append(answer)
+
+    if errors:
+        raise ExamParseError(errors, theme)
+
+    return Exam(theme, tuple(questions), "".join(answers))
+
+
+def _benchmark(repeat: int = 20000) -> None:
+    sample = (
+        "THEME: Планеты Солнечной системы\n"
+        "ANSWERS: 1A 2B 3C 4D 5A\n\n"
+        "QUESTIONS:\n"
+        + "\n\n".join(
+            f"{i}. Какая планета {i}-я от Солнца?\nA) Меркурий\nB) Венера\nC) Земля\nD) Марс"
+            for i in range(1, 6)
+        )
+    )
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        exam = parse_exam(sample)
+    parse_us = (time.perf_counter() - started) / repeat * 1e6
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        Exam(exam.theme, exam.questions, exam.answers).questions_text
+    render_us = (time.perf_counter() - started) / repeat * 1e6
+
+    print(f"parse_exam: {parse_us:.1f} мкс на тест, первый questions_text: {render_us:.1f} мкс")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,158 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+EXAM_BANK_PATH = os.getenv("LUMIRA_EXAM_BANK", "exam_bank.sqlite3")
+
+# Сколько раз один и тот же тест можно выдать разным ученикам,
+# прежде чем он уйдёт на покой и тема получит свежий тест
+MAX_SERVES_PER_EXAM = int(os.getenv("LUMIRA_EXAM_MAX_SERVES", "30"))
+
+
+def _topic_key(topic_id: int) -> str:
+    # темы приходят уже канонизированными через utils.topic_index
+    return str(topic_id)
+
+
+class ExamBank:
+    """
+    Локальный банк уже сгенерированных тестов (SQLite), ключ — id темы из TopicIndex.
+
+    - pick() отдаёт тест по теме, который этот ученик ещё не видел
+      (сначала наименее выдававшиеся, среди равных — случайный);
+    - тест, выданный MAX_SERVES_PER_EXAM раз, больше не выдаётся;
+    - если подходящих тестов нет — тема «исчерпана», и нужно сгенерировать новый через add().
+    """
+
+    def __init__(self, path: str = EXAM_BANK_PATH, max_serves: int = MAX_SERVES_PER_EXAM):
+        self.path = path
+        self.max_serves = max_serves
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS exams (
+                id          INTEGER PRIMARY KEY,
+                topic_key   TEXT NOT NULL,
+                theme       TEXT NOT NULL,
+                raw         TEXT NOT NULL,
+                questions   TEXT NOT NULL,
+                answers     TEXT NOT NULL,
+                created     REAL NOT NULL,
+                serves      INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS exams_topic ON exams (topic_key, serves);
+
+            CREATE TABLE IF NOT EXISTS served (
+                student     TEXT NOT NULL,
+                exam_id     INTEGER NOT NULL,
+                ts          REAL NOT NULL,
+                PRIMARY KEY (student, exam_id)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def pick(self, topic_id: int, student: str) -> Optional[Tuple[int, str, Dict[int, str], str]]:
+        """
+        Возвращает (exam_id, questions_text, answers_dict, theme) или None, если тема исчерпана.
+        Тест сразу помечается выданным этому ученику.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, questions, answers, theme, serves FROM exams
+                WHERE topic_key = ? AND serves < ?
+                  AND id NOT IN (SELECT exam_id FROM served WHERE student = ?)
+                ORDER BY serves
+                LIMIT 8
+                """,
+                (_topic_key(topic_id), self.max_serves, student),
+            ).fetchall()
+            if not rows:
+                return None
+
+            least_served = rows[0][4]
+            exam_id, questions, answers, theme, _ = random.choice(
+                [row for row in rows if row[4] == least_served]
+            )
+            self._mark_served(exam_id, student)
+
+        answers_dict = {int(k): v for k, v in json.loads(answers).items()}
+        return exam_id, questions, answers_dict, theme
+
+    def has_unseen(self, topic_id: int, student: str) -> bool:
+        """
+        Есть ли в банке тест по теме, который можно выдать ученику (без пометки «выдан»).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT 1 FROM exams
+                WHERE topic_key = ? AND serves < ?
+                  AND id NOT IN (SELECT exam_id FROM served WHERE student = ?)
+                LIMIT 1
+                """,
+                (_topic_key(topic_id), self.max_serves, student),
+            ).fetchone()
+        return row is not None
+
+    def add(
+        self,
+        topic_id: int,
+        raw: str,
+        questions_text: str,
+        answers_dict: Dict[int, str],
+        theme: str,
+        student: Optional[str] = None,
+    ) -> int:
+        """
+        Сохраняет новый тест по теме. Если указан student — тест сразу считается выданным ему.
+        Тот же самый тест (например, один ответ модели на склеенные запросы
+        нескольких учеников) второй раз не сохраняется — возвращается id уже сохранённого.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM exams WHERE topic_key = ? AND raw = ?", (_topic_key(topic_id), raw)
+            ).fetchone()
+            if row is not None:
+                exam_id = row[0]
+            else:
+                cur = self._conn.execute(
+                    "INSERT INTO exams (topic_key, theme, raw, questions, answers, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    (_topic_key(topic_id), theme, raw, questions_text, json.dumps(answers_dict), time.time()),
+                )
+                exam_id = cur.lastrowid
+            if student is not None:
+                self._mark_served(exam_id, student)
+            else:
+                self._conn.commit()
+        return exam_id
+
+    def mark_served(self, exam_id: int, student: str) -> None:
+        with self._lock:
+            self._mark_served(exam_id, student)
+
+    def _mark_served(self, exam_id: int, student: str) -> None:
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO served (student, exam_id, ts) VALUES (?, ?, ?)",
+            (student, exam_id, time.time()),
+        )
+        if cur.rowcount:
+            self._conn.execute("UPDATE exams SET serves = serves + 1 WHERE id = ?", (exam_id,))
+        self._conn.commit()
+
+    def count(self, topic_id: int) -> int:
+        with self._lock:
+            (n,) = self._conn.execute(
+                "SELECT COUNT(*) FROM exams WHERE topic_key = ?", (_topic_key(topic_id),)
+            ).fetchone()
+        return n
+
+    def close(self) -> None:
+        self._conn.close()
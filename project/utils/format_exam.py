@@ -1,6 +1,7 @@
-import re
 from typing import Tuple, Dict
 
+from utils.exam import ExamParseError, parse_exam
+
 
 def format_exam(exam_text: str) -> Tuple[str, Dict[int, str], str]:
     """
@@ -18,39 +19,13 @@ def format_exam(exam_text: str) -> Tuple[str, Dict[int, str], str]:
       1) questions_text — только блок вопросов (для показа пользователю)
       2) answers_dict   — словарь {номер: буква}
       3) theme          — строка с темой теста
+
+    Разбор и проверка — utils.exam.parse_exam. Если тест не прошёл проверку,
+    вместо вопросов возвращается текст ошибки, а answers_dict пустой.
     """
+    try:
+        exam = parse_exam(exam_text)
+    except ExamParseError as e:
+        return "Ошибка: экзаменатор выдал некорректный тест (" + str(e) + ").", {}, e.theme
 
-    # --- 1. ТЕМА ---
-    theme_match = re.search(r"THEME:\s*(.+)", exam_text)
-    if theme_match:
-        theme = theme_match.group(1).strip()
-    else:
-        theme = "(не удалось определить тему)"
-
-    # --- 2. ОТВЕТЫ ---
-    answers_match = re.search(r"ANSWERS:\s*(.+)", exam_text)
-    if not answers_match:
-        return "Ошибка: экзаменатор не выдал строку ANSWERS.", {}, theme
-
-    answers_str = answers_match.group(1).strip()
-
-    answers_dict: Dict[int, str] = {}
-    for pair in answers_str.split():
-        # ожидаем формат типа '1A'
-        if len(pair) < 2:
-            continue
-        try:
-            num = int(pair[:-1])
-            letter = pair[-1].upper()
-            answers_dict[num] = letter
-        except ValueError:
-            continue
-
-    # --- 3. ВОПРОСЫ ---
-    questions_match = re.search(r"QUESTIONS:\s*(.+)", exam_text, re.DOTALL)
-    if not questions_match:
-        return "Ошибка: нет блока QUESTIONS.", {}, theme
-
-    questions_text = questions_match.group(1).strip()
-
-    return questions_text, answers_dict, theme
+    return exam.questions_text, exam.answers_dict, exam.theme
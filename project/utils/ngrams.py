@@ -0,0 +1,76 @@
+import re
+import zlib
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+
+
+_SPACES_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нижний регистр, ё → е, без пунктуации и лишних пробелов.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+# Слова-«обёртки» вопроса, которые не меняют его смысла:
+# «что такое интеграл» и «объясни интеграл» — один и тот же вопрос
+FILLER_WORDS = {
+    "что", "такое", "объясни", "объясните", "расскажи", "расскажите", "поясни",
+    "про", "о", "об", "мне", "пожалуйста", "это", "а", "ну", "можешь", "можно",
+    "what", "is", "are", "explain", "tell", "me", "about", "please", "the", "a", "an",
+}
+
+
+def strip_fillers(text: str) -> str:
+    """
+    Нормализованный текст без слов-обёрток (если после чистки что-то осталось).
+    """
+    words = normalize_text(text).split()
+    content = [w for w in words if w not in FILLER_WORDS]
+    return " ".join(content or words)
+
+
+def char_ngrams(text: str, n_min: int = 2, n_max: int = 4) -> List[str]:
+    """
+    Символьные n-граммы нормализованного текста (с пробелами по краям,
+    чтобы начало и конец слова тоже были признаками).
+    """
+    padded = f" {normalize_text(text)} "
+    grams = []
+    for n in range(n_min, n_max + 1):
+        for i in range(len(padded) - n + 1):
+            grams.append(padded[i:i + n])
+    return grams
+
+
+def hashed_features(text: str, dim: int, n_min: int = 2, n_max: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Разреженный вектор признаков текста: (индексы, веса).
+    Индекс n-граммы — crc32 по модулю dim (стабилен между запусками, в отличие от hash()),
+    вес — 1 + log(tf), вектор нормирован по L2.
+    """
+    counts = Counter(zlib.crc32(g.encode("utf-8")) % dim for g in char_ngrams(text, n_min, n_max))
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    values /= np.linalg.norm(values)
+    return indices, values.astype(np.float32)
+
+
+def dense_features(text: str, dim: int, n_min: int = 2, n_max: int = 4) -> np.ndarray:
+    """
+    То же, что hashed_features, но плотным вектором длины dim.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    indices, values = hashed_features(text, dim, n_min, n_max)
+    vec[indices] = values
+    return vec
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+# Сколько фоновых генераций одновременно допускается на процесс (0 — выключено)
+PREFETCH_MAX_CONCURRENT = int(os.getenv("LUMIRA_PREFETCH_MAX", "8"))
+
+# Сколько секунд заранее подготовленный результат считается актуальным
+PREFETCH_TTL = float(os.getenv("LUMIRA_PREFETCH_TTL", "600"))
+
+
+class Prefetcher:
+    """
+    Фоновая подготовка результата «на будущее», по одной задаче на сессию.
+
+    schedule() запускает генерацию для (сессия, тема), если лимит параллельных
+    задач не исчерпан; take() отдаёт готовый (или ещё идущий) результат, если тема
+    совпала и он не старше ttl. Смена темы или конец сессии отменяют задачу.
+    """
+
+    def __init__(self, max_concurrent: int = PREFETCH_MAX_CONCURRENT, ttl: float = PREFETCH_TTL):
+        self.max_concurrent = max_concurrent
+        self.ttl = ttl
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"scheduled": 0, "skipped": 0, "served": 0, "expired": 0, "cancelled": 0}
+
+    def _running(self) -> int:
+        return sum(1 for e in self._entries.values() if not e["task"].done())
+
+    def schedule(self, session_id: str, topic: Hashable, factory: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Запускает factory() в фоне для темы topic. Если для этой темы задача
+        уже есть и не устарела — ничего не делает.
+        """
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            if entry["topic"] == topic and time.monotonic() - entry["created"] <= self.ttl:
+                return
+            self.cancel(session_id)
+
+        if self._running() >= self.max_concurrent:
+            self.stats["skipped"] += 1
+            return
+
+        task = asyncio.create_task(factory())
+        task.add_done_callback(_consume_exception)
+        self._entries[session_id] = {"topic": topic, "task": task, "created": time.monotonic()}
+        self.stats["scheduled"] += 1
+
+    async def take(self, session_id: str, topic: Hashable) -> Optional[Any]:
+        """
+        Забирает результат для (сессия, тема). None — нечего отдать
+        (не было задачи, другая тема, устарел или генерация упала).
+        """
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return None
+
+        task = entry["task"]
+        if entry["topic"] != topic:
+            task.cancel()
+            self.stats["cancelled"] += 1
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            task.cancel()
+            self.stats["expired"] += 1
+            return None
+
+        if task.cancelled():
+            return None
+        try:
+            # если генерация ещё идёт — дождаться её всё равно быстрее, чем начинать заново;
+            # shield — чтобы отмена реплики не выбросила почти готовый результат
+            result = await asyncio.shield(task)
+        except Exception:
+            return None
+
+        self.stats["served"] += 1
+        return result
+
+    def cancel(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None and not entry["task"].done():
+            entry["task"].cancel()
+            self.stats["cancelled"] += 1
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    # ошибка фоновой генерации не должна всплывать в лог как «never retrieved»
+    if not task.cancelled():
+        task.exception()
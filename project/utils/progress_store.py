@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+PROGRESS_DB_PATH = os.getenv("LUMIRA_PROGRESS_DB", "progress.sqlite3")
+
+# topic_id строки с итогами по всем темам сразу
+ALL_TOPICS = -1
+
+
+def _percent(correct: int, questions: int) -> int:
+    return int(correct / questions * 100) if questions > 0 else 0
+
+
+def _totals_dict(row) -> Dict:
+    topic_id, topic, tests, correct, questions, last_ts = row
+    return {
+        "topic_id": None if topic_id == ALL_TOPICS else topic_id,
+        "topic": topic,
+        "tests": tests,
+        "correct": correct,
+        "questions": questions,
+        "percent": _percent(correct, questions),
+        "last_ts": last_ts,
+    }
+
+
+class ProgressStore:
+    """
+    Журнал результатов тестов (SQLite, только дописывание) с готовыми итогами.
+
+    Каждый record() в одной транзакции дописывает строку в results и
+    прибавляет её к итогам ученика — по теме и по всем темам (topic_id = ALL_TOPICS).
+    Поэтому summary() читает одну строку, by_topic() — по строке на тему,
+    а полная история нужна только для отчётов за период (results()).
+    """
+
+    def __init__(self, path: str = PROGRESS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id          INTEGER PRIMARY KEY,
+                student     TEXT NOT NULL,
+                topic_id    INTEGER,
+                topic       TEXT,
+                score       INTEGER NOT NULL,
+                total       INTEGER NOT NULL,
+                answers     TEXT NOT NULL,
+                ts          REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_student_ts ON results (student, ts);
+            CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+
+            CREATE TABLE IF NOT EXISTS totals (
+                student     TEXT NOT NULL,
+                topic_id    INTEGER NOT NULL,
+                topic       TEXT,
+                tests       INTEGER NOT NULL,
+                correct     INTEGER NOT NULL,
+                questions   INTEGER NOT NULL,
+                last_ts     REAL NOT NULL,
+                PRIMARY KEY (student, topic_id)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def record(
+        self,
+        student: str,
+        topic_id: Optional[int],
+        topic: Optional[str],
+        score: int,
+        total: int,
+        answers: str = "",
+        ts: Optional[float] = None,
+    ) -> None:
+        ts = time.time() if ts is None else ts
+        topic_key = ALL_TOPICS if topic_id is None else topic_id
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO results (student, topic_id, topic, score, total, answers, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (student, topic_id, topic, score, total, answers, ts),
+            )
+            # без темы результат попадает только в общий итог
+            keys = {topic_key, ALL_TOPICS}
+            for key in keys:
+                self._conn.execute(
+                    """
+                    INSERT INTO totals (student, topic_id, topic, tests, correct, questions, last_ts)
+                    VALUES (?, ?, ?, 1, ?, ?, ?)
+                    ON CONFLICT (student, topic_id) DO UPDATE SET
+                        topic     = COALESCE(excluded.topic, topic),
+                        tests     = tests + 1,
+                        correct   = correct + excluded.correct,
+                        questions = questions + excluded.questions,
+                        last_ts   = MAX(last_ts, excluded.last_ts)
+                    """,
+                    (student, key, None if key == ALL_TOPICS else topic, score, total, ts),
+                )
+
+    def summary(self, student: str) -> Dict:
+        """
+        Итог ученика по всем темам: tests, correct, questions, percent, last_ts.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT topic_id, topic, tests, correct, questions, last_ts FROM totals WHERE student = ? AND topic_id = ?",
+                (student, ALL_TOPICS),
+            ).fetchone()
+        if row is None:
+            return _totals_dict((ALL_TOPICS, None, 0, 0, 0, None))
+        return _totals_dict(row)
+
+    def by_topic(self, student: str) -> List[Dict]:
+        """
+        Итоги ученика по каждой теме, в порядке последнего теста.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT topic_id, topic, tests, correct, questions, last_ts FROM totals
+                WHERE student = ? AND topic_id != ?
+                ORDER BY last_ts
+                """,
+                (student, ALL_TOPICS),
+            ).fetchall()
+        return [_totals_dict(row) for row in rows]
+
+    def class_summary(self, students: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+        """
+        Общие итоги сразу для нескольких учеников (по умолчанию — для всех).
+        """
+        query = "SELECT student, topic_id, topic, tests, correct, questions, last_ts FROM totals WHERE topic_id = ?"
+        params: List = [ALL_TOPICS]
+        if students is not None:
+            students = list(students)
+            query += f" AND student IN ({', '.join('?' * len(students))})"
+            params += students
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {row[0]: _totals_dict(row[1:]) for row in rows}
+
+    def results(
+        self,
+        student: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+    ) -> List[Dict]:
+        """
+        Отдельные результаты за период [since, until) — для отчётов.
+        Без student — по всем ученикам.
+        """
+        conditions, params = [], []
+        if student is not None:
+            conditions.append("student = ?")
+            params.append(student)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+
+        query = "SELECT student, topic_id, topic, score, total, answers, ts FROM results"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY ts DESC" if newest_first else " ORDER BY ts"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {
+                "student": student_,
+                "topic_id": topic_id,
+                "topic": topic,
+                "score": score,
+                "total": total,
+                "percent": _percent(score, total),
+                "answers": answers,
+                "ts": ts,
+            }
+            for student_, topic_id, topic, score, total, answers, ts in rows
+        ]
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,187 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from utils.ngrams import char_ngrams, strip_fillers
+
+
+TOPIC_INDEX_PATH = os.getenv("LUMIRA_TOPIC_INDEX", "topics.sqlite3")
+
+# Минимальное сходство (коэффициент Дайса по символьным триграммам),
+# при котором текст считается написанием уже известной темы. Окончания уже
+# отрезаны, поэтому порог высокий: «синус» и «косинус» (0.67), «второй» и
+# «третий закон Ньютона» (0.69) — разные темы
+TOPIC_MATCH_THRESHOLD = float(os.getenv("LUMIRA_TOPIC_THRESHOLD", "0.75"))
+
+
+# Слова просьбы о тесте: «сделай тест по производным» — это тема «производным».
+# Без них все такие просьбы похожи друг на друга сильнее, чем на свои темы
+REQUEST_WORDS = {
+    "сделай", "сделайте", "составь", "составьте", "дай", "дайте", "давай", "хочу", "нужен", "нужна",
+    "проверь", "проверка", "по", "на", "тему", "теме", "для", "меня", "еще", "новый", "небольшой",
+    "тест", "теста", "тесты", "тестик", "викторину", "викторина", "вопросы",
+    "make", "give", "create", "generate", "i", "want", "let's", "lets", "do", "on", "of", "some", "new",
+    "test", "tests", "quiz", "questions",
+}
+
+
+# Падежные окончания: «производная», «по производным» — одна тема
+_ENDING_RE = re.compile(
+    r"(ами|ями|ого|его|ому|ему|ыми|ими|ая|яя|ое|ее|ые|ие|ый|ий|ой|ей|ым|им|ых|их|ом|ем|ам|ям|ах|ях|ов|ев|"
+    r"ую|юю|ия|ию|ы|и|а|я|о|е|у|ю|ь|й)$"
+)
+
+
+def _stem(word: str) -> str:
+    return _ENDING_RE.sub("", word) if len(word) > 4 else word
+
+
+def topic_key(text: str) -> str:
+    """
+    Нормализованный текст темы: без регистра, пунктуации, слов-обёрток,
+    слов просьбы о тесте и падежных окончаний.
+    """
+    words = strip_fillers(text).split()
+    content = [w for w in words if w not in REQUEST_WORDS]
+    return " ".join(_stem(w) for w in content or words)
+
+
+def _trigrams(key: str) -> FrozenSet[str]:
+    return frozenset(char_ngrams(key, 3, 3))
+
+
+class TopicIndex:
+    """
+    Справочник тем: свободный текст запроса или THEME экзаменатора → id темы.
+
+    Каждая тема хранит несколько написаний (aliases). Поиск — точное совпадение
+    нормализованного текста, иначе инвертированный индекс «триграмма → написания»
+    и коэффициент Дайса; если ничего достаточно похожего нет — заводится новая тема.
+    Написание, слова которого — часть слов другого («законы Ньютона» и «второй закон
+    Ньютона»), — общая тема и частная: совпасть они могут только точно.
+    Всё хранится в SQLite и поднимается в память при старте, новые темы и
+    написания добавляются по одной.
+
+    >>> index = TopicIndex(":memory:")
+    >>> index.resolve("второй закон Ньютона") == index.resolve("Законы Ньютона")
+    False
+    >>> index.resolve("Сделай тест по производным") == index.resolve("что такое производная")
+    True
+    """
+
+    def __init__(self, path: str = TOPIC_INDEX_PATH, threshold: float = TOPIC_MATCH_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS topics (
+                id          INTEGER PRIMARY KEY,
+                label       TEXT NOT NULL,
+                created     REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS aliases (
+                alias_key   TEXT PRIMARY KEY,
+                topic_id    INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+        self._labels: Dict[int, str] = {}
+        self._by_key: Dict[str, int] = {}
+        self._aliases: List[Tuple[int, FrozenSet[str], FrozenSet[str]]] = []   # (topic_id, триграммы, слова)
+        self._postings: Dict[str, List[int]] = defaultdict(list)  # триграмма → номера написаний
+
+        for topic_id, label in self._conn.execute("SELECT id, label FROM topics"):
+            self._labels[topic_id] = label
+        for key, topic_id in self._conn.execute("SELECT alias_key, topic_id FROM aliases"):
+            self._index_alias(key, topic_id)
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _index_alias(self, key: str, topic_id: int) -> None:
+        grams = _trigrams(key)
+        alias_no = len(self._aliases)
+        self._aliases.append((topic_id, grams, frozenset(key.split())))
+        self._by_key[key] = topic_id
+        for gram in grams:
+            self._postings[gram].append(alias_no)
+
+    def _find(self, key: str) -> Optional[int]:
+        topic_id = self._by_key.get(key)
+        if topic_id is not None:
+            return topic_id
+
+        grams = _trigrams(key)
+        words = frozenset(key.split())
+        overlap: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for alias_no in self._postings.get(gram, ()):
+                overlap[alias_no] += 1
+        if not overlap:
+            return None
+
+        best_no, best_score = None, 0.0
+        for alias_no, common in overlap.items():
+            alias_words = self._aliases[alias_no][2]
+            if words < alias_words or alias_words < words:
+                # общая тема и частная — не одно и то же
+                continue
+            score = 2.0 * common / (len(grams) + len(self._aliases[alias_no][1]))
+            if score > best_score:
+                best_no, best_score = alias_no, score
+        if best_score < self.threshold:
+            return None
+        return self._aliases[best_no][0]
+
+    def _add_alias(self, key: str, topic_id: int) -> None:
+        if key in self._by_key:
+            return
+        self._conn.execute("INSERT OR IGNORE INTO aliases (alias_key, topic_id) VALUES (?, ?)", (key, topic_id))
+        self._index_alias(key, topic_id)
+
+    def match(self, text: str) -> Optional[int]:
+        """
+        id известной темы, на которую похож текст, или None. Ничего не добавляет.
+        """
+        key = topic_key(text)
+        if not key:
+            return None
+        with self._lock:
+            return self._find(key)
+
+    def resolve(self, text: str, default: Optional[int] = None) -> Optional[int]:
+        """
+        id темы для текста. Если похожей темы нет — текст становится новым
+        написанием темы default, а без default — новой темой.
+        Новое написание известной темы тоже запоминается, чтобы в следующий раз
+        находиться точным совпадением.
+        """
+        key = topic_key(text)
+        if not key:
+            return default
+
+        with self._lock:
+            topic_id = self._find(key)
+            if topic_id is None:
+                topic_id = default
+            if topic_id is None:
+                cur = self._conn.execute(
+                    "INSERT INTO topics (label, created) VALUES (?, ?)", (text.strip(), time.time())
+                )
+                topic_id = cur.lastrowid
+                self._labels[topic_id] = text.strip()
+            self._add_alias(key, topic_id)
+            self._conn.commit()
+        return topic_id
+
+    def close(self) -> None:
+        self._conn.close()